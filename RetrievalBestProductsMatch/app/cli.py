@@ -0,0 +1,424 @@
+# app/cli.py
+"""
+CLI offline del paquete. Uso (desde RetrievalBestProductsMatch/):
+
+    python -m app.cli build-index --workers 4 --batch-size 64
+    python -m app.cli convert-index --index-type hnsw --out data/faiss_hnsw.index
+    python -m app.cli export-onnx
+    python -m app.cli onnx-parity --limit 200
+    python -m app.cli eval --out results/baseline.json
+    python -m app.cli compare results/baseline.json results/hnsw.json
+    python -m app.cli serve --workers 4 --threads-per-worker 2
+    python -m app.cli loadtest --mix search=0.8,rag=0.2 --concurrency 16 --duration 60 --fake-llm
+"""
+import argparse
+import json
+import logging
+import os
+
+from app.config import settings
+from app.logger import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def _cmd_build_index(args):
+    from app.utils.index_builder import build_index_offline
+
+    manifest = build_index_offline(
+        product_csv=args.product_csv,
+        index_path=args.index_path,
+        store_dir=args.store_dir,
+        embeddings_path=args.embeddings,
+        manifest_path=args.manifest,
+        model_name=args.model,
+        index_params={
+            "index_type": args.index_type,
+            "nlist": args.nlist,
+            "pq_m": args.pq_m,
+            "pq_nbits": args.pq_nbits,
+            "hnsw_m": args.hnsw_m,
+            "ef_construction": args.ef_construction,
+            "train_size": settings.INDEX_TRAIN_SIZE,
+        },
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        resume=not args.no_resume,
+        lexical_path="" if args.no_lexical else args.lexical_index,
+        bm25_k1=settings.BM25_K1,
+        bm25_b=settings.BM25_B,
+    )
+    logger.info("Build done: %s", manifest)
+
+
+def _add_index_type_args(p: argparse.ArgumentParser):
+    p.add_argument("--index-type", default=settings.INDEX_TYPE)
+    p.add_argument("--nlist", type=int, default=settings.IVF_NLIST)
+    p.add_argument("--pq-m", type=int, default=settings.PQ_M)
+    p.add_argument("--pq-nbits", type=int, default=settings.PQ_NBITS)
+    p.add_argument("--hnsw-m", type=int, default=settings.HNSW_M)
+    p.add_argument("--ef-construction", type=int, default=settings.HNSW_EF_CONSTRUCTION)
+
+
+def _cmd_convert_index(args):
+    import faiss
+    import numpy as np
+    from app.models.index_factory import build_index, describe
+
+    if args.embeddings and os.path.exists(args.embeddings):
+        vectors = np.load(args.embeddings, mmap_mode='r')
+    else:
+        # el IndexFlatIP del notebook guarda los vectores originales: se pueden reconstruir
+        src = faiss.read_index(args.src)
+        logger.info("Reconstructing vectors from %s (%s)", args.src, describe(src))
+        vectors = src.reconstruct_n(0, src.ntotal)
+        if args.save_embeddings:
+            np.save(args.save_embeddings, vectors)
+            logger.info("Embeddings saved to %s", args.save_embeddings)
+
+    index = build_index(
+        vectors,
+        index_type=args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        pq_nbits=args.pq_nbits,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        train_size=settings.INDEX_TRAIN_SIZE,
+    )
+    faiss.write_index(index, args.out)
+    logger.info("Index written to %s (%s)", args.out, describe(index))
+
+
+def _retriever_from_settings(**overrides):
+    """Retriever configurado como en main.py (sin cache de embeddings); overrides sobreescribe kwargs."""
+    from app.models.retriever import Retriever
+
+    kwargs = dict(
+        encode_batch_size=settings.EMBED_BATCH_SIZE,
+        product_store_dir=settings.PRODUCT_STORE_DIR,
+        nprobe=settings.FAISS_NPROBE,
+        ef_search=settings.FAISS_EF_SEARCH,
+        exact_rescore=settings.EXACT_RESCORE,
+        rescore_factor=settings.RESCORE_FACTOR,
+        embeddings_path=settings.EMBEDDINGS_PATH,
+        manifest_path=settings.MANIFEST_PATH,
+        retrieval_mode=settings.RETRIEVAL_MODE,
+        lexical_index_path=settings.LEXICAL_INDEX_PATH,
+        lexical_build_on_load=settings.LEXICAL_BUILD_ON_LOAD,
+        rrf_k=settings.RRF_K,
+        inference_backend=settings.INFERENCE_BACKEND,
+        onnx_dir=settings.ONNX_DIR,
+        onnx_quantize=settings.ONNX_QUANTIZE,
+        onnx_threads=settings.ONNX_INTRA_OP_THREADS,
+    )
+    kwargs.update(overrides)
+    return Retriever(settings.FAISS_INDEX_PATH, settings.PRODUCT_CSV, settings.EMBED_MODEL, **kwargs)
+
+
+def _reranker_from_settings(**overrides):
+    from app.models.reranker import Reranker
+
+    kwargs = dict(
+        batch_size=settings.RERANK_BATCH_SIZE,
+        inference_backend=settings.INFERENCE_BACKEND,
+        onnx_dir=settings.ONNX_DIR,
+        onnx_quantize=settings.ONNX_QUANTIZE,
+        onnx_threads=settings.ONNX_INTRA_OP_THREADS,
+        cascade=settings.RERANK_CASCADE,
+        cascade_batch_size=settings.RERANK_CASCADE_BATCH,
+        cascade_margin=settings.RERANK_CASCADE_MARGIN,
+        cascade_model_name=settings.RERANK_CASCADE_MODEL,
+    )
+    kwargs.update(overrides)
+    return Reranker(settings.RERANKER_MODEL, **kwargs)
+
+
+def _cmd_eval(args):
+    from app.models.benchmark import load_queries, run_benchmark
+    from app.utils.evaluation import Qrels
+
+    backend = {"inference_backend": args.backend} if args.backend else {}
+    retriever = _retriever_from_settings(encode_batch_size=args.batch_size,
+                                         exact_rescore=args.exact_rescore or settings.EXACT_RESCORE, **backend)
+    if args.index:
+        retriever.index_path = args.index
+    retriever.load()
+    reranker = None
+    if not args.no_rerank:
+        cascade = {key: value for key, value in (("cascade", args.cascade or None),
+                                                 ("cascade_margin", args.cascade_margin),
+                                                 ("cascade_batch_size", args.cascade_batch)) if value is not None}
+        reranker = _reranker_from_settings(**backend, **cascade)
+        reranker.load()
+
+    results = run_benchmark(
+        retriever, reranker,
+        queries=load_queries(args.queries, limit=args.limit),
+        qrels=Qrels.from_csv(args.labels, exact_w=args.exact_w, partial_w=args.partial_w),
+        top_k=args.top_k, top_m=args.top_m, k=args.k, batch_size=args.batch_size, mode=args.mode,
+        warmup_batches=args.warmup, n_boot=args.n_boot, seed=args.seed,
+        nprobe=args.nprobe, ef_search=args.ef_search,
+    )
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info("Results written to %s", args.out)
+    print(json.dumps({key: results[key] for key in ("config", "quality", "latency", "throughput_qps",
+                                                    "rerank_pairs", "significance") if key in results}, indent=2))
+
+
+def _cmd_compare(args):
+    from app.models.benchmark import compare_runs
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(json.dumps(compare_runs(baseline, candidate, n_boot=args.n_boot, seed=args.seed), indent=2))
+
+
+def _cmd_loadtest(args):
+    import asyncio
+    import time
+    from app.utils.cache import read_query_log
+    from app.utils import loadtest
+
+    mix = loadtest.parse_mix(args.mix)
+    queries = read_query_log(args.queries, limit=args.query_limit)
+    payload = {"top_k": args.top_k, "rerank_m": args.rerank_m}
+    llm_overrides = {}
+    if args.fake_llm:
+        llm_overrides = {
+            "LLM_BACKEND": "fake",
+            "FAKE_LLM_FIRST_TOKEN_MS": args.fake_first_token_ms,
+            "FAKE_LLM_TOKENS_PER_S": args.fake_tokens_per_s,
+            "FAKE_LLM_OUTPUT_TOKENS": args.fake_output_tokens,
+        }
+
+    async def run(client, alive=None):
+        ready = await loadtest.wait_ready(client, need_llm=any(e != "search" for e in mix), alive=alive)
+        if args.warmup:
+            await loadtest.run_closed_loop(client, loadtest.workload(queries, mix, n=args.warmup, seed=args.seed + 1,
+                                                                     **payload),
+                                           concurrency=args.concurrency, timeout_s=args.timeout)
+        n = args.requests or (0 if args.duration else 200)
+        requests = loadtest.workload(queries, mix, n=n, seed=args.seed, **payload)
+        t0 = time.perf_counter()
+        if args.rate > 0:
+            records = await loadtest.run_open_loop(client, requests, rate=args.rate, duration_s=args.duration,
+                                                   timeout_s=args.timeout, max_inflight=args.max_inflight,
+                                                   seed=args.seed)
+        else:
+            records = await loadtest.run_closed_loop(client, requests, concurrency=args.concurrency,
+                                                     duration_s=args.duration, timeout_s=args.timeout)
+        wall_s = time.perf_counter() - t0
+        return {
+            "config": {key: v for key, v in vars(args).items() if key != "func"},
+            "mix": mix,
+            "components": ready.get("components"),
+            "wall_s": wall_s,
+            "results": loadtest.summarize(records, wall_s),
+        }
+
+    async def run_against_target():
+        if args.url:
+            async with loadtest.http_client(args.url) as client:
+                return await run(client)
+        if args.uvicorn:
+            env = {key: str(v) for key, v in llm_overrides.items()}
+            with loadtest.uvicorn_server(port=args.port, workers=args.workers, env=env) as (base_url, proc):
+                async with loadtest.http_client(base_url) as client:
+                    return await run(client, alive=lambda: proc.poll() is None)
+        # en proceso: main lee settings al importarse, así que los overrides van antes del import
+        for key, value in llm_overrides.items():
+            setattr(settings, key, value)
+        import main as service
+        async with loadtest.inprocess_client(service.app) as client:
+            return await run(client)
+
+    report = asyncio.run(run_against_target())
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info("Load test report written to %s", args.out)
+    print(json.dumps(report["results"], indent=2))
+
+
+def _cmd_serve(args):
+    from app.utils.prefork import PreforkServer, set_worker_threads
+    import main as service
+
+    server = PreforkServer(
+        service.app, host=args.host, port=args.port, workers=args.workers,
+        preload=None if args.no_preload else service.load_components,
+        child_init=lambda worker_id: set_worker_threads(args.threads_per_worker),
+        memory_report_s=args.memory_report_interval, log_level=args.log_level,
+    )
+    server.run()
+
+
+def _cmd_export_onnx(args):
+    from app.models.onnx_backend import export_model, model_dir
+
+    for model_name, kind in ((args.embed_model, "embedder"), (args.reranker_model, "cross_encoder")):
+        out = export_model(model_name, kind, model_dir(args.onnx_dir, model_name), quantize=not args.no_quantize)
+        logger.info("%s -> %s", model_name, out)
+
+
+def _cmd_onnx_parity(args):
+    from sentence_transformers import CrossEncoder
+    from app.models.onnx_backend import load_onnx_model, parity_report
+    from app.utils.cache import read_query_log
+
+    retriever = _retriever_from_settings(inference_backend="torch")
+    retriever.load()
+    queries = read_query_log(args.queries, limit=args.limit)
+    candidates = retriever.retrieve_batch(queries, top_k=args.top_k)
+    texts = [retriever.store.rerank_texts(idxs) for idxs, _ in candidates]
+    quantize = not args.no_quantize
+    report = parity_report(
+        queries, texts,
+        ref_encoder=retriever.embedding_model,
+        new_encoder=load_onnx_model(settings.EMBED_MODEL, "embedder", args.onnx_dir, quantize=quantize,
+                                    intra_op_threads=args.threads),
+        ref_reranker=CrossEncoder(settings.RERANKER_MODEL),
+        new_reranker=load_onnx_model(settings.RERANKER_MODEL, "cross_encoder", args.onnx_dir, quantize=quantize,
+                                     intra_op_threads=args.threads),
+        k=args.k,
+    )
+    print(json.dumps(report, indent=2))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build-index", help="product.csv -> product store + embeddings + índice FAISS + manifest")
+    p.add_argument("--product-csv", default=settings.PRODUCT_CSV)
+    p.add_argument("--index-path", default=settings.FAISS_INDEX_PATH)
+    p.add_argument("--store-dir", default=settings.PRODUCT_STORE_DIR)
+    p.add_argument("--embeddings", default=settings.EMBEDDINGS_PATH, help="checkpoint .npy memory-mapped")
+    p.add_argument("--manifest", default=settings.MANIFEST_PATH)
+    p.add_argument("--model", default=settings.EMBED_MODEL)
+    p.add_argument("--chunk-size", type=int, default=10000, help="filas del CSV por chunk")
+    p.add_argument("--batch-size", type=int, default=64, help="batch de encode dentro de cada chunk")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                   help="procesos CPU de encode (0 = en el proceso actual)")
+    p.add_argument("--threads-per-worker", type=int, default=0, help="torch threads por proceso (0 = por defecto)")
+    p.add_argument("--no-resume", action="store_true", help="ignorar checkpoint previo")
+    p.add_argument("--lexical-index", default=settings.LEXICAL_INDEX_PATH, help="índice BM25 (.npz) para modo lexical/hybrid")
+    p.add_argument("--no-lexical", action="store_true", help="no construir el índice BM25")
+    _add_index_type_args(p)
+    p.set_defaults(func=_cmd_build_index)
+
+    p = sub.add_parser("convert-index", help="Reconstruye un índice FAISS existente como IVF/HNSW/PQ")
+    p.add_argument("--src", default=settings.FAISS_INDEX_PATH, help="índice Flat de origen")
+    p.add_argument("--embeddings", default="", help=".npy con los vectores (alternativa a --src)")
+    p.add_argument("--save-embeddings", default="", help="guardar los vectores reconstruidos (para EXACT_RESCORE)")
+    p.add_argument("--out", required=True)
+    _add_index_type_args(p)
+    p.set_defaults(func=_cmd_convert_index)
+
+    p = sub.add_parser("export-onnx", help="Exporta embedder y cross-encoder a ONNX (+ int8 dinámico)")
+    p.add_argument("--embed-model", default=settings.EMBED_MODEL)
+    p.add_argument("--reranker-model", default=settings.RERANKER_MODEL)
+    p.add_argument("--onnx-dir", default=settings.ONNX_DIR)
+    p.add_argument("--no-quantize", action="store_true", help="sólo el export fp32")
+    p.set_defaults(func=_cmd_export_onnx)
+
+    p = sub.add_parser("onnx-parity", help="Acuerdo de ranking ONNX vs PyTorch sobre un log de queries")
+    p.add_argument("--queries", default="data/query.csv")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=50, help="candidatos por query a re-puntuar")
+    p.add_argument("--k", type=int, default=10, help="k del overlap@k")
+    p.add_argument("--onnx-dir", default=settings.ONNX_DIR)
+    p.add_argument("--threads", type=int, default=settings.ONNX_INTRA_OP_THREADS)
+    p.add_argument("--no-quantize", action="store_true", help="comparar el export fp32")
+    p.set_defaults(func=_cmd_onnx_parity)
+
+    p = sub.add_parser("eval", help="Calidad (MAP/NDCG/P/R@k) + latencia por etapa sobre WANDS -> JSON")
+    p.add_argument("--queries", default="data/query.csv")
+    p.add_argument("--labels", default="data/label.csv")
+    p.add_argument("--limit", type=int, default=0, help="primeras N queries (0 = todas)")
+    p.add_argument("--out", default="", help="fichero JSON de resultados (comparable con `compare`)")
+    p.add_argument("--top-k", type=int, default=settings.TOP_K_RETRIEVER)
+    p.add_argument("--top-m", type=int, default=settings.RERANK_TOP_M)
+    p.add_argument("--k", type=int, default=10, help="corte de las métricas")
+    p.add_argument("--batch-size", type=int, default=32, help="queries por batch (1 = latencia por query)")
+    p.add_argument("--warmup", type=int, default=1, help="batches de calentamiento sin medir")
+    p.add_argument("--mode", choices=["dense", "lexical", "hybrid"], default=None)
+    p.add_argument("--index", default="", help="índice FAISS alternativo")
+    p.add_argument("--nprobe", type=int, default=None)
+    p.add_argument("--ef-search", type=int, default=None)
+    p.add_argument("--exact-rescore", action="store_true")
+    p.add_argument("--backend", choices=["torch", "onnx"], default=None)
+    p.add_argument("--no-rerank", action="store_true", help="evaluar sólo el retriever")
+    p.add_argument("--cascade", action="store_true", help="rerank en cascada con parada temprana")
+    p.add_argument("--cascade-margin", type=float, default=None)
+    p.add_argument("--cascade-batch", type=int, default=None)
+    p.add_argument("--exact-w", type=float, default=1.0)
+    p.add_argument("--partial-w", type=float, default=0.5)
+    p.add_argument("--n-boot", type=int, default=2000)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=_cmd_eval)
+
+    p = sub.add_parser("compare", help="Diferencias entre dos resultados de `eval` (bootstrap pareado)")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--n-boot", type=int, default=2000)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=_cmd_compare)
+
+    p = sub.add_parser("serve", help="N workers uvicorn (fork) que comparten índice, product store y modelos")
+    p.add_argument("--host", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--threads-per-worker", type=int, default=0,
+                   help="hilos torch/FAISS por worker (0 = por defecto; p.ej. núcleos / workers)")
+    p.add_argument("--no-preload", action="store_true",
+                   help="cada worker carga sus modelos (sólo se comparten las páginas mmap)")
+    p.add_argument("--memory-report-interval", type=float, default=0.0, help="log de RSS/PSS por worker cada N s")
+    p.add_argument("--log-level", default="info")
+    p.set_defaults(func=_cmd_serve)
+
+    p = sub.add_parser("loadtest", help="Carga concurrente sobre /search y /rag: throughput, latencia de cola y errores")
+    target = p.add_mutually_exclusive_group()
+    target.add_argument("--url", default="", help="servidor ya levantado (por defecto la app en proceso)")
+    target.add_argument("--uvicorn", action="store_true", help="lanzar `uvicorn main:app` en un subproceso")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--workers", type=int, default=1, help="workers de uvicorn (con --uvicorn)")
+    p.add_argument("--queries", default="data/query.csv")
+    p.add_argument("--query-limit", type=int, default=0)
+    p.add_argument("--mix", default="search=1", help="pesos por endpoint: search, rag, rag_stream")
+    p.add_argument("--concurrency", type=int, default=8, help="workers en modo cerrado")
+    p.add_argument("--rate", type=float, default=0.0, help="req/s con llegadas Poisson (modo abierto)")
+    p.add_argument("--max-inflight", type=int, default=1000, help="modo abierto: por encima se descartan llegadas")
+    p.add_argument("--requests", type=int, default=0, help="total de requests (0 = hasta --duration, o 200 sin duración)")
+    p.add_argument("--duration", type=float, default=0.0, help="segundos (0 = hasta --requests)")
+    p.add_argument("--warmup", type=int, default=0, help="requests de calentamiento sin medir")
+    p.add_argument("--timeout", type=float, default=120.0, help="timeout del cliente por request (s)")
+    p.add_argument("--top-k", type=int, default=settings.TOP_K_RETRIEVER)
+    p.add_argument("--rerank-m", type=int, default=settings.RERANK_TOP_M)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--fake-llm", action="store_true", help="usar FakeLLMClient en lugar de GPT4All")
+    p.add_argument("--fake-first-token-ms", type=float, default=settings.FAKE_LLM_FIRST_TOKEN_MS)
+    p.add_argument("--fake-tokens-per-s", type=float, default=settings.FAKE_LLM_TOKENS_PER_S)
+    p.add_argument("--fake-output-tokens", type=int, default=settings.FAKE_LLM_OUTPUT_TOKENS)
+    p.add_argument("--out", default="", help="informe JSON")
+    p.set_defaults(func=_cmd_loadtest)
+    return parser
+
+
+def main(argv=None):
+    setup_logging()
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
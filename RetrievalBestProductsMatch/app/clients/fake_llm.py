@@ -0,0 +1,82 @@
+# app/clients/fake_llm.py
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.clients.llm_base import LLMClientProtocol, extract_json_from_text
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_PRODUCT_ID = re.compile(r"^product_id: (\S+)$", flags=re.MULTILINE)
+_CHARS_PER_TOKEN = 4
+
+
+class FakeLLMClient(LLMClientProtocol):
+    """
+    LLM de sustitución para pruebas de carga y desarrollo sin descargar el .gguf: no carga ningún
+    modelo, pero reproduce el perfil temporal de uno local de forma determinística:
+      - first_token_s de latencia hasta el primer token (prefill)
+      - tokens_per_s de velocidad de decodificación
+      - output_tokens tokens aprox. por respuesta (0 -> sólo el JSON mínimo)
+    La respuesta es el JSON que espera RAGService (best_product_id = primer producto del contexto),
+    troceado en tokens de ~4 caracteres. Respeta cancel_event igual que GPT4AllClient, así que el
+    timeout y la cancelación del LLMPool se pueden medir sin un modelo real.
+    """
+    def __init__(self, first_token_s: float = 0.3, tokens_per_s: float = 10.0, output_tokens: int = 120):
+        self.first_token_s = max(0.0, first_token_s)
+        self.tokens_per_s = tokens_per_s
+        self.output_tokens = output_tokens
+
+    def _answer_text(self, context: str) -> str:
+        ids = _PRODUCT_ID.findall(context)
+        candidates = [{"product_id": _as_int(pid), "score": round(1.0 - 0.1 * i, 2)} for i, pid in enumerate(ids[:3])]
+        answer = {
+            "best_product_id": candidates[0]["product_id"] if candidates else None,
+            "reasons": [],
+            "top_candidates": candidates,
+        }
+        base_tokens = -(-len(json.dumps(answer)) // _CHARS_PER_TOKEN)
+        filler = max(0, self.output_tokens - base_tokens - 1)
+        answer["reasons"] = [("tok " * filler).rstrip() or "first candidate in context"]
+        return json.dumps(answer)
+
+    def _tokens(self, context: str, max_tokens: int) -> List[str]:
+        text = self._answer_text(context)
+        return [text[i:i + _CHARS_PER_TOKEN] for i in range(0, len(text), _CHARS_PER_TOKEN)][:max_tokens]
+
+    def stream_answer(self, query: str, context: str, max_tokens: int = 1024,
+                      cancel_event: Optional[threading.Event] = None) -> Iterator[str]:
+        cancel_event = cancel_event or threading.Event()
+        interval = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        n_tokens = 0
+        try:
+            with metrics.timer("llm_generate"):
+                t0 = time.perf_counter()
+                for i, token in enumerate(self._tokens(context, max_tokens)):
+                    # ritmo respecto al inicio (no acumula el retraso de cada wait)
+                    delay = t0 + self.first_token_s + i * interval - time.perf_counter()
+                    if cancel_event.wait(delay) if delay > 0 else cancel_event.is_set():
+                        return
+                    n_tokens += 1
+                    yield token
+        finally:
+            metrics.inc("llm_tokens_total", n_tokens)
+
+    def generate_answer(self, query: str, context: str, max_tokens: int = 1024) -> Dict[str, Any]:
+        text = "".join(self.stream_answer(query, context, max_tokens=max_tokens))
+        parsed = extract_json_from_text(text)
+        if parsed is None:
+            metrics.inc("llm_json_fallbacks_total", source="client")
+            return {"raw": text}
+        return parsed
+
+
+def _as_int(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return value
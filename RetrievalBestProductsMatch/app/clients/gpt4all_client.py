@@ -1,12 +1,40 @@
 # app/clients/gpt4all_client.py
+import importlib.metadata
+import inspect
 import logging
 import json
-import re
-from typing import Dict, Any
-from app.clients.llm_base import LLMClientProtocol
+import queue
+import threading
+from typing import Dict, Any, Iterator, Optional, Sequence
+from app.clients.llm_base import LLMClientProtocol, IncrementalJSONParser, extract_json_from_text, is_answer
+from app.utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Prefijo fijo del modo estructurado: se ingiere una vez por instancia y su KV cache se reutiliza
+# en cada llamada (sólo se procesa el prompt de la query). Pide un JSON corto y nada más.
+STRUCTURED_SYSTEM_PROMPT = (
+    "You pick the product that best matches a shopping query among the given products.\n"
+    "Reply with ONE JSON object and nothing else:\n"
+    '{"best_product_id": <product_id or null>, "reasons": [<at most 2 short strings>], '
+    '"top_candidates": [{"product_id": <product_id>, "score": <0-1>}]}\n'
+    "List at most 3 top_candidates. Use only the given products."
+)
+# además del cierre del JSON, la generación se corta en cuanto aparece alguna de estas secuencias
+DEFAULT_STOP = ("\n\n\n", "<|eot_id|>", "<|im_end|>", "</s>", "\nQuery:")
+STRUCTURED_TEMPERATURE = 0.1
+# el prefijo cacheado usa internals de LLModel (prompt_model(..., reset_context, special) y context.n_past)
+# que no son API pública: sólo se activa con la versión fijada en requirements.txt
+PREFIX_CACHE_GPT4ALL_VERSION = "2.8."
+_DONE = object()
+
+
+def _gpt4all_version() -> Optional[str]:
+    try:
+        return importlib.metadata.version("gpt4all")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
 
 class GPT4AllClient(LLMClientProtocol):
     """
@@ -17,21 +45,31 @@ class GPT4AllClient(LLMClientProtocol):
 
     Este adaptador encapsula esa lógica y devuelve un dict (si el LLM produce JSON)
     o {"raw": "<texto>"} en caso contrario.
+
+    Con structured=True (por defecto):
+      - las instrucciones van en un prefijo fijo (STRUCTURED_SYSTEM_PROMPT) que se ingiere una sola
+        vez; antes de cada llamada se rebobina el contexto de llama.cpp (n_past) al final del prefijo,
+        así que sólo se procesan los tokens de productos + query
+      - el prompt por llamada es compacto (productos + query, sin repetir el esquema)
+      - la generación se corta en cuanto se cierra un objeto JSON con la forma de la respuesta
+        (IncrementalJSONParser) o aparece una secuencia de stop, sin pagar la prosa posterior
+      - el prefijo cacheado depende de internals de gpt4all: si la versión instalada no es la fijada
+        (PREFIX_CACHE_GPT4ALL_VERSION) o el modelo no tiene esas piezas, cada llamada usa generate()
+        en un chat_session con el mismo system prompt (sin reutilizar el prefijo)
+    Las instancias GPT4All no son thread-safe: cada cliente lo usa un único thread del LLMPool.
     """
-    def __init__(self, gpt4all_instance):
+    def __init__(self, gpt4all_instance, structured: bool = True, stop: Sequence[str] = DEFAULT_STOP,
+                 temperature: float = STRUCTURED_TEMPERATURE):
         self._gpt = gpt4all_instance
+        self.structured = structured
+        self.stop = tuple(stop)
+        self.temperature = temperature
+        self._prefix_n_past: Optional[int] = None
+        self._prefix_reuse: Optional[bool] = None  # None: aún sin comprobar
 
     def _extract_json_from_text(self, text: str):
-        """Extrae el primer bloque JSON del texto, si existe."""
-        try:
-            m = re.search(r'\{.*\}', text, flags=re.DOTALL)
-            if not m:
-                return None
-            payload = json.loads(m.group(0))
-            return payload
-        except Exception as e:
-            logger.debug("Failed to parse JSON from LLM output: %s", e)
-            return None
+        """Extrae el primer objeto JSON con la forma de la respuesta, si existe."""
+        return extract_json_from_text(text, accept=is_answer)
 
     def _unpack_raw_output(self, raw_out):
         """
@@ -59,12 +97,10 @@ class GPT4AllClient(LLMClientProtocol):
         else:
             return str(raw_out)
 
-    def generate_answer(self, query: str, context: str, max_tokens: int = 1024) -> Dict[str, Any]:
-        """
-        Genera una respuesta a partir de query+context. Devuelve dict con la respuesta parseada
-        (busca JSON embebido) o {'raw': '<texto completo>'} si no logra extraer JSON.
-        """
-        prompt = (
+    def build_prompt(self, query: str, context: str) -> str:
+        if self.structured:
+            return f"Products:\n{context}\nQuery: {query}\nJSON:"
+        return (
             "Context:\n"
             f"{context}\n\n"
             f"User question: {query}\n\n"
@@ -75,18 +111,187 @@ class GPT4AllClient(LLMClientProtocol):
             "Return JSON ONLY. No extra commentary.\n"
         )
 
+    # ------------------------------------------------------------------ modo estructurado
+    def _prompt_template(self) -> str:
+        # mismo formato que chat_session: '{0}' = mensaje del usuario, '{1}' = respuesta
+        template = (getattr(self._gpt, "config", None) or {}).get("promptTemplate") or "{0}"
+        return template.format("%1", "%2")
+
+    def _system_turn(self, text: str) -> str:
+        template = self._prompt_template()
+        if "<|start_header_id|>" in template:
+            return f"<|start_header_id|>system<|end_header_id|>\n\n{text}<|eot_id|>"
+        if "<|im_start|>" in template:
+            return f"<|im_start|>system\n{text}<|im_end|>\n"
+        return f"{text}\n\n"
+
+    def _supports_prefix_reuse(self) -> bool:
+        if self._prefix_reuse is None:
+            reason = self._prefix_reuse_problem()
+            if reason is not None:
+                logger.warning("gpt4all prompt prefix cache disabled (%s); using generate() on every call", reason)
+            self._prefix_reuse = reason is None
+        return self._prefix_reuse
+
+    def _prefix_reuse_problem(self) -> Optional[str]:
+        """None si la versión y el modelo tienen lo que usa _rewind_to_prefix; si no, el motivo."""
+        version = _gpt4all_version()
+        if version is not None and not version.startswith(PREFIX_CACHE_GPT4ALL_VERSION):
+            return f"gpt4all {version} is not the pinned {PREFIX_CACHE_GPT4ALL_VERSION}x"
+        model = getattr(self._gpt, "model", None)
+        prompt_model = getattr(model, "prompt_model", None)
+        if prompt_model is None or not hasattr(model, "context"):
+            return "the model has no prompt_model / context"
+        try:
+            params = inspect.signature(prompt_model).parameters
+        except (TypeError, ValueError):
+            return "prompt_model signature is not available"
+        missing = [name for name in ("n_predict", "reset_context", "special") if name not in params]
+        if missing:
+            return f"prompt_model has no {', '.join(missing)} argument"
+        return None
+
+    def _rewind_to_prefix(self):
+        """Ingiere el prefijo fijo la primera vez; después sólo rebobina n_past al final del prefijo."""
+        model = self._gpt.model
+        if self._prefix_n_past is None or model.context is None:
+            with metrics.timer("llm_prefix_ingest"):
+                model.prompt_model(self._system_turn(STRUCTURED_SYSTEM_PROMPT), "%1%2", lambda *_: True,
+                                   n_predict=0, reset_context=True, special=True)
+            self._prefix_n_past = model.context.n_past
+            logger.info("LLM prompt prefix ingested (%d tokens); reused on every call", self._prefix_n_past)
+        else:
+            model.context.n_past = self._prefix_n_past
+
+    def _structured_tokens(self, prompt: str, max_tokens: int,
+                           cancel_event: Optional[threading.Event]) -> Iterator[str]:
+        """
+        Genera en un thread propio y entrega los tokens por una cola. El callback de gpt4all corre en
+        ese thread: alimenta el parser incremental y corta en cuanto se cierra el JSON de la respuesta,
+        aparece una secuencia de stop, se cancela o el consumidor deja de leer. Al salir se espera al
+        thread, así el modelo nunca queda generando cuando el cliente vuelve al pool.
+        """
+        parser = IncrementalJSONParser(accept=is_answer)
+        out: "queue.Queue" = queue.Queue()
+        closed = threading.Event()
+        stopped = {"reason": None}
+        longest_stop = max(map(len, self.stop), default=0)
+
+        def _keep_going(token_id, response) -> bool:
+            if closed.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                return False
+            out.put(response)
+            if parser.feed(response) is not None:
+                stopped["reason"] = "json"
+                return False
+            if any(seq in parser.text[-(len(response) + longest_stop):] for seq in self.stop):
+                stopped["reason"] = "stop"
+                return False
+            return True
+
+        def _run():
+            try:
+                if self._supports_prefix_reuse():
+                    try:
+                        self._rewind_to_prefix()
+                    except (AttributeError, TypeError) as e:
+                        # internals distintos de los esperados: sin prefijo cacheado a partir de ahora
+                        logger.warning("gpt4all prompt prefix cache disabled (%s); using generate() on every call", e)
+                        self._prefix_reuse = False
+                if self._prefix_reuse:
+                    self._gpt.model.prompt_model(prompt, self._prompt_template(), _keep_going, n_predict=max_tokens,
+                                                 temp=self.temperature, reset_context=False)
+                else:
+                    with self._gpt.chat_session(system_prompt=STRUCTURED_SYSTEM_PROMPT):
+                        self._gpt.generate(prompt, max_tokens=max_tokens, temp=self.temperature,
+                                           callback=_keep_going)
+            except BaseException as e:
+                # el contexto puede haber quedado a medias: se vuelve a ingerir el prefijo
+                self._prefix_n_past = None
+                out.put(e)
+            finally:
+                out.put(_DONE)
+
+        thread = threading.Thread(target=_run, name="gpt4all-generate", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = out.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            closed.set()
+            thread.join()
+        if stopped["reason"]:
+            metrics.inc("llm_early_stops_total", reason=stopped["reason"])
+
+    def stream_answer(self, query: str, context: str, max_tokens: int = 1024,
+                      cancel_event: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        Igual que generate_answer pero devuelve los tokens a medida que se generan.
+        Si cancel_event se activa (timeout / cliente desconectado) la generación se corta en el
+        siguiente token vía el callback de gpt4all.
+        """
+        prompt = self.build_prompt(query, context)
+
+        def _keep_going(token_id, response) -> bool:
+            return not (cancel_event is not None and cancel_event.is_set())
+
+        n_tokens = 0
+        try:
+            with metrics.timer("llm_generate"):
+                if self.structured:
+                    for token in self._structured_tokens(prompt, max_tokens, cancel_event):
+                        n_tokens += 1
+                        yield token
+                    return
+                with self._gpt.chat_session():
+                    for token in self._gpt.generate(prompt, max_tokens=max_tokens, streaming=True,
+                                                    callback=_keep_going):
+                        n_tokens += 1
+                        yield token
+        finally:
+            metrics.inc("llm_tokens_total", n_tokens)
+
+    def generate_answer(self, query: str, context: str, max_tokens: int = 1024) -> Dict[str, Any]:
+        """
+        Genera una respuesta a partir de query+context. Devuelve dict con la respuesta parseada
+        (busca JSON embebido) o {'raw': '<texto completo>'} si no logra extraer JSON.
+        """
+        if self.structured:
+            text = "".join(self.stream_answer(query, context, max_tokens=max_tokens))
+            parsed = self._extract_json_from_text(text)
+            if parsed is None:
+                logger.warning("gpt4all returned no JSON. Returning raw text for debugging.")
+                metrics.inc("llm_json_fallbacks_total", source="client")
+                return {"raw": text}
+            return parsed
+
+        prompt = self.build_prompt(query, context)
+        n_tokens = 0
+
+        def _count(token_id, response) -> bool:
+            nonlocal n_tokens
+            n_tokens += 1
+            return True
+
         try:
             # Usa chat_session si existe (tal como en tu notebook)
-            if hasattr(self._gpt, "chat_session"):
-                try:
-                    with self._gpt.chat_session():
-                        raw_out = self._gpt.generate(prompt, max_tokens=max_tokens)
-                except TypeError:
-                    # algunas versiones pueden querer (prompt, max_tokens) distinto, fallback:
-                    raw_out = self._gpt.generate(prompt)
-            else:
-                # fallback directo a generate
-                raw_out = self._gpt.generate(prompt, max_tokens=max_tokens)
+            with metrics.timer("llm_generate"):
+                if hasattr(self._gpt, "chat_session"):
+                    try:
+                        with self._gpt.chat_session():
+                            raw_out = self._gpt.generate(prompt, max_tokens=max_tokens, callback=_count)
+                    except TypeError:
+                        # algunas versiones pueden querer (prompt, max_tokens) distinto, fallback:
+                        raw_out = self._gpt.generate(prompt)
+                else:
+                    # fallback directo a generate
+                    raw_out = self._gpt.generate(prompt, max_tokens=max_tokens)
+            metrics.inc("llm_tokens_total", n_tokens)
 
             text = self._unpack_raw_output(raw_out)
             parsed = self._extract_json_from_text(text)
@@ -95,6 +300,7 @@ class GPT4AllClient(LLMClientProtocol):
                 return parsed
             else:
                 logger.warning("gpt4all returned no JSON. Returning raw text for debugging.")
+                metrics.inc("llm_json_fallbacks_total", source="client")
                 return {"raw": text}
         except Exception as e:
             logger.exception("gpt4all generation error: %s", e)
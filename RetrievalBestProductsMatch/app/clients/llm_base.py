@@ -1,11 +1,110 @@
 # app/clients/llm_base.py
-from typing import Dict, Any, Protocol
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Protocol
+
+logger = logging.getLogger(__name__)
 
 
 class LLMClientProtocol(Protocol):
     """
     Protocolo que define la interfaz mínima que RAGService espera.
     Implementaciones deben proporcionar generate_answer(query, context, **kwargs) -> Dict[str, Any].
+    Opcionalmente stream_answer(query, context, max_tokens, cancel_event) -> Iterator[str] para
+    /rag/stream (LLMPool hace fallback a generate_answer si no existe).
     """
     def generate_answer(self, query: str, context: str, **kwargs) -> Dict[str, Any]:
-        ...
\ No newline at end of file
+        ...
+
+    def stream_answer(self, query: str, context: str, max_tokens: int = 1024,
+                      cancel_event: Optional[threading.Event] = None) -> Iterator[str]:
+        ...
+
+
+ANSWER_KEYS = ("best_product_id", "reasons", "top_candidates")
+
+
+def is_answer(obj: Any) -> bool:
+    """True si obj tiene la forma de respuesta que espera RAGService (best_product_id + listas opcionales)."""
+    return (isinstance(obj, dict) and "best_product_id" in obj
+            and isinstance(obj.get("reasons", []), list) and isinstance(obj.get("top_candidates", []), list))
+
+
+def coerce_answer(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Completa las claves que falten (reasons / top_candidates) de una respuesta que cumple is_answer."""
+    return {**obj, "reasons": obj.get("reasons") or [], "top_candidates": obj.get("top_candidates") or []}
+
+
+class IncrementalJSONParser:
+    """
+    Localiza el primer objeto JSON (que cumpla accept, si se da) en un texto que llega por trozos:
+    lleva la profundidad de llaves y el estado de strings/escapes, así que cada carácter se mira una
+    sola vez y el objeto se detecta en el mismo token en que se cierra (para cortar la generación ahí).
+    El texto fuera de objetos (prosa, ```json) se ignora; si un objeto cerrado no parsea o no cumple
+    accept, se sigue buscando dentro y después de él.
+    """
+    def __init__(self, accept: Optional[Callable[[Any], bool]] = None):
+        self.accept = accept
+        self.text = ""
+        self.result: Optional[Dict[str, Any]] = None
+        self.end: Optional[int] = None  # posición en text justo después del objeto encontrado
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        if self.result is not None:
+            return self.result
+        self.text += chunk
+        text, i = self.text, self._pos
+        while i < len(text):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = self._depth > 0
+            elif c == "{":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif c == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._parse(text[self._start:i + 1])
+                    if obj is not None:
+                        self.result, self.end, self._pos = obj, i + 1, i + 1
+                        return obj
+                    # objeto inválido: reintentar con los objetos anidados
+                    i = self._start
+            i += 1
+        self._pos = i
+        return None
+
+    def _parse(self, candidate: str) -> Optional[Dict[str, Any]]:
+        try:
+            obj = json.loads(candidate)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict) or (self.accept is not None and not self.accept(obj)):
+            return None
+        return obj
+
+
+def extract_json_from_text(text: str, accept: Optional[Callable[[Any], bool]] = None) -> Optional[Dict[str, Any]]:
+    """Extrae el primer objeto JSON del texto (que cumpla accept, si se da), si existe."""
+    parsed = IncrementalJSONParser(accept).feed(text)
+    if parsed is None:
+        logger.debug("No JSON object found in LLM output")
+    return parsed
@@ -0,0 +1,128 @@
+# app/clients/llm_pool.py
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.clients.llm_base import LLMClientProtocol
+from app.utils.batching import QueueFullError
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LLMTimeoutError(TimeoutError):
+    """La generación superó el timeout por request (y se canceló)."""
+
+
+class LLMPool:
+    """
+    Pool acotado de N clientes LLM precargados (uno por instancia GPT4All, que no es thread-safe):
+      - cada generación ocupa un cliente y un thread del pool; el resto de requests espera en cola
+      - si ya hay max_queue requests esperando, se rechaza con QueueFullError (-> 503)
+      - timeout por request y cancelación (timeout o cliente desconectado) vía threading.Event,
+        que el cliente comprueba en cada token
+    Un cliente no vuelve al pool hasta que su thread termina de verdad.
+    """
+    def __init__(self, clients: List[LLMClientProtocol], max_queue: int = 8, timeout_s: float = 60.0,
+                 max_tokens: int = 1024):
+        if not clients:
+            raise ValueError("LLMPool needs at least one client")
+        self.clients = clients
+        self.max_queue = max_queue
+        self.timeout_s = timeout_s
+        self.max_tokens = max_tokens
+        self._executor = ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix="llm")
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for client in clients:
+            self._idle.put_nowait(client)
+        self._waiting = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.clients)
+
+    def saturated(self) -> bool:
+        return self._idle.empty() and self._waiting >= self.max_queue
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": self.size, "idle": self._idle.qsize(), "waiting": self._waiting, "max_queue": self.max_queue}
+
+    async def _acquire(self) -> LLMClientProtocol:
+        if self._idle.empty() and self._waiting >= self.max_queue:
+            raise QueueFullError(f"LLM pool queue is full ({self.max_queue})")
+        self._waiting += 1
+        try:
+            return await self._idle.get()
+        finally:
+            self._waiting -= 1
+
+    def _run(self, client, query: str, context: str, cancel: threading.Event, emit):
+        """Corre en un thread del pool: emite ('token', str) / ('result', dict) / ('error', exc) / ('done', None)."""
+        try:
+            stream = getattr(client, "stream_answer", None)
+            if stream is not None:
+                for token in stream(query, context, max_tokens=self.max_tokens, cancel_event=cancel):
+                    if cancel.is_set():
+                        break
+                    emit(("token", token))
+            else:
+                emit(("result", client.generate_answer(query=query, context=context)))
+        except Exception as e:
+            emit(("error", e))
+        finally:
+            emit(("done", None))
+
+    async def stream(self, query: str, context: str, timeout_s: Optional[float] = None) -> AsyncIterator[Any]:
+        """
+        Async generator de tokens (str). Si el cliente no soporta streaming, emite un único dict
+        con la respuesta completa. Cerrar el generador (desconexión) cancela la generación.
+        """
+        with metrics.timer("llm_queue_wait"):
+            client = await self._acquire()
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        cancel = threading.Event()
+
+        def emit(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        fut = loop.run_in_executor(self._executor, self._run, client, query, context, cancel, emit)
+        fut.add_done_callback(lambda _: self._idle.put_nowait(client))
+        started = loop.time()
+        deadline = started + (timeout_s or self.timeout_s)
+        first = True
+        # el histograma de llm_generate lo registra el cliente; aquí sólo el desglose de la request
+        with metrics.timer("llm_generate", histogram=False):
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    try:
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError
+                        kind, payload = await asyncio.wait_for(events.get(), remaining)
+                    except asyncio.TimeoutError:
+                        raise LLMTimeoutError(f"LLM generation exceeded {timeout_s or self.timeout_s}s")
+                    if kind == "done":
+                        return
+                    if kind == "error":
+                        raise payload
+                    if first:
+                        metrics.observe("llm_first_token_seconds", loop.time() - started)
+                        first = False
+                    yield payload
+            finally:
+                cancel.set()
+
+    async def generate(self, query: str, context: str, timeout_s: Optional[float] = None) -> Dict[str, Any]:
+        """Generación completa (no streaming) con timeout; devuelve el dict del cliente o {'raw': texto}."""
+        chunks = []
+        async for item in self.stream(query, context, timeout_s=timeout_s):
+            if isinstance(item, dict):
+                return item
+            chunks.append(item)
+        return {"raw": "".join(chunks)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -3,16 +3,130 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     FAISS_INDEX_PATH: str = "data/faiss.index"
     PRODUCT_CSV: str = "data/product.csv"
+    # Directorio del ProductStore columnar (si existe se carga con mmap en lugar de leer PRODUCT_CSV)
+    PRODUCT_STORE_DIR: str = "data/product_store"
     EMBED_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
     RERANKER_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
     LLM_MODEL_NAME: str = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
 
     LLM_ALLOW_DOWNLOAD: bool = True
+    # Cargar store, índice y modelos en background: el servidor acepta conexiones al momento, /ready
+    # informa del progreso por componente y /search, /rag y /catalog responden 503 hasta que estén
+    COMPONENTS_LAZY_LOAD: bool = True
+    # Cargar el LLM en background tras el arranque: /search sirve antes y /rag responde 503 hasta que esté
+    LLM_LAZY_LOAD: bool = True
+    # Pool de instancias GPT4All precargadas (cada una ocupa la RAM del modelo completo)
+    LLM_POOL_SIZE: int = 1
+    LLM_QUEUE_MAX: int = 8            # requests esperando un cliente libre; por encima -> 503
+    LLM_TIMEOUT_S: float = 60.0       # timeout por generación (se cancela y se devuelve el fallback)
+    LLM_MAX_TOKENS: int = 1024
+    # Generación estructurada: prefijo fijo reutilizado (KV cache), prompt compacto, stop sequences y
+    # corte en cuanto se cierra el JSON de la respuesta. False -> prompt libre del notebook.
+    LLM_STRUCTURED: bool = True
+    LLM_STRUCTURED_MAX_TOKENS: int = 256   # tope de tokens generados en modo estructurado
+    LLM_CONTEXT_TOKENS: int = 700          # presupuesto de tokens de los productos en el prompt
+    # gpt4all | fake (FakeLLMClient: sin modelo, latencia y velocidad de tokens configurables)
+    LLM_BACKEND: str = "gpt4all"
+    FAKE_LLM_FIRST_TOKEN_MS: float = 300.0
+    FAKE_LLM_TOKENS_PER_S: float = 10.0
+    FAKE_LLM_OUTPUT_TOKENS: int = 120
     
+    # Tipo de índice ANN para build-index: flat | ivf_flat | hnsw | ivf_pq | opq_ivf_pq
+    INDEX_TYPE: str = "flat"
+    IVF_NLIST: int = 1024
+    PQ_M: int = 16
+    PQ_NBITS: int = 8
+    HNSW_M: int = 32
+    HNSW_EF_CONSTRUCTION: int = 200
+    INDEX_TRAIN_SIZE: int = 100000
+    # knobs de búsqueda por defecto del deployment (sobreescribibles por request)
+    FAISS_NPROBE: int = 16
+    FAISS_EF_SEARCH: int = 64
+    # re-scoring exacto del shortlist ANN contra los vectores originales (EMBEDDINGS_PATH)
+    EXACT_RESCORE: bool = False
+    RESCORE_FACTOR: int = 4
+    EMBEDDINGS_PATH: str = "data/embeddings.npy"
+    # mmap del índice FAISS (arranque en segundos, páginas compartidas entre procesos; sólo lectura)
+    FAISS_MMAP: bool = True
+    # si PRODUCT_STORE_DIR no existe, construirlo desde PRODUCT_CSV al arrancar (el siguiente arranque usa mmap)
+    SNAPSHOT_ON_LOAD: bool = True
+    # manifest escrito por `python -m app.cli build-index` (modelo, dimensión, filas); se valida al arrancar
+    MANIFEST_PATH: str = "data/manifest.json"
+
+    # Recuperación: dense (FAISS) | lexical (BM25) | hybrid (RRF dense + BM25)
+    RETRIEVAL_MODE: str = "dense"
+    LEXICAL_INDEX_PATH: str = "data/lexical.npz"
+    LEXICAL_BUILD_ON_LOAD: bool = False
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    RRF_K: int = 60
+
+    # Filtros de metadatos (product_class, category hierarchy, ratings): filtros con <= N filas se
+    # puntúan por fuerza bruta sobre el subconjunto; el resto con un selector de ids dentro de FAISS
+    FILTER_BRUTE_FORCE_MAX_ROWS: int = 5000
+    FILTER_CACHE_SIZE: int = 256      # bitmaps de filtros ya resueltos
+
+    # Catálogo vivo: POST /catalog/upsert | /catalog/delete escriben un lote en CATALOG_DELTA_DIR (log
+    # compartido por los workers prefork) y cada worker lo aplica sin reiniciar (embeddings en lotes,
+    # índice delta con ids, tombstones). Compactación en background al pasar cualquiera de los umbrales.
+    CATALOG_LIVE_ENABLED: bool = True
+    CATALOG_DELTA_DIR: str = "data/catalog_deltas"
+    CATALOG_POLL_S: float = 2.0       # 0 = sin watcher (sólo los cambios recibidos por este proceso)
+    CATALOG_EMBED_BATCH: int = 256
+    CATALOG_COMPACT_TOMBSTONE_RATIO: float = 0.1  # tombstones / filas del índice base
+    CATALOG_COMPACT_DELTA_ROWS: int = 20000
+    # la compactación reescribe índice, store, BM25, embeddings y manifest (un único proceso)
+    CATALOG_PERSIST: bool = True
+
     TOP_K_RETRIEVER: int = 50
     RERANK_TOP_M: int = 10
 
+    # Rerank en cascada: el cross-encoder puntúa los candidatos en orden de la etapa barata, en lotes,
+    # y para cuando el top RERANK_TOP_M ya no puede cambiar por más de RERANK_CASCADE_MARGIN
+    RERANK_CASCADE: bool = False
+    RERANK_CASCADE_BATCH: int = 8       # candidatos por lote tras el primero (top_m + batch)
+    RERANK_CASCADE_MARGIN: float = 1.0  # en unidades del score del cross-encoder (logits)
+    RERANK_CASCADE_MODEL: str = ""      # cross-encoder ligero como etapa barata ("" = score de retrieval)
+
+    # Backend de inferencia de embeddings + cross-encoder: torch | onnx (ONNX Runtime, int8 dinámico)
+    INFERENCE_BACKEND: str = "torch"
+    ONNX_DIR: str = "data/onnx"       # exports por modelo (se generan al arrancar si faltan)
+    ONNX_QUANTIZE: bool = True
+    ONNX_INTRA_OP_THREADS: int = 0    # 0 = lo decide ONNX Runtime
+
+    EMBED_BATCH_SIZE: int = 64
+    RERANK_BATCH_SIZE: int = 128
+    MAX_BATCH_QUERIES: int = 1024
+
+    # Micro-batching de encode/rerank entre requests concurrentes (/search, /rag)
+    BATCHING_ENABLED: bool = True
+    BATCH_MAX_SIZE: int = 64          # queries por batch de encode
+    BATCH_MAX_PAIRS: int = 512        # pares (query, candidato) por batch del cross-encoder
+    BATCH_MAX_WAIT_MS: float = 5.0
+    BATCH_MAX_QUEUE: int = 256        # por encima -> 503
+
+    CACHE_ENABLED: bool = True
+    EMBED_CACHE_SIZE: int = 10000
+    RESULT_CACHE_SIZE: int = 5000
+    RESULT_CACHE_TTL_S: float = 3600.0
+    # Log de queries para precalentar la cache al arrancar (p.ej. data/query.csv). Vacío = sin warm-up.
+    CACHE_WARMUP_QUERY_LOG: str = ""
+    CACHE_WARMUP_LIMIT: int = 1000
+
+    # Cache semántica de respuestas RAG: mismos candidatos en el contexto + coseno(query) >= umbral
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIZE: int = 2000
+    ANSWER_CACHE_TTL_S: float = 86400.0
+    ANSWER_CACHE_THRESHOLD: float = 0.92
+    # .npz donde se persiste la cache al apagar y se recarga al arrancar. Vacío = sólo en memoria.
+    ANSWER_CACHE_PATH: str = ""
+
+    # Observabilidad: /metrics (Prometheus), cabecera Server-Timing por request y profiler por muestreo
+    METRICS_ENABLED: bool = True
+    SERVER_TIMING_HEADER: bool = True
+    PROFILER_ENABLED: bool = False    # expone /debug/profiler/*; el muestreo se activa en caliente
+
     class Config:
         env_file = ".env"
 
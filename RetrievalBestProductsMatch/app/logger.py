@@ -4,6 +4,9 @@ from logging.config import dictConfig
 def setup_logging():
     config = {
         "version": 1,
+        # main.py vuelve a llamar a setup_logging al importarse (p.ej. desde la CLI): no silenciar
+        # los loggers de los módulos ya importados
+        "disable_existing_loggers": False,
         "formatters": {
             "default": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"}
         },
@@ -0,0 +1,176 @@
+# app/models/benchmark.py
+"""
+Evaluación offline (calidad + latencia) del pipeline real Retriever -> Reranker sobre WANDS:
+  - las queries de query.csv se procesan en batches (un encode, una búsqueda FAISS y un rerank por batch)
+  - el desglose por etapa sale de los mismos timers que /metrics (encode, faiss_search, bm25_search,
+    candidate_texts, rerank_predict, ...), así que los números son comparables con producción
+  - se evalúan a la vez el ranking 'semantic' (retriever top_m) y 'rerank' (cross-encoder top_m),
+    con el bootstrap pareado rerank - semantic como en el notebook
+El resultado es un dict JSON-serializable que se puede guardar y comparar entre runs (compare_runs).
+"""
+import logging
+import platform
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.models.index_factory import describe
+from app.utils.evaluation import (Qrels, bootstrap_paired_diff, latency_summary, ranking_metrics,
+                                  summarize, to_lists)
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RESULTS_VERSION = 1
+
+
+def load_queries(path: str, limit: int = 0) -> pd.DataFrame:
+    """query.csv de WANDS (separado por tabs): columnas query_id, query."""
+    df = pd.read_csv(path, sep='\t', usecols=["query_id", "query"]).dropna(subset=["query"])
+    df["query"] = df["query"].astype(str)
+    return df.head(limit) if limit else df
+
+
+def run_benchmark(retriever, reranker, queries: pd.DataFrame, qrels: Qrels, top_k: int = 50, top_m: int = 10,
+                  k: int = 10, batch_size: int = 32, mode: Optional[str] = None, warmup_batches: int = 1,
+                  n_boot: int = 2000, seed: int = 42, **search_kwargs) -> Dict[str, Any]:
+    """
+    retriever / reranker: instancias ya cargadas (reranker=None evalúa sólo el retriever).
+    Las latencias por etapa son por batch de `batch_size` queries (batch_size=1 -> latencia por query);
+    throughput_qps = queries / tiempo total de la etapa.
+    """
+    texts: List[str] = queries["query"].tolist()
+    query_ids = queries["query_id"].tolist()
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    for batch in batches[:warmup_batches]:
+        _run_batch(retriever, reranker, batch, top_k, top_m, mode, search_kwargs)
+
+    stage_samples: Dict[str, List[float]] = {}
+    pair_counts: Dict[str, float] = {}
+    semantic_ids: List[List[str]] = []
+    rerank_ids: List[List[str]] = []
+    t_start = time.perf_counter()
+    for batch in batches:
+        timings, token = metrics.start_request()
+        t0 = time.perf_counter()
+        try:
+            candidates, reranked = _run_batch(retriever, reranker, batch, top_k, top_m, mode, search_kwargs)
+            for name, value in metrics.request_counts().items():
+                pair_counts[name] = pair_counts.get(name, 0) + value
+        finally:
+            metrics.end_request(token)
+        timings["end_to_end"] = time.perf_counter() - t0
+        for stage, seconds in timings.items():
+            stage_samples.setdefault(stage, []).append(seconds)
+        semantic_ids.extend(retriever.store.product_ids(idxs[:top_m]) for idxs, _ in candidates)
+        if reranked is not None:
+            rerank_ids.extend(retriever.store.product_ids(idxs) for idxs, _ in reranked)
+    wall_s = time.perf_counter() - t_start
+
+    pipelines = {"semantic": semantic_ids}
+    if rerank_ids:
+        pipelines["rerank"] = rerank_ids
+    per_query = {name: ranking_metrics(qrels.matrices(query_ids, ids, k), k) for name, ids in pipelines.items()}
+
+    results: Dict[str, Any] = {
+        "version": RESULTS_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "queries": len(texts),
+            "top_k": top_k,
+            "top_m": top_m,
+            "k": k,
+            "batch_size": batch_size,
+            "mode": mode or retriever.retrieval_mode,
+            "exact_w": qrels.exact_w,
+            "partial_w": qrels.partial_w,
+            "embed_model": retriever.embed_model_name,
+            "reranker_model": getattr(reranker, "model_name", None),
+            "rerank_cascade": {
+                "batch_size": reranker.cascade_batch_size,
+                "margin": reranker.cascade_margin,
+                "model": reranker.cascade_model_name or "retrieval_scores",
+            } if getattr(reranker, "cascade", False) else None,
+            "inference_backend": retriever.inference_backend,
+            "index": describe(retriever.index),
+            "search_kwargs": {key: v for key, v in search_kwargs.items() if v is not None},
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "quality": {name: summarize(values) for name, values in per_query.items()},
+        "latency": {stage: latency_summary(samples, items=len(texts)) for stage, samples in stage_samples.items()},
+        "throughput_qps": len(texts) / wall_s if wall_s > 0 else 0.0,
+        "per_query": {"query_id": [str(q) for q in query_ids],
+                      **{name: to_lists(values) for name, values in per_query.items()}},
+    }
+    if pair_counts.get("rerank_candidates"):
+        # pares (query, candidato) puntuados por el cross-encoder completo: con cascada < candidatos
+        results["rerank_pairs"] = {
+            "per_query": pair_counts.get("rerank_pairs", 0) / len(texts),
+            "fraction": pair_counts.get("rerank_pairs", 0) / pair_counts["rerank_candidates"],
+        }
+    if "rerank" in per_query:
+        results["significance"] = {
+            "rerank_vs_semantic": {
+                metric: bootstrap_paired_diff(per_query["rerank"][metric], per_query["semantic"][metric],
+                                              n_boot=n_boot, seed=seed)
+                for metric in per_query["rerank"]
+            }
+        }
+    return results
+
+
+def _run_batch(retriever, reranker, batch: List[str], top_k: int, top_m: int, mode: Optional[str],
+               search_kwargs: Dict[str, Any]):
+    candidates = retriever.retrieve_batch(batch, top_k=top_k, mode=mode, **search_kwargs)
+    if reranker is None:
+        return candidates, None
+    with metrics.timer("candidate_texts"):
+        texts = [retriever.store.rerank_texts(idxs) for idxs, _ in candidates]
+    reranked = reranker.rerank_batch(batch, texts, [idxs for idxs, _ in candidates], top_m=top_m,
+                                     cheap_scores=[scores for _, scores in candidates])
+    return candidates, reranked
+
+
+def compare_runs(baseline: Dict[str, Any], candidate: Dict[str, Any], n_boot: int = 2000,
+                 seed: int = 42) -> Dict[str, Any]:
+    """
+    Diferencias candidate - baseline: medias de calidad con bootstrap pareado sobre las queries comunes
+    (alineadas por query_id) y deltas de p50/p95/p99 por etapa.
+    """
+    base_pq, cand_pq = baseline["per_query"], candidate["per_query"]
+    base_pos = {q: i for i, q in enumerate(base_pq["query_id"])}
+    common = [(base_pos[q], i) for i, q in enumerate(cand_pq["query_id"]) if q in base_pos]
+    b_idx = np.array([b for b, _ in common], dtype=np.int64)
+    c_idx = np.array([c for _, c in common], dtype=np.int64)
+
+    quality: Dict[str, Dict[str, Any]] = {}
+    for pipeline in sorted(set(base_pq) & set(cand_pq) - {"query_id"}):
+        quality[pipeline] = {}
+        for metric in sorted(set(base_pq[pipeline]) & set(cand_pq[pipeline])):
+            base = np.asarray(base_pq[pipeline][metric])[b_idx]
+            cand = np.asarray(cand_pq[pipeline][metric])[c_idx]
+            quality[pipeline][metric] = {
+                "baseline": float(base.mean()) if len(base) else 0.0,
+                "candidate": float(cand.mean()) if len(cand) else 0.0,
+                **bootstrap_paired_diff(cand, base, n_boot=n_boot, seed=seed),
+            }
+
+    latency: Dict[str, Dict[str, float]] = {}
+    for stage in sorted(set(baseline["latency"]) & set(candidate["latency"])):
+        base, cand = baseline["latency"][stage], candidate["latency"][stage]
+        latency[stage] = {f"{p}_delta_ms": cand[p] - base[p]
+                          for p in ("p50_ms", "p95_ms", "p99_ms") if p in base and p in cand}
+    return {
+        "common_queries": len(common),
+        "quality": quality,
+        "latency": latency,
+        "throughput_qps": {"baseline": baseline.get("throughput_qps"), "candidate": candidate.get("throughput_qps")},
+        "rerank_pairs": {"baseline": baseline.get("rerank_pairs"), "candidate": candidate.get("rerank_pairs")},
+        "config_changes": {key: [baseline["config"].get(key), candidate["config"].get(key)]
+                           for key in sorted(set(baseline["config"]) | set(candidate["config"]))
+                           if baseline["config"].get(key) != candidate["config"].get(key)},
+    }
@@ -0,0 +1,868 @@
+# app/models/catalog.py
+"""
+Catálogo vivo: altas, cambios y bajas de productos sin reconstruir el índice ni reiniciar el servicio.
+  - entre compactaciones las filas (ids del índice y del ProductStore) sólo se añaden: un producto nuevo
+    o modificado ocupa una fila nueva al final y su fila anterior queda marcada como borrada (tombstone)
+  - base: índice FAISS, ProductStore, BM25 y bitsets del último build o compactación; delta: las filas
+    añadidas desde entonces, en un IndexIDMap2(IndexFlatIP) con ids = filas globales, postings BM25 y
+    de metadatos; cada lote sólo añade sus filas (add_with_ids) y quita las sustituidas o borradas
+    (remove_ids): el delta no se rehace hasta la compactación
+  - cada lote produce una CatalogView nueva que se publica con una sola asignación: las búsquedas en
+    curso siguen con la vista que capturaron (base, tombstones y nº de filas del delta, que las vistas
+    sucesivas comparten) y nunca esperan al escritor
+  - la compactación en segundo plano reconstruye la base con las filas vivas renumeradas 0..n-1 (índice
+    posicional, como el del build) cuando los tombstones o el delta pasan de un umbral
+  - como la compactación renumera, cada request HTTP fija una vista (CatalogViewMiddleware) y resuelve
+    contra ella todas las filas que obtiene, aunque se publique otra mientras tanto
+"""
+import contextvars
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from app.models.filters import DeltaMetadataIndex, MetadataIndex, ProductFilter
+from app.models.index_factory import bitmap_selector, reconstructs_exactly, search_parameters
+from app.models.lexical import DeltaLexicalIndex, LexicalIndex
+from app.models.product_store import ProductStore, replace_dir
+from app.utils.cache import LRUCache
+from app.utils.catalog_deltas import (list_delta_files, prune_delta_files, read_delta_file, validate_ops,
+                                      write_delta_file)
+from app.utils.index_builder import embedding_texts, read_manifest, write_json_atomic
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# vista fijada por la request en curso (ver CatalogViewMiddleware); None -> la publicada
+_pinned_view: contextvars.ContextVar[Optional["CatalogView"]] = contextvars.ContextVar("catalog_view", default=None)
+
+
+@contextmanager
+def pinned_view(view: Optional["CatalogView"]):
+    """Fija view para el contexto actual (y los threads que lo copian: run_in_threadpool, asyncio.to_thread)."""
+    token = _pinned_view.set(view)
+    try:
+        yield view
+    finally:
+        _pinned_view.reset(token)
+
+
+def current_view() -> Optional["CatalogView"]:
+    return _pinned_view.get()
+
+
+class CatalogViewMiddleware:
+    """
+    Middleware ASGI: fija la vista publicada del catálogo durante toda la request. Búsqueda, textos del
+    rerank y formateo de resultados resuelven las filas contra la misma vista aunque entretanto una
+    compactación publique otra con las filas renumeradas.
+    """
+    def __init__(self, app, retriever):
+        self.app = app
+        self.retriever = retriever
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with pinned_view(self.retriever.view):
+            await self.app(scope, receive, send)
+
+
+def merge_topk(a: Tuple[List[int], List[float]], b: Tuple[List[int], List[float]],
+               top_k: int) -> Tuple[List[int], List[float]]:
+    """Une dos resultados (ids, scores) ordenados por score descendente y se queda con los top_k."""
+    if not len(b[0]):
+        return list(a[0][:top_k]), list(a[1][:top_k])
+    ids = list(a[0]) + list(b[0])
+    scores = list(a[1]) + list(b[1])
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')[:top_k]
+    return [ids[i] for i in order], [scores[i] for i in order]
+
+
+def _packed_mask(packed: np.ndarray, num_rows: int) -> np.ndarray:
+    return np.unpackbits(packed, bitorder="little", count=num_rows).astype(bool)
+
+
+class OverlayStore(ProductStore):
+    """
+    ProductStore de la base + filas del delta con filas globales (las filas >= len(base) son del delta;
+    una vista sólo ve las len(deleted) primeras). Las filas borradas conservan su texto hasta la
+    compactación (una request que ya tiene la fila la sigue resolviendo); row_of sólo devuelve la
+    versión viva de cada product_id.
+    """
+    def __init__(self, base: ProductStore, delta: Optional["DeltaSegment"], deleted: np.ndarray):
+        self.base = base
+        self.delta = delta
+        self._num_base = len(base)
+        self._num_rows = len(deleted)
+        self._deleted = deleted
+
+    @property
+    def columns(self) -> List[str]:
+        return self.base.columns
+
+    def nbytes(self) -> int:
+        if self.delta is None:
+            return self.base.nbytes()
+        return self.base.nbytes() + self.delta.nbytes(self._num_rows - self._num_base)
+
+    def texts(self, column: str, idxs: Sequence[int]) -> List[str]:
+        rows = np.asarray(idxs, dtype=np.int64)
+        in_delta = rows >= self._num_base
+        if not in_delta.any():
+            return self.base.texts(column, rows)
+        out = [""] * len(rows)
+        for pos, store, offset in ((np.flatnonzero(~in_delta), self.base, 0),
+                                   (np.flatnonzero(in_delta), self.delta, self._num_base)):
+            for p, text in zip(pos.tolist(), store.texts(column, rows[pos] - offset)):
+                out[p] = text
+        return out
+
+    def text(self, column: str, idx: int) -> str:
+        if idx >= self._num_base:
+            return self.delta.text(column, idx - self._num_base)
+        return self.base.text(column, idx)
+
+    def empty_rows(self, column: str) -> np.ndarray:
+        rows = self.base.empty_rows(column)
+        if self.delta is None:
+            return rows
+        return np.concatenate([rows, self.delta.empty_rows(column, self._num_rows - self._num_base) + self._num_base])
+
+    def row_of(self, product_id) -> Optional[int]:
+        pid = str(product_id)
+        row = self.delta.row_of(pid, self._num_rows) if self.delta is not None else None
+        if row is None:
+            row = self.base.row_of(pid)
+        if row is None or self._deleted[row]:
+            return None
+        return row
+
+
+class DeltaSegment:
+    """
+    Filas añadidas desde la última compactación (filas globales first_row, first_row + 1, ...): columnas
+    de texto, vectores, IndexIDMap2(IndexFlatIP) con las filas vivas y, si la base los tiene, postings
+    BM25 (con el idf de la base) y de metadatos.
+      - append/remove (bajo el write lock del catálogo) sólo añaden filas al final, y quitan del índice
+        FAISS las sustituidas o borradas: el coste de un lote es el del lote, no el del delta
+      - las vistas sucesivas comparten el segmento; cada una se limita a sus primeras filas (las que
+        había al crearla), así que los lotes posteriores no le cambian los resultados salvo por las
+        filas que quitan del índice FAISS (productos que la vista nueva ya sirve en su fila nueva)
+      - el índice FAISS no admite búsquedas concurrentes con add/remove: se serializan con self.lock
+        (el delta es pequeño y la búsqueda exacta sobre él es rápida)
+    """
+    def __init__(self, first_row: int, columns: Sequence[str], dim: int, lexical: Optional[LexicalIndex] = None,
+                 with_metadata: bool = False):
+        self.first_row = first_row
+        self.columns: Dict[str, List[str]] = {col: [] for col in columns}
+        self._vectors = np.empty((0, dim), dtype='float32')
+        self.num_rows = 0
+        # filas de cada product_id dentro del delta (la última es la versión más reciente)
+        self.rows: Dict[str, List[int]] = {}
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.lock = threading.Lock()
+        self.lexical = DeltaLexicalIndex(reference=lexical) if lexical is not None else None
+        self.metadata = DeltaMetadataIndex() if with_metadata else None
+
+    @classmethod
+    def build(cls, first_row: int, columns: Dict[str, List[str]], vectors: np.ndarray, live: np.ndarray,
+              lexical: Optional[LexicalIndex] = None, with_metadata: bool = False) -> "DeltaSegment":
+        """Segmento con filas ya existentes (lotes aplicados durante una compactación)."""
+        segment = cls(first_row, list(columns), vectors.shape[1], lexical=lexical, with_metadata=with_metadata)
+        segment.append(columns, vectors, live)
+        return segment
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self.num_rows]
+
+    def append(self, columns: Dict[str, List[str]], vectors: np.ndarray, live: Optional[np.ndarray] = None):
+        """Añade filas al final; live: cuáles entran en el índice FAISS (None -> todas)."""
+        start, n = self.num_rows, len(vectors)
+        if start + n > len(self._vectors):
+            # crece por duplicación; las filas ya escritas no cambian (las vistas viejas leen el buffer viejo)
+            grown = np.empty((max(start + n, 2 * len(self._vectors)), self._vectors.shape[1]), dtype='float32')
+            grown[:start] = self._vectors[:start]
+            self._vectors = grown
+        self._vectors[start:start + n] = vectors
+        for col, values in self.columns.items():
+            values.extend(columns[col])
+        for row, pid in enumerate(columns["product_id"], start=self.first_row + start):
+            self.rows.setdefault(pid, []).append(row)
+        if self.lexical is not None:
+            self.lexical.add(columns[ProductStore.RERANK_COLUMN])
+        if self.metadata is not None:
+            self.metadata.add(columns)
+        rows = np.arange(start, start + n) if live is None else start + np.flatnonzero(live)
+        with self.lock:
+            if len(rows):
+                self.index.add_with_ids(np.ascontiguousarray(self._vectors[rows]), rows + self.first_row)
+            self.num_rows = start + n
+
+    def remove(self, rows: np.ndarray):
+        """Quita filas globales del índice FAISS (sustituidas o borradas); sus textos se quedan."""
+        if len(rows):
+            with self.lock:
+                self.index.remove_ids(np.asarray(rows, dtype=np.int64))
+
+    def search(self, q_np: np.ndarray, top_k: int, num_rows: int,
+               params=None) -> Optional[List[Tuple[List[int], List[float]]]]:
+        """Top-k exacto sobre las filas vivas de las primeras num_rows (filas globales < first_row + num_rows)."""
+        with self.lock:
+            ntotal = self.index.ntotal
+            if not ntotal:
+                return None
+            # filas añadidas después de la vista: se piden de más y se descartan
+            D, I = self.index.search(q_np, min(top_k + self.num_rows - num_rows, ntotal), params=params)
+        results = []
+        for d_row, i_row in zip(D, I):
+            keep = (i_row >= 0) & (i_row < self.first_row + num_rows)
+            results.append((i_row[keep][:top_k].tolist(), d_row[keep][:top_k].tolist()))
+        return results
+
+    # ------------------------------------------------------------------ store (filas locales)
+    def texts(self, column: str, idxs: Sequence[int]) -> List[str]:
+        values = self.columns[column]
+        return [values[i] for i in np.asarray(idxs, dtype=np.int64).tolist()]
+
+    def text(self, column: str, idx: int) -> str:
+        return self.columns[column][idx]
+
+    def empty_rows(self, column: str, num_rows: int) -> np.ndarray:
+        return np.flatnonzero([not v for v in self.columns[column][:num_rows]])
+
+    def nbytes(self, num_rows: int) -> int:
+        texts = sum(len(v) for values in self.columns.values() for v in values[:num_rows])
+        return int(texts + self._vectors[:num_rows].nbytes)
+
+    def row_of(self, product_id: str, limit: int) -> Optional[int]:
+        """Fila global más reciente de product_id por debajo de limit (filas visibles para una vista)."""
+        for row in reversed(self.rows.get(product_id, ())):
+            if row < limit:
+                return row
+        return None
+
+
+class CatalogView:
+    """
+    Estado inmutable del catálogo que ve una búsqueda: base + delta + tombstones.
+      - deleted: bool por fila global (tombstones); los de la base se excluyen de la búsqueda ANN con un
+        selector y los del delta se quitan de su índice (remove_ids)
+      - delta: segmento compartido con las vistas anteriores y siguientes; esta sólo ve sus primeras
+        num_delta filas
+      - vectors: vectores de re-scoring de la base (EXACT_RESCORE); originals: vectores originales de la
+        base (vectors, EMBEDDINGS_PATH mapeado o los de una compactación en memoria) para compactar
+        sin reconstruirlos de un índice con pérdida
+    Los bitmaps de filtros se cachean por vista; la parte de la base en una cache que comparten todas
+    las vistas con la misma base.
+    """
+    def __init__(self, version: int, index, store: ProductStore, lexical: Optional[LexicalIndex],
+                 metadata: Optional[MetadataIndex], vectors: Optional[np.ndarray], deleted: np.ndarray,
+                 delta: Optional[DeltaSegment] = None, watermark: str = "",
+                 base_filter_cache: Optional[LRUCache] = None, filter_cache_size: int = 256,
+                 originals: Optional[np.ndarray] = None):
+        self.version = version
+        self.index = index
+        self.base_store = store
+        self.lexical = lexical
+        self.metadata = metadata
+        self.vectors = vectors
+        self.originals = originals if originals is not None else vectors
+        self.deleted = deleted
+        self.delta = delta
+        self.watermark = watermark
+        self.num_base = len(store)
+        self.num_rows = self.num_base + (len(delta) if delta is not None else 0)
+        self.num_deleted = int(deleted.sum())
+        # tombstones que siguen dentro del índice base (necesitan selector en la búsqueda ANN)
+        self.index_tombstones = int(np.count_nonzero(deleted[:self.num_base]))
+        self.store = OverlayStore(store, delta, deleted)
+        self.base_filter_cache = base_filter_cache if base_filter_cache is not None else LRUCache(filter_cache_size)
+        self.filter_cache = LRUCache(maxsize=self.base_filter_cache.maxsize)
+        self._live_packed: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_base(cls, index, store: ProductStore, lexical, metadata, vectors, filter_cache: LRUCache,
+                  watermark: str = "", originals: Optional[np.ndarray] = None) -> "CatalogView":
+        """Vista inicial de un build/compactación persistida (las filas sin product_id no son productos)."""
+        deleted = np.zeros(len(store), dtype=bool)
+        deleted[store.empty_rows("product_id")] = True
+        return cls(0, index, store, lexical, metadata, vectors, deleted, watermark=watermark,
+                   base_filter_cache=filter_cache, originals=originals)
+
+    @property
+    def num_delta(self) -> int:
+        return self.num_rows - self.num_base
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "rows": self.num_rows,
+            "live_rows": self.num_rows - self.num_deleted,
+            "base_rows": self.num_base,
+            "delta_rows": self.num_delta,
+            "tombstones": self.num_deleted,
+            "index_tombstones": self.index_tombstones,
+            "watermark": self.watermark,
+        }
+
+    # ------------------------------------------------------------------ filtros / máscaras
+    def live_bitmap(self) -> Optional[np.ndarray]:
+        """Bitmap de filas vivas, o None si el índice base no contiene tombstones (sin selector)."""
+        if not self.index_tombstones:
+            return None
+        if self._live_packed is None:
+            self._live_packed = np.packbits(~self.deleted, bitorder="little")
+        return self._live_packed
+
+    def live_mask(self) -> Optional[np.ndarray]:
+        return ~self.deleted if self.num_deleted else None
+
+    def filter_bitmap(self, filters: ProductFilter) -> Tuple[np.ndarray, int]:
+        """(bitmap empaquetado sobre las filas globales, nº de filas) del filtro, sin las filas borradas."""
+        if self.metadata is None:
+            raise ValueError("metadata filters are not available: the product store has no metadata columns")
+        cached = self.filter_cache.get(filters)
+        if cached is not None:
+            return cached
+        with metrics.timer("filter_bitmap"):
+            base = self.base_filter_cache.get(filters)
+            if base is None:
+                base = self.metadata.bitmap(filters)
+                self.base_filter_cache.put(filters, base)
+            if self.delta is None and not self.num_deleted:
+                cached = base
+            else:
+                mask = self.metadata.mask(base[0])
+                if self.delta is not None:
+                    mask = np.concatenate([mask, self.delta.metadata.mask(filters, self.num_delta)])
+                mask &= ~self.deleted
+                cached = (np.packbits(mask, bitorder="little"), int(mask.sum()))
+        self.filter_cache.put(filters, cached)
+        return cached
+
+    def mask(self, packed: np.ndarray) -> np.ndarray:
+        return _packed_mask(packed, self.num_rows)
+
+    def rows(self, packed: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(self.mask(packed))
+
+    # ------------------------------------------------------------------ búsqueda
+    def search_delta(self, q_np: np.ndarray, top_k: int,
+                     packed: Optional[np.ndarray] = None) -> Optional[List[Tuple[List[int], List[float]]]]:
+        """Top-k exacto sobre las filas vivas del delta (packed: bitmap de filtro sobre filas globales)."""
+        if self.delta is None:
+            return None
+        params = search_parameters(self.delta.index, sel=bitmap_selector(packed)) if packed is not None else None
+        return self.delta.search(q_np, top_k, self.num_delta, params=params)
+
+    def lexical_search(self, query: str, top_k: int,
+                       mask: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """BM25 sobre base + delta; mask: bool por fila global (None -> todas las filas vivas)."""
+        if mask is None:
+            mask = self.live_mask()
+        ids, scores = self.lexical.search(query, top_k, mask=mask[:self.num_base] if mask is not None else None)
+        if self.delta is None or self.delta.lexical is None:
+            return ids, scores
+        d_ids, d_scores = self.delta.lexical.search(query, top_k, num_docs=self.num_delta,
+                                                    mask=mask[self.num_base:] if mask is not None else None)
+        return merge_topk((ids, scores), ([i + self.num_base for i in d_ids], d_scores), top_k)
+
+    def subset_vectors(self, rows: np.ndarray) -> Optional[np.ndarray]:
+        """Vectores de filas globales (los originales si los hay, si no reconstruidos del índice)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        in_delta = rows >= self.num_base
+        out = None
+        if in_delta.any():
+            out = np.empty((len(rows), self.delta.vectors.shape[1]), dtype='float32')
+            out[in_delta] = self.delta.vectors[rows[in_delta] - self.num_base]  # < num_delta: filas ya escritas
+            if in_delta.all():
+                return out
+        base_rows = rows[~in_delta]
+        if self.originals is not None:
+            base = np.asarray(self.originals[base_rows], dtype='float32')
+        else:
+            try:
+                base = self.index.reconstruct_batch(base_rows)
+            except RuntimeError:
+                return None
+        if out is None:
+            return base
+        out[~in_delta] = base
+        return out
+
+
+class LiveCatalog:
+    """
+    Ingesta de cambios del catálogo sobre el Retriever:
+      - apply(ops): embebe en lotes los productos nuevos o modificados, marca tombstones, construye la
+        vista siguiente y la publica (retriever.swap_view) bajo un lock de escritura que sólo excluye
+        a otros escritores
+      - delta_dir: log de lotes en disco compartido por todos los workers; upsert/delete escriben un
+        lote en el log y lo aplican, y un watcher aplica los lotes de los demás cada poll_s segundos
+      - compactación en background cuando tombstones / filas de la base >= compact_tombstone_ratio o el
+        delta llega a compact_delta_rows: la base nueva tiene sólo las filas vivas, renumeradas; con
+        persist, este proceso reescribe índice, store, BM25, embeddings y manifest y pasa a mapear
+        (mmap) los ficheros escritos
+      - follow_persisted: otro proceso compacta y persiste; este no compacta y, en cada poll, si el
+        manifest describe una base posterior a la suya la mapea de disco y re-aplica los lotes posteriores
+        a su watermark. Lo mismo hace cualquier proceso que arranca con una base vieja
+      - elect_persister: persist / follow_persisted se deciden con un flock no bloqueante sobre
+        <manifest>.persister.lock que el ganador mantiene mientras vive: un único persistidor entre todos
+        los procesos (prefork, uvicorn --workers, gunicorn); si muere, otro lo sustituye en su siguiente poll
+    on_swap: callbacks tras publicar cambios (p.ej. invalidar caches de resultados y respuestas).
+    """
+    def __init__(self, retriever, delta_dir: str = "", poll_s: float = 2.0, embed_batch_size: int = 256,
+                 compact_tombstone_ratio: float = 0.1, compact_delta_rows: int = 20000,
+                 index_builder: Optional[Callable[[np.ndarray], Any]] = None, persist: bool = False,
+                 follow_persisted: bool = False, elect_persister: bool = False,
+                 on_swap: Sequence[Callable[[], None]] = ()):
+        self.retriever = retriever
+        self.delta_dir = delta_dir
+        self.poll_s = poll_s
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.compact_tombstone_ratio = compact_tombstone_ratio
+        self.compact_delta_rows = compact_delta_rows
+        # vectores -> índice posicional (fila i = vectors[i]); por defecto un IndexFlatIP
+        self.index_builder = index_builder or self._flat_index
+        self.persist = persist
+        self.follow_persisted = follow_persisted
+        self.elect_persister = elect_persister
+        self._persister_lock = None  # fichero abierto con el flock del persistidor
+        self.on_swap = list(on_swap)
+        self._write_lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._applied: set = set()
+        self._floor = ""  # ficheros <= floor ya están en la base cargada
+        self._base_key: Tuple[Optional[str], str] = (None, "")  # base cargada: (compacted_at, watermark)
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._compactor: Optional[threading.Thread] = None
+        self.last_compaction: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _manifest_key(manifest: Optional[dict]) -> Tuple[Optional[str], str]:
+        manifest = manifest or {}
+        return manifest.get("compacted_at"), manifest.get("catalog_watermark") or ""
+
+    @staticmethod
+    def _flat_index(vectors: np.ndarray):
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(np.ascontiguousarray(vectors, dtype='float32'))
+        return index
+
+    # ------------------------------------------------------------------ ciclo de vida
+    def start(self):
+        """
+        Aplica el log pendiente y arranca el watcher (en cada worker: los threads no sobreviven al fork).
+        El punto de partida es la base que cargó este proceso (en prefork, el padre): si desde entonces se
+        ha persistido otra, el primer poll la carga.
+        """
+        self._floor = self.retriever.view.watermark
+        self._base_key = self._manifest_key(self.retriever.manifest)
+        self._elect()
+        self.poll()
+        if self.delta_dir and self.poll_s > 0 and self._watcher is None:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+            self._watcher.start()
+            logger.info("Catalog watcher polling %s every %.1fs", self.delta_dir, self.poll_s)
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=self.poll_s + 5)
+            self._watcher = None
+        if self._persister_lock is not None:
+            self._persister_lock.close()  # libera el flock: otro proceso pasa a persistir
+            self._persister_lock = None
+
+    def _elect(self):
+        """Con elect_persister, intenta quedarse el flock del persistidor (sin esperar) si aún no lo tiene."""
+        if not self.elect_persister or self._persister_lock is not None:
+            return
+        r = self.retriever
+        lock = open(f"{r.manifest_path or r.index_path}.persister.lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            self.persist, self.follow_persisted = False, True
+            return
+        self._persister_lock = lock
+        self.persist, self.follow_persisted = True, False
+        logger.info("Process %d compacts and persists the live catalog", os.getpid())
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_s):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Catalog delta poll failed")
+
+    # ------------------------------------------------------------------ ingesta
+    def upsert(self, products: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return self.submit([{"op": "upsert", "product": p} for p in products])
+
+    def delete(self, product_ids: List[Any]) -> Dict[str, Any]:
+        return self.submit([{"op": "delete", "product_id": pid} for pid in product_ids])
+
+    def submit(self, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Con delta_dir: añade el lote al log (lo verán todos los workers) y aplica lo pendiente."""
+        ops = validate_ops(ops)
+        if not self.delta_dir:
+            return self.apply(ops)
+        name = write_delta_file(self.delta_dir, ops)
+        logger.info("Catalog delta %s written (%d ops)", name, len(ops))
+        return self.poll()
+
+    def poll(self) -> Dict[str, Any]:
+        """Aplica en un solo lote los ficheros del log que este proceso aún no ha aplicado."""
+        with self._poll_lock:
+            self._elect()
+            self._sync_persisted_base()
+            listed = list_delta_files(self.delta_dir, after=self._floor)
+            # olvida los ficheros ya borrados del log
+            self._applied.intersection_update(listed)
+            names = [n for n in listed if n not in self._applied]
+            if not names:
+                return {"applied_files": 0, **self.retriever.view.stats()}
+            result = self.apply(self._read_files(names), files=names)
+            self._applied.update(names)
+            return {"applied_files": len(names), **result}
+
+    def apply(self, ops: List[Dict[str, Any]], files: Sequence[str] = ()) -> Dict[str, Any]:
+        """Aplica un lote de operaciones (la última operación sobre un product_id gana)."""
+        products, deletes = self._latest(ops)
+        t0 = time.perf_counter()
+        with metrics.timer("catalog_apply"):
+            columns, vectors = self._embed(products)
+            with self._write_lock:
+                view = self.retriever.view
+                new_view, missing = self._next_view(view, columns, vectors, deletes, files)
+                self.retriever.swap_view(new_view)
+        for callback in self.on_swap:
+            callback()
+        metrics.inc("catalog_ops_total", len(products), op="upsert")
+        metrics.inc("catalog_ops_total", len(deletes) - missing, op="delete")
+        stats = new_view.stats()
+        logger.info("Catalog v%d: %d upserts, %d deletes (%d unknown) in %.0fms; %d rows, %d delta, %d tombstones",
+                    new_view.version, len(products), len(deletes), missing, (time.perf_counter() - t0) * 1000,
+                    stats["rows"], stats["delta_rows"], stats["tombstones"])
+        self.maybe_compact()
+        return {"upserted": len(products), "deleted": len(deletes) - missing, "unknown_deletes": missing, **stats}
+
+    @staticmethod
+    def _latest(ops: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """(productos a insertar, product_ids a borrar) con la última operación de cada product_id."""
+        latest: Dict[str, Dict[str, Any]] = {}
+        for op in validate_ops(ops):
+            pid = op["product"]["product_id"] if op["op"] == "upsert" else op["product_id"]
+            latest.pop(pid, None)  # reinsertar al final: orden de la última operación
+            latest[pid] = op
+        products = [op["product"] for op in latest.values() if op["op"] == "upsert"]
+        deletes = [pid for pid, op in latest.items() if op["op"] == "delete"]
+        return products, deletes
+
+    def _read_files(self, names: Sequence[str]) -> List[Dict[str, Any]]:
+        ops = []
+        for name in names:
+            try:
+                ops.extend(read_delta_file(self.delta_dir, name))
+            except OSError as e:
+                # borrado por la compactación de otro proceso: ya está en la base persistida
+                logger.warning("Could not read catalog delta %s: %s", name, e)
+        return ops
+
+    def _embed(self, products: List[Dict[str, Any]]) -> Tuple[Dict[str, List[str]], Optional[np.ndarray]]:
+        if not products:
+            return {}, None
+        columns = ProductStore.text_columns(pd.DataFrame(products))
+        texts = embedding_texts(pd.DataFrame({"product_name": columns["product_name"],
+                                              "product_description": columns["product_description"]}))
+        vectors = np.concatenate([
+            self.retriever.encode_documents(texts[start:start + self.embed_batch_size])
+            for start in range(0, len(texts), self.embed_batch_size)
+        ])
+        return columns, vectors
+
+    def _next_view(self, view: CatalogView, columns: Dict[str, List[str]], vectors: Optional[np.ndarray],
+                   deletes: List[str], files: Sequence[str]) -> Tuple[CatalogView, int]:
+        n_new = len(vectors) if vectors is not None else 0
+        deleted = np.concatenate([view.deleted, np.zeros(n_new, dtype=bool)])
+        missing = 0
+        for pid in columns.get("product_id", []):
+            row = view.store.row_of(pid)
+            if row is not None:
+                deleted[row] = True
+        for pid in deletes:
+            row = view.store.row_of(pid)
+            if row is None:
+                missing += 1
+            else:
+                deleted[row] = True
+        delta = view.delta
+        if delta is not None and len(delta) != view.num_delta:
+            # el segmento ya creció desde otra vista (no pasa con una sola cadena de vistas): copia propia
+            delta = self._segment(view, np.arange(view.num_base, view.num_rows), view.deleted[view.num_base:],
+                                  view.num_base, view.lexical, view.metadata) if view.num_delta else None
+        if delta is not None:
+            # filas del delta sustituidas o borradas en este lote
+            delta.remove(view.num_base + np.flatnonzero(deleted[view.num_base:view.num_rows]
+                                                        & ~view.deleted[view.num_base:]))
+        if n_new:
+            if delta is None:
+                delta = DeltaSegment(view.num_base, view.base_store.columns, vectors.shape[1], lexical=view.lexical,
+                                     with_metadata=view.metadata is not None)
+            # el delta tiene las mismas columnas que la base (las que falten, vacías)
+            delta.append({col: columns.get(col, [""] * n_new) for col in view.base_store.columns}, vectors)
+        watermark = max([view.watermark, *files])
+        new_view = CatalogView(view.version + 1, view.index, view.base_store, view.lexical, view.metadata,
+                               view.vectors, deleted, delta=delta, watermark=watermark,
+                               base_filter_cache=view.base_filter_cache, originals=view.originals)
+        return new_view, missing
+
+    @staticmethod
+    def _segment(view: CatalogView, rows: np.ndarray, deleted: np.ndarray, first_row: int,
+                 lexical: Optional[LexicalIndex], metadata: Optional[MetadataIndex]) -> DeltaSegment:
+        """Segmento nuevo con las filas globales rows de view (deleted: sus tombstones) desde first_row."""
+        columns = {col: view.store.texts(col, rows) for col in view.base_store.columns}
+        return DeltaSegment.build(first_row, columns, view.subset_vectors(rows), ~deleted, lexical=lexical,
+                                  with_metadata=metadata is not None)
+
+    # ------------------------------------------------------------------ compactación
+    def needs_compaction(self, view: Optional[CatalogView] = None) -> bool:
+        view = view or self.retriever.view
+        if view.index_tombstones and view.index_tombstones / max(1, view.num_base) >= self.compact_tombstone_ratio:
+            return True
+        return self.compact_delta_rows > 0 and view.num_delta >= self.compact_delta_rows
+
+    def maybe_compact(self):
+        if self.follow_persisted or not self.needs_compaction() or self._compact_lock.locked():
+            return
+        self._compactor = threading.Thread(target=self._compact_background, name="catalog-compaction", daemon=True)
+        self._compactor.start()
+
+    def _compact_background(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Catalog compaction failed")
+
+    def compact(self, persist: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Reconstruye la base con las filas vivas de la vista actual (sin bloquear búsquedas ni lotes) y
+        publica la vista compactada con los lotes que llegaron mientras tanto. Un único compactador a la vez.
+        """
+        if self.follow_persisted:
+            return {"status": "skipped", "reason": "another process compacts and persists the catalog"}
+        if not self._compact_lock.acquire(blocking=False):
+            return {"status": "running"}
+        try:
+            with metrics.timer("catalog_compact"):
+                result = self._compact(self.persist if persist is None else persist)
+            self.last_compaction = result
+            return result
+        finally:
+            self._compact_lock.release()
+
+    def _compact(self, persist: bool) -> Dict[str, Any]:
+        """
+        Las filas vivas de la foto (snap) pasan a ser las filas 0..n-1 de la base nueva, en el mismo orden
+        (live[i] -> i): store, BM25, bitsets, embeddings y un índice posicional se construyen densos.
+        """
+        t0 = time.perf_counter()
+        snap = self.retriever.view
+        num_rows = snap.num_rows
+        live = np.flatnonzero(~snap.deleted)
+        if not len(live):
+            return {"status": "skipped", "reason": "no live rows"}
+        if snap.originals is None and not reconstructs_exactly(snap.index):
+            # reconstruir de PQ/SQ y reindexar acumula el error de cuantización en cada compactación
+            logger.error("Catalog compaction skipped: the base index only stores compressed vectors and the "
+                         "original ones (EMBEDDINGS_PATH %r) are not available; compacting would lose recall on "
+                         "every pass. Rebuild with build-index to write them.", self.retriever.embeddings_path)
+            return {"status": "skipped", "reason": "original vectors not available for a lossy index"}
+        d = snap.index.d
+        vectors = np.empty((len(live), d), dtype='float32')
+        for start in range(0, len(live), 65536):
+            block = snap.subset_vectors(live[start:start + 65536])
+            if block is None:
+                logger.warning("Catalog compaction needs the original vectors (EMBEDDINGS_PATH) or an index "
+                               "that can reconstruct them; skipping.")
+                return {"status": "skipped", "reason": "vectors not available"}
+            vectors[start:start + len(block)] = block
+        index = self.index_builder(vectors)
+        exact = reconstructs_exactly(index)
+        if snap.vectors is None:
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.make_direct_map()
+        store = ProductStore.from_columns({col: snap.store.texts(col, live) for col in snap.base_store.columns})
+        lexical = LexicalIndex.build_from_store(store) if snap.lexical is not None else None
+        metadata = MetadataIndex.from_store(store) if snap.metadata is not None else None
+        # vectores por fila nueva: re-scoring exacto y/o EMBEDDINGS_PATH alineado con el store; si la base
+        # nueva sólo se sirve de memoria y su índice es con pérdida, se guardan para la siguiente compactación
+        rescore = vectors if snap.vectors is not None else None
+        originals = rescore if rescore is not None or exact else vectors
+        build_s = time.perf_counter() - t0
+        persisted = None
+        if persist:
+            manifest = self._persist(index, store, lexical, vectors, snap.watermark)
+            persisted = manifest is not None
+            if persisted:
+                try:
+                    # se sirven los ficheros recién escritos (mmap), compartidos con los demás workers
+                    base = self._load_persisted_base(manifest, lexical=lexical, metadata=metadata)
+                    index, store, rescore, originals = base.index, base.base_store, base.vectors, base.originals
+                    self._base_key = self._manifest_key(manifest)
+                except (OSError, ValueError) as e:
+                    logger.warning("Could not map the persisted catalog base (%s); serving it from memory.", e)
+        del vectors
+
+        with self._write_lock:
+            cur = self.retriever.view
+            # bajas de filas de la foto aplicadas durante la compactación: tombstones de la base nueva
+            deleted = np.concatenate([cur.deleted[live], cur.deleted[num_rows:]])
+            delta = None
+            if cur.num_rows > num_rows:
+                # lotes aplicados durante la compactación: pasan a ser el delta de la base nueva
+                delta = self._segment(cur, np.arange(num_rows, cur.num_rows), deleted[len(live):], len(live),
+                                      lexical, metadata)
+            view = CatalogView(cur.version + 1, index, store, lexical, metadata, rescore, deleted,
+                               delta=delta, watermark=cur.watermark,
+                               filter_cache_size=cur.base_filter_cache.maxsize, originals=originals)
+            self.retriever.swap_view(view)
+        result = {"status": "done", "build_s": round(build_s, 2), "compacted_rows": int(len(live)),
+                  "removed_rows": int(num_rows - len(live)), **view.stats()}
+        if persisted is not None:
+            result["persisted"] = persisted
+        logger.info("Catalog compacted in %.1fs: %d rows -> %d live rows", build_s, num_rows, len(live))
+        return result
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        """flock sobre <manifest>.lock: LOCK_EX al escribir la base, LOCK_SH al mapearla."""
+        r = self.retriever
+        with open(f"{r.manifest_path or r.index_path}.lock", "a") as lock:
+            fcntl.flock(lock, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _persist(self, index, store: ProductStore, lexical: Optional[LexicalIndex],
+                 vectors: Optional[np.ndarray], watermark: str) -> Optional[dict]:
+        """
+        Escribe la base compactada (tmp + rename) para que los demás workers y los arranques siguientes
+        partan de ella. Devuelve el manifest escrito (None si no hay dónde escribir el store).
+        """
+        r = self.retriever
+        if not r.product_store_dir:
+            logger.warning("CATALOG_PERSIST needs PRODUCT_STORE_DIR; the compacted catalog stays in memory.")
+            return None
+        with self._file_lock(fcntl.LOCK_EX):
+            suffix = f".tmp-{os.getpid()}"
+            directory = r.product_store_dir.rstrip("/")
+            store.save(directory + suffix)
+            replace_dir(directory + suffix, directory)
+            faiss.write_index(index, r.index_path + suffix)
+            os.replace(r.index_path + suffix, r.index_path)
+            if lexical is not None and r.lexical_index_path:
+                tmp = f"{r.lexical_index_path}{suffix}.npz"  # np.savez añade .npz si falta
+                lexical.save(tmp)
+                os.replace(tmp, r.lexical_index_path)
+            if vectors is not None and r.embeddings_path:
+                tmp = f"{r.embeddings_path}{suffix}.npy"
+                np.save(tmp, vectors)
+                os.replace(tmp, r.embeddings_path)
+            manifest = read_manifest(r.manifest_path) or {"model_name": r.embed_model_name, "dim": int(index.d)}
+            manifest.update({
+                "num_rows": len(store),
+                "catalog_watermark": watermark,
+                "compacted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            })
+            if r.manifest_path:
+                write_json_atomic(r.manifest_path, manifest)
+        self._floor = max(self._floor, watermark)
+        if self.delta_dir:
+            # los demás workers leen el log cada poll_s: se dejan los ficheros recientes
+            removed = prune_delta_files(self.delta_dir, watermark, min_age_s=max(60.0, 10 * self.poll_s))
+            self._applied = {n for n in self._applied if n > self._floor}
+            logger.info("Catalog persisted (watermark %s); %d delta files pruned", watermark or "-", removed)
+        return manifest
+
+    # ------------------------------------------------------------------ base persistida por otro proceso
+    def _load_persisted_base(self, manifest: dict, lexical: Optional[LexicalIndex] = None,
+                             metadata: Optional[MetadataIndex] = None) -> CatalogView:
+        # LOCK_SH: el compactador no reescribe los ficheros mientras se mapean; load_base los valida
+        # contra el manifest por si otra compactación los cambió después de leerlo
+        with self._file_lock(fcntl.LOCK_SH):
+            return self.retriever.load_base(manifest, lexical=lexical, metadata=metadata)
+
+    def _sync_persisted_base(self):
+        """Si el manifest describe una base persistida distinta de la cargada, la carga (ver _reload_base)."""
+        if not self.retriever.manifest_path or not self.retriever.product_store_dir:
+            return
+        manifest = read_manifest(self.retriever.manifest_path)
+        if manifest is None or self._manifest_key(manifest) == self._base_key:
+            return
+        # excluye una compactación propia en curso (también cambia la base); se reintenta en el siguiente poll
+        if not self._compact_lock.acquire(blocking=False):
+            return
+        try:
+            self._reload_base(manifest)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load the persisted catalog base (retrying on the next poll): %s", e)
+        finally:
+            self._compact_lock.release()
+
+    def _reload_base(self, manifest: dict):
+        """
+        Sustituye la base por la persistida (mmap) y vuelve a aplicar encima los lotes del log posteriores
+        a su watermark (se re-embeben: son los pocos llegados desde la compactación). Se publica una sola
+        vista con todo, así que las búsquedas nunca ven la base sin esos lotes.
+        """
+        t0 = time.perf_counter()
+        base = self._load_persisted_base(manifest)
+        names = list_delta_files(self.delta_dir, after=base.watermark)
+        products, deletes = self._latest(self._read_files(names))
+        columns, vectors = self._embed(products)
+        with self._write_lock:
+            base.version = self.retriever.view.version  # aún sin publicar: view será la versión siguiente
+            view, _ = self._next_view(base, columns, vectors, deletes, names)
+            self.retriever.swap_view(view)
+        self._floor = base.watermark
+        self._applied = set(names)
+        self._base_key = self._manifest_key(manifest)
+        for callback in self.on_swap:
+            callback()
+        logger.info("Catalog v%d: loaded the persisted base (%d rows, watermark %s) and re-applied %d delta "
+                    "files in %.0fms", view.version, base.num_rows, base.watermark or "-", len(names),
+                    (time.perf_counter() - t0) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        view = self.retriever.view
+        return {
+            **view.stats(),
+            "needs_compaction": self.needs_compaction(view),
+            "compacting": self._compact_lock.locked(),
+            "last_compaction": self.last_compaction,
+            "delta_dir": self.delta_dir or None,
+            "follow_persisted": self.follow_persisted,
+            "pending_files": len([n for n in list_delta_files(self.delta_dir, after=self._floor)
+                                  if n not in self._applied]),
+        }
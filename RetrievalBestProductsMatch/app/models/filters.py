@@ -0,0 +1,224 @@
+# app/models/filters.py
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CLASS_COLUMN = "product_class"
+CATEGORY_COLUMN = "category hierarchy"
+NUMERIC_COLUMNS = ("average_rating", "rating_count", "review_count")
+FILTER_COLUMNS = (CLASS_COLUMN, CATEGORY_COLUMN) + NUMERIC_COLUMNS
+# rangos numéricos del filtro -> (columna, operador)
+_RANGES = {
+    "min_rating": ("average_rating", ">="),
+    "max_rating": ("average_rating", "<="),
+    "min_rating_count": ("rating_count", ">="),
+    "min_review_count": ("review_count", ">="),
+}
+
+
+def _norm_value(value: str) -> str:
+    return " ".join(str(value).split()).lower()
+
+
+def _norm_category(path: str) -> str:
+    # 'Furniture/Living Room Furniture ' -> 'furniture / living room furniture'
+    return " / ".join(_norm_value(level) for level in str(path).split("/") if level.strip())
+
+
+def _category_prefixes(path: str) -> List[str]:
+    levels = _norm_category(path).split(" / ") if path else []
+    return [" / ".join(levels[:i]) for i in range(1, len(levels) + 1)]
+
+
+def _class_keys(value: str) -> List[str]:
+    return [_norm_value(value)] if value.strip() else []
+
+
+def _numeric_values(values: List[str]) -> np.ndarray:
+    # celdas vacías o no numéricas ('N/A', '4.5 stars') -> NaN: no pasan ningún rango
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float32)
+
+
+def _check_ranges(product_filter: "ProductFilter", numeric: Dict[str, Any]):
+    """ValueError si el filtro tiene un rango sobre una columna numérica que el store no tiene."""
+    for field, (col, _) in _RANGES.items():
+        if getattr(product_filter, field) is not None and col not in numeric:
+            raise ValueError(f"filter {field!r} needs the {col!r} column in the product store")
+
+
+def _range_mask(product_filter: "ProductFilter", numeric: Dict[str, np.ndarray]) -> Optional[np.ndarray]:
+    """AND de los rangos numéricos del filtro (None si no tiene ninguno)."""
+    _check_ranges(product_filter, numeric)
+    mask = None
+    for field, (col, op) in _RANGES.items():
+        bound = getattr(product_filter, field)
+        if bound is None:
+            continue
+        values = numeric[col]
+        cond = values >= bound if op == ">=" else values <= bound
+        mask = cond if mask is None else np.logical_and(mask, cond, out=mask)
+    return mask
+
+
+class ProductFilter:
+    """
+    Filtro de metadatos de una request (inmutable y hashable: forma parte de la clave de la QueryCache):
+      - product_class: clase exacta (sin distinguir mayúsculas)
+      - category: prefijo de 'category hierarchy' por niveles ('Furniture / Bedroom Furniture')
+      - min_rating / max_rating (average_rating), min_rating_count, min_review_count
+    Los productos sin valor en una columna numérica no pasan un rango sobre esa columna.
+    """
+    FIELDS = ("product_class", "category") + tuple(_RANGES)
+
+    def __init__(self, product_class: Optional[str] = None, category: Optional[str] = None,
+                 min_rating: Optional[float] = None, max_rating: Optional[float] = None,
+                 min_rating_count: Optional[float] = None, min_review_count: Optional[float] = None):
+        self.product_class = _norm_value(product_class) if product_class else None
+        self.category = _norm_category(category) if category else None
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self.min_rating_count = min_rating_count
+        self.min_review_count = min_review_count
+
+    @classmethod
+    def from_dict(cls, values: Optional[Dict[str, Any]]) -> Optional["ProductFilter"]:
+        """None si no hay ningún campo con valor (sin filtro)."""
+        values = {k: v for k, v in (values or {}).items() if k in cls.FIELDS and v not in (None, "")}
+        return cls(**values) if values else None
+
+    def key(self) -> tuple:
+        return tuple((f, getattr(self, f)) for f in self.FIELDS if getattr(self, f) is not None)
+
+    def __eq__(self, other):
+        return isinstance(other, ProductFilter) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return "ProductFilter(" + ", ".join(f"{f}={v!r}" for f, v in self.key()) + ")"
+
+
+class MetadataIndex:
+    """
+    Bitsets precalculados por valor de metadato sobre las filas del ProductStore (= ids del índice FAISS):
+      - un bitmap empaquetado (np.packbits, orden de bits LSB-first como faiss.IDSelectorBitmap)
+        por product_class y por cada prefijo de 'category hierarchy'
+      - columnas numéricas (average_rating, rating_count, review_count) como float32 (NaN = sin dato)
+    Resolver un filtro es un AND de bitmaps de n/8 bytes más las comparaciones numéricas: el bitmap
+    resultante se pasa tal cual como selector de la búsqueda FAISS.
+    """
+    def __init__(self, num_rows: int, classes: Dict[str, np.ndarray], categories: Dict[str, np.ndarray],
+                 numeric: Dict[str, np.ndarray]):
+        self.num_rows = num_rows
+        self.classes = classes
+        self.categories = categories
+        self.numeric = numeric
+
+    @staticmethod
+    def _bitmaps(values: List[List[str]], num_rows: int) -> Dict[str, np.ndarray]:
+        rows: Dict[str, List[int]] = {}
+        for row, keys in enumerate(values):
+            for key in keys:
+                rows.setdefault(key, []).append(row)
+        bitmaps = {}
+        for key, idxs in rows.items():
+            mask = np.zeros(num_rows, dtype=bool)
+            mask[idxs] = True
+            bitmaps[key] = np.packbits(mask, bitorder="little")
+        return bitmaps
+
+    @classmethod
+    def from_store(cls, store) -> "MetadataIndex":
+        n = len(store)
+        classes, categories = {}, {}
+        if CLASS_COLUMN in store.columns:
+            classes = cls._bitmaps([_class_keys(v) for v in store.column(CLASS_COLUMN)], n)
+        if CATEGORY_COLUMN in store.columns:
+            categories = cls._bitmaps([_category_prefixes(v) for v in store.column(CATEGORY_COLUMN)], n)
+        numeric = {col: _numeric_values(store.column(col)) for col in NUMERIC_COLUMNS if col in store.columns}
+        index = cls(n, classes, categories, numeric)
+        logger.info("Metadata index: %d classes, %d category prefixes, %.1f MB", len(classes), len(categories),
+                    index.nbytes() / 1e6)
+        return index
+
+    def nbytes(self) -> int:
+        maps = list(self.classes.values()) + list(self.categories.values()) + list(self.numeric.values())
+        return int(sum(m.nbytes for m in maps))
+
+    def validate(self, product_filter: ProductFilter):
+        """ValueError si el filtro usa una columna que el store no tiene (la API responde 400)."""
+        _check_ranges(product_filter, self.numeric)
+
+    def bitmap(self, product_filter: ProductFilter) -> Tuple[np.ndarray, int]:
+        """(bitmap empaquetado de las filas que cumplen el filtro, nº de filas)."""
+        empty = np.zeros((self.num_rows + 7) // 8, dtype=np.uint8)
+        packed = None
+        for key, bitmaps in ((product_filter.product_class, self.classes), (product_filter.category, self.categories)):
+            if key is None:
+                continue
+            if key not in bitmaps:
+                return empty, 0
+            packed = bitmaps[key].copy() if packed is None else np.bitwise_and(packed, bitmaps[key], out=packed)
+        mask = _range_mask(product_filter, self.numeric)
+        if mask is not None:
+            ranged = np.packbits(mask, bitorder="little")
+            packed = ranged if packed is None else np.bitwise_and(packed, ranged, out=packed)
+        if packed is None:
+            packed = np.packbits(np.ones(self.num_rows, dtype=bool), bitorder="little")
+        count = int(self.mask(packed).sum())
+        return packed, count
+
+    def mask(self, packed: np.ndarray) -> np.ndarray:
+        return np.unpackbits(packed, bitorder="little", count=self.num_rows).astype(bool)
+
+    def rows(self, packed: np.ndarray) -> np.ndarray:
+        """Filas (int64, ordenadas) marcadas en un bitmap empaquetado."""
+        return np.flatnonzero(self.mask(packed))
+
+
+class DeltaMetadataIndex:
+    """
+    Metadatos del delta del catálogo vivo, que crecen por lotes sin rehacerse: postings (filas) por
+    product_class y por prefijo de 'category hierarchy' y columnas numéricas como listas. mask() evalúa
+    un filtro sobre las primeras num_rows filas, así que un lector no necesita lock aunque otro thread
+    esté añadiendo filas.
+    """
+    def __init__(self):
+        self.num_rows = 0
+        self.classes: Dict[str, List[int]] = {}
+        self.categories: Dict[str, List[int]] = {}
+        self.numeric: Dict[str, List[float]] = {}
+
+    def add(self, columns: Dict[str, List[str]]):
+        """Añade filas al final con las columnas de texto del ProductStore (las que falten no se indexan)."""
+        start = self.num_rows
+        for col, postings, keys in ((CLASS_COLUMN, self.classes, _class_keys),
+                                    (CATEGORY_COLUMN, self.categories, _category_prefixes)):
+            for row, value in enumerate(columns.get(col, ()), start=start):
+                for key in keys(value):
+                    postings.setdefault(key, []).append(row)
+        for col in NUMERIC_COLUMNS:
+            if col in columns:
+                self.numeric.setdefault(col, []).extend(_numeric_values(columns[col]).tolist())
+        self.num_rows = start + len(columns["product_id"])
+
+    def mask(self, product_filter: ProductFilter, num_rows: int) -> np.ndarray:
+        """bool por fila (las primeras num_rows) que cumple el filtro."""
+        mask = np.ones(num_rows, dtype=bool)
+        for key, postings in ((product_filter.product_class, self.classes), (product_filter.category, self.categories)):
+            if key is None:
+                continue
+            rows = np.asarray(postings.get(key, [])[:], dtype=np.int64)
+            hit = np.zeros(num_rows, dtype=bool)
+            hit[rows[rows < num_rows]] = True
+            mask &= hit
+        numeric = {col: np.asarray(values[:num_rows], dtype=np.float32) for col, values in self.numeric.items()}
+        ranged = _range_mask(product_filter, numeric)
+        if ranged is not None:
+            mask &= ranged
+        return mask
@@ -0,0 +1,162 @@
+# app/models/index_factory.py
+import logging
+from typing import Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq", "opq_ivf_pq")
+
+
+def factory_string(index_type: str, num_vectors: int, nlist: int = 1024, pq_m: int = 16,
+                   pq_nbits: int = 8, hnsw_m: int = 32) -> str:
+    """Traduce INDEX_TYPE (+ parámetros) a la cadena de faiss.index_factory."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+    # FAISS recomienda >= 39 puntos de entrenamiento por centroide
+    nlist = max(1, min(nlist, num_vectors // 39))
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    return f"OPQ{pq_m},IVF{nlist},PQ{pq_m}x{pq_nbits}"
+
+
+def build_index(vectors: np.ndarray, index_type: str = "flat", nlist: int = 1024, pq_m: int = 16,
+                pq_nbits: int = 8, hnsw_m: int = 32, ef_construction: int = 200,
+                train_size: int = 100000, add_batch_size: int = 65536, seed: int = 123) -> faiss.Index:
+    """
+    Construye un índice inner-product sobre vectores L2-normalizados (coseno), como el IndexFlatIP
+    del notebook. Para IVF/PQ entrena sobre una muestra de train_size vectores y añade en lotes
+    (vectors puede ser un np.memmap).
+    """
+    n, d = vectors.shape
+    spec = factory_string(index_type, n, nlist=nlist, pq_m=pq_m, pq_nbits=pq_nbits, hnsw_m=hnsw_m)
+    logger.info("Building FAISS index %r over %d x %d vectors", spec, n, d)
+    index = faiss.index_factory(d, spec, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = ef_construction
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, train_size), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample], dtype='float32'))
+
+    for start in range(0, n, add_batch_size):
+        index.add(np.ascontiguousarray(vectors[start:start + add_batch_size], dtype='float32'))
+    return index
+
+
+def build_index_from_settings(vectors: np.ndarray, settings) -> faiss.Index:
+    return build_index(
+        vectors,
+        index_type=settings.INDEX_TYPE,
+        nlist=settings.IVF_NLIST,
+        pq_m=settings.PQ_M,
+        pq_nbits=settings.PQ_NBITS,
+        hnsw_m=settings.HNSW_M,
+        ef_construction=settings.HNSW_EF_CONSTRUCTION,
+        train_size=settings.INDEX_TRAIN_SIZE,
+    )
+
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Parámetros de búsqueda por request (thread-safe, no mutan el índice compartido).
+    sel: selector de ids (p.ej. faiss.IDSelectorBitmap de un filtro de metadatos); sólo se
+    devuelven los ids que lo cumplen.
+    Devuelve None si no hay nada que ajustar para este tipo de índice (p.ej. Flat sin selector).
+    """
+    inner = unwrap_index(index)
+    referenced = [sel]
+    if sel is not None and isinstance(index, faiss.IndexIDMap):
+        # el selector se expresa en ids externos: lo traducimos a posiciones del índice envuelto
+        # (IndexIDMap sólo traduce el selector de los parámetros de primer nivel, no el de un PreTransform)
+        sel = faiss.IDSelectorTranslated(index.id_map, sel)
+        referenced.append(sel)
+
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(nprobe) if nprobe else inner.nprobe
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search) if ef_search else inner.hnsw.efSearch
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+        params.referenced_objects = referenced
+
+    if isinstance(_strip_id_map(index), faiss.IndexPreTransform):
+        outer = faiss.SearchParametersPreTransform()
+        outer.index_params = params
+        # el wrapper SWIG no retiene el objeto interno: mantenemos la referencia
+        outer.referenced_objects = [params]
+        return outer
+    return params
+
+
+def bitmap_selector(packed: np.ndarray) -> faiss.IDSelector:
+    """Selector sobre un bitmap empaquetado LSB-first (np.packbits(..., bitorder='little')); packed debe
+    seguir vivo mientras se use el selector."""
+    return faiss.IDSelectorBitmap(len(packed), faiss.swig_ptr(packed))
+
+
+def _strip_id_map(index: faiss.Index) -> faiss.Index:
+    if isinstance(index, faiss.IndexIDMap):  # también IndexIDMap2
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def unwrap_index(index: faiss.Index) -> faiss.Index:
+    """Índice que hace la búsqueda, sin los wrappers IndexIDMap(2) / IndexPreTransform (OPQ)."""
+    inner = _strip_id_map(index)
+    if isinstance(inner, faiss.IndexPreTransform):
+        inner = faiss.downcast_index(inner.index)
+    return inner
+
+
+def reconstructs_exactly(index: faiss.Index) -> bool:
+    """
+    True si reconstruct() devuelve los vectores añadidos (Flat, IVFFlat, HNSW sobre Flat); con PQ / SQ
+    (ivf_pq, opq_ivf_pq) sólo devuelve su aproximación.
+    """
+    inner = unwrap_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    return isinstance(inner, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+
+def describe(index: faiss.Index) -> dict:
+    info = {"type": type(unwrap_index(index)).__name__, "ntotal": int(index.ntotal), "d": int(index.d)}
+    if isinstance(index, faiss.IndexIDMap):
+        info["id_map"] = True
+    return info
+
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    """
+    Lee un índice FAISS. Con mmap=True los códigos (Flat/PQ, IO_FLAG_MMAP_IFC) y las listas IVF
+    (IO_FLAG_MMAP) se mapean desde disco en vez de copiarse a RAM: el arranque es casi instantáneo
+    y las páginas se comparten entre procesos. El índice queda de sólo lectura (add() no está permitido).
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    ivf_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if ifc:
+        try:
+            return faiss.read_index(path, ivf_flags | ifc)
+        except RuntimeError:
+            # los índices IVF no admiten la combinación (el lector IFC no es un fichero): sólo listas IVF
+            pass
+    return faiss.read_index(path, ivf_flags)
@@ -0,0 +1,241 @@
+# app/models/lexical.py
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_MAX_TOKEN_LEN = 40
+
+try:
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS as _STOP_WORDS
+except Exception:  # sklearn es opcional para el servicio
+    _STOP_WORDS = frozenset(
+        "a an and are as at be but by for from has have in into is it its of on or that the their "
+        "this to was were will with".split()
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(str(text).lower()) if t not in _STOP_WORDS and len(t) <= _MAX_TOKEN_LEN]
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[int]], k: int = 60, top_k: int = 50) -> Tuple[List[int], List[float]]:
+    """RRF: score(d) = sum_i 1 / (k + rank_i(d)); devuelve (docs, scores) ordenados desc."""
+    scores: Dict[int, float] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            scores[doc] = scores.get(doc, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+    return [d for d, _ in fused], [s for _, s in fused]
+
+
+class LexicalIndex:
+    """
+    Índice invertido BM25 con postings compactos (CSR por término):
+      - indptr[t]:indptr[t+1] delimita las postings del término t
+      - doc_ids (int32, ordenados por doc dentro de cada término) e impacts (float32, contribución
+        BM25 precalculada de cada posting)
+      - max_impact[t]: cota superior por término para el pruning MaxScore
+    Sólo se puntúan documentos que comparten términos con la query.
+    """
+    def __init__(self, terms: Sequence[str], indptr: np.ndarray, doc_ids: np.ndarray,
+                 impacts: np.ndarray, max_impact: np.ndarray, num_docs: int):
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.terms = list(terms)
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.max_impact = max_impact
+        self.num_docs = num_docs
+
+    # ------------------------------------------------------------------ build / io
+    @classmethod
+    def build(cls, texts, k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        """texts: iterable de documentos (en orden de fila del ProductStore)."""
+        vocab: Dict[str, int] = {}
+        post_term, post_doc, post_tf = [], [], []
+        doc_len = []
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                post_term.append(vocab.setdefault(term, len(vocab)))
+                post_doc.append(doc)
+                post_tf.append(tf)
+        num_docs = len(doc_len)
+        term_ids = np.asarray(post_term, dtype=np.int32)
+        doc_ids = np.asarray(post_doc, dtype=np.int32)
+        tfs = np.asarray(post_tf, dtype=np.float32)
+        dl = np.asarray(doc_len, dtype=np.float32)
+
+        order = np.lexsort((doc_ids, term_ids))
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        df = np.bincount(term_ids, minlength=len(vocab)).astype(np.float32)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df.astype(np.int64), out=indptr[1:])
+
+        idf = np.log1p((num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(dl.mean()) if num_docs else 1.0
+        norm = k1 * (1.0 - b + b * dl[doc_ids] / max(avgdl, 1e-6))
+        impacts = (idf[term_ids] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+        max_impact = np.zeros(len(vocab), dtype=np.float32)
+        np.maximum.at(max_impact, term_ids, impacts)
+
+        terms = [None] * len(vocab)
+        for term, i in vocab.items():
+            terms[i] = term
+        logger.info("BM25 index: %d docs, %d terms, %d postings", num_docs, len(terms), len(doc_ids))
+        return cls(terms, indptr, doc_ids, impacts, max_impact, num_docs)
+
+    @classmethod
+    def build_from_store(cls, store, k1: float = 1.2, b: float = 0.75, block: int = 50000) -> "LexicalIndex":
+        def _texts():
+            for start in range(0, len(store), block):
+                yield from store.rerank_texts(np.arange(start, min(start + block, len(store))))
+        return cls.build(_texts(), k1=k1, b=b)
+
+    def save(self, path: str):
+        np.savez(path, terms=np.asarray(self.terms, dtype=str), indptr=self.indptr, doc_ids=self.doc_ids,
+                 impacts=self.impacts, max_impact=self.max_impact, num_docs=np.asarray(self.num_docs))
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        data = np.load(path)
+        return cls(data["terms"].tolist(), data["indptr"], data["doc_ids"], data["impacts"],
+                   data["max_impact"], int(data["num_docs"]))
+
+    def df(self, term: str) -> int:
+        """Nº de documentos con el término (0 si no está en el vocabulario)."""
+        t = self.vocab.get(term)
+        return 0 if t is None else int(self.indptr[t + 1] - self.indptr[t])
+
+    # ------------------------------------------------------------------ search
+    def search(self, query: str, top_k: int = 50, mask: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """
+        Top-k BM25 con pruning MaxScore (term-at-a-time, vectorizado con NumPy):
+        los términos se procesan de mayor a menor cota; en cuanto la suma de cotas de los
+        términos restantes no supera el umbral theta (k-ésimo score actual), esos términos
+        sólo actualizan candidatos existentes y ya no añaden documentos nuevos, y se descartan
+        los candidatos que no pueden alcanzar theta.
+        mask: bool por documento (filtro de metadatos); las postings de documentos fuera del
+        filtro se descartan antes de puntuar (las cotas siguen siendo válidas).
+        """
+        q_counts = Counter(t for t in tokenize(query) if t in self.vocab)
+        if not q_counts or top_k <= 0:
+            return [], []
+        terms = sorted(((self.vocab[t], w) for t, w in q_counts.items()),
+                       key=lambda tw: self.max_impact[tw[0]] * tw[1], reverse=True)
+        bounds = np.array([self.max_impact[t] * w for t, w in terms], dtype=np.float32)
+        remaining = np.concatenate([np.cumsum(bounds[::-1])[::-1], [0.0]])
+
+        cand_docs = np.empty(0, dtype=np.int32)
+        cand_scores = np.empty(0, dtype=np.float32)
+        theta = -np.inf
+        for i, (t, w) in enumerate(terms):
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            docs, imps = self.doc_ids[lo:hi], self.impacts[lo:hi] * w
+            if mask is not None:
+                keep = mask[docs]
+                docs, imps = docs[keep], imps[keep]
+                if not len(docs):
+                    continue
+            if len(cand_docs) >= top_k and remaining[i] <= theta:
+                # término no esencial: sólo suma a candidatos ya vistos
+                pos = np.searchsorted(docs, cand_docs)
+                pos_c = np.minimum(pos, len(docs) - 1)
+                hit = (pos < len(docs)) & (docs[pos_c] == cand_docs)
+                cand_scores[hit] += imps[pos_c[hit]]
+            else:
+                all_docs = np.concatenate([cand_docs, docs])
+                all_scores = np.concatenate([cand_scores, imps])
+                cand_docs, inverse = np.unique(all_docs, return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=all_scores).astype(np.float32)
+            if len(cand_docs) >= top_k:
+                theta = float(np.partition(cand_scores, len(cand_scores) - top_k)[len(cand_scores) - top_k])
+                keep = cand_scores + remaining[i + 1] >= theta
+                cand_docs, cand_scores = cand_docs[keep], cand_scores[keep]
+
+        k = min(top_k, len(cand_docs))
+        if not k:
+            return [], []
+        top = np.argpartition(-cand_scores, k - 1)[:k]
+        top = top[np.argsort(-cand_scores[top], kind='stable')]
+        return cand_docs[top].tolist(), cand_scores[top].tolist()
+
+
+class DeltaLexicalIndex:
+    """
+    BM25 del delta del catálogo vivo: postings que crecen por lotes (término -> docs y tfs) en lugar
+    de CSR y sin impacts precalculados, que cambiarían con cada lote. El idf suma las df de reference
+    (el índice de la base) a las del delta para que los scores se puedan mezclar con los de reference.
+    El delta es pequeño: search puntúa en el momento, sin MaxScore, sólo los documentos que comparten
+    términos con la query.
+    Los lotes sólo añaden documentos al final: un lector que se limita a sus primeros num_docs
+    documentos no necesita lock aunque otro thread esté añadiendo.
+    """
+    def __init__(self, reference: Optional[LexicalIndex] = None, k1: float = 1.2, b: float = 0.75):
+        self.reference = reference
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.doc_len: List[int] = []
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, texts: Sequence[str]):
+        """Añade documentos al final (doc = num_docs, num_docs + 1, ...)."""
+        for text in texts:
+            doc = len(self.doc_len)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                docs, tfs = self.postings.setdefault(term, ([], []))
+                # tfs antes que docs: un lector que ve el doc ya ve su tf
+                tfs.append(tf)
+                docs.append(doc)
+            self.doc_len.append(sum(counts.values()))
+
+    def search(self, query: str, top_k: int = 50, mask: Optional[np.ndarray] = None,
+               num_docs: Optional[int] = None) -> Tuple[List[int], List[float]]:
+        """
+        Top-k BM25 exacto sobre los primeros num_docs documentos (None -> todos).
+        mask: bool por documento (len >= num_docs), como en LexicalIndex.search.
+        """
+        n = self.num_docs if num_docs is None else num_docs
+        q_counts = Counter(t for t in tokenize(query) if t in self.postings)
+        if not q_counts or top_k <= 0 or not n:
+            return [], []
+        dl = np.asarray(self.doc_len[:n], dtype=np.float32)
+        avgdl = max(float(dl.mean()), 1e-6)
+        total = n + (self.reference.num_docs if self.reference is not None else 0)
+        cand_docs, cand_scores = [], []
+        for term, w in q_counts.items():
+            doc_list, tf_list = self.postings[term]
+            docs = np.asarray(doc_list[:], dtype=np.int64)
+            tfs = np.asarray(tf_list[:len(docs)], dtype=np.float32)
+            keep = docs < n
+            docs, tfs = docs[keep], tfs[keep]
+            df = len(docs) + (self.reference.df(term) if self.reference is not None else 0)
+            idf = np.float32(np.log1p((total - df + 0.5) / (df + 0.5)))
+            if mask is not None:
+                keep = mask[docs]
+                docs, tfs = docs[keep], tfs[keep]
+            if not len(docs):
+                continue
+            norm = self.k1 * (1.0 - self.b + self.b * dl[docs] / avgdl)
+            cand_docs.append(docs)
+            cand_scores.append((idf * tfs * (self.k1 + 1.0) / (tfs + norm)).astype(np.float32) * w)
+        if not cand_docs:
+            return [], []
+        docs, inverse = np.unique(np.concatenate(cand_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(cand_scores)).astype(np.float32)
+        k = min(top_k, len(docs))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return docs[top].tolist(), scores[top].tolist()
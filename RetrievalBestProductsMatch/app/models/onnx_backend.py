@@ -0,0 +1,260 @@
+# app/models/onnx_backend.py
+"""
+Backend de inferencia CPU con ONNX Runtime (INFERENCE_BACKEND=onnx):
+  - export_model: exporta el transformer de un SentenceTransformer / CrossEncoder a ONNX y lo
+    cuantiza con int8 dinámico (pesos int8, activaciones cuantizadas en runtime)
+  - OnnxSentenceEncoder.encode y OnnxCrossEncoder.predict replican la firma de sentence-transformers,
+    así que Retriever y Reranker los usan sin cambiar los call sites
+  - parity_report compara ambos backends (coseno de embeddings y acuerdo de ranking del cross-encoder)
+El serving sólo necesita onnxruntime + tokenizers; el export necesita además torch y onnx.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.utils.index_builder import model_basename
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("embedder", "cross_encoder")
+META_FILE = "onnx_meta.json"
+
+
+def model_dir(onnx_dir: str, model_name: str) -> str:
+    return os.path.join(onnx_dir, model_basename(model_name))
+
+
+def _onnx_path(directory: str, quantize: bool) -> str:
+    return os.path.join(directory, "model_int8.onnx" if quantize else "model.onnx")
+
+
+# ---------------------------------------------------------------------------- export
+def export_model(model_name: str, kind: str, out_dir: str, quantize: bool = True, opset: int = 14) -> str:
+    """
+    Exporta model_name (embedder = SentenceTransformer, cross_encoder = CrossEncoder) a out_dir:
+    model.onnx, model_int8.onnx (si quantize), tokenizer.json y onnx_meta.json (pooling, max_length...).
+    Devuelve out_dir.
+    """
+    import torch
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    os.makedirs(out_dir, exist_ok=True)
+    if kind == "embedder":
+        st = SentenceTransformer(model_name, device="cpu")
+        hf_model, tokenizer = st[0].auto_model, st.tokenizer
+        pooling = next((m for m in st if hasattr(m, "get_pooling_mode_str")), None)
+        meta = {
+            "max_length": int(st.max_seq_length),
+            "pooling": pooling.get_pooling_mode_str() if pooling is not None else "mean",
+            "normalize": any(type(m).__name__ == "Normalize" for m in st),
+            "dim": int(st.get_sentence_embedding_dimension()),
+        }
+    else:
+        ce = CrossEncoder(model_name, device="cpu")
+        hf_model, tokenizer = ce.model, ce.tokenizer
+        activation = getattr(ce, "activation_fn", None) or getattr(ce, "default_activation_function", None)
+        meta = {
+            "max_length": int(ce.max_length or tokenizer.model_max_length),
+            "num_labels": int(hf_model.config.num_labels),
+            "sigmoid": type(activation).__name__ == "Sigmoid",
+        }
+    meta.update({"kind": kind, "model_name": model_name})
+
+    class _Wrapper(torch.nn.Module):
+        """Devuelve sólo el primer output (last_hidden_state / logits) como tensor."""
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+    sample = tokenizer(["query example"], ["a product description"], return_tensors="pt") if kind == "cross_encoder" \
+        else tokenizer(["query example"], return_tensors="pt")
+    input_names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in sample]
+    output_name = "token_embeddings" if kind == "embedder" else "logits"
+    dynamic_axes = {name: {0: "batch", 1: "seq"} for name in input_names}
+    dynamic_axes[output_name] = {0: "batch", 1: "seq"} if kind == "embedder" else {0: "batch"}
+
+    fp32_path = _onnx_path(out_dir, quantize=False)
+    wrapper = _Wrapper(hf_model.eval())
+    with torch.no_grad():
+        torch.onnx.export(wrapper, tuple(sample[k] for k in input_names), fp32_path, input_names=input_names,
+                          output_names=[output_name], dynamic_axes=dynamic_axes, opset_version=opset,
+                          dynamo=False)
+    logger.info("Exported %s (%s) -> %s", model_name, kind, fp32_path)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, _onnx_path(out_dir, quantize=True), weight_type=QuantType.QInt8)
+        logger.info("Quantized (dynamic int8) -> %s", _onnx_path(out_dir, quantize=True))
+
+    tokenizer.save_pretrained(out_dir)  # escribe tokenizer.json (tokenizer rápido)
+    meta["inputs"] = input_names
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    return out_dir
+
+
+# ---------------------------------------------------------------------------- runtime
+class _OnnxModel:
+    """Sesión ONNX Runtime + tokenizer (librería tokenizers, sin transformers) de un modelo exportado."""
+    def __init__(self, directory: str, quantize: bool = True, intra_op_threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        path = _onnx_path(directory, quantize)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"ONNX model not found: {path}")
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # un solo grafo por llamada: el paralelismo útil es intra-op; 0 = lo decide ORT (núcleos físicos)
+        if intra_op_threads:
+            opts.intra_op_num_threads = intra_op_threads
+        opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=int(self.meta["max_length"]))
+        self.tokenizer.no_padding()
+        self.pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+        logger.info("ONNX model %s loaded (%s, intra_op_threads=%s)", self.meta.get("model_name"),
+                    os.path.basename(path), intra_op_threads or "auto")
+
+    def _feeds(self, encodings) -> Dict[str, np.ndarray]:
+        n, seq = len(encodings), max(len(e.ids) for e in encodings)
+        ids = np.full((n, seq), self.pad_id, dtype=np.int64)
+        mask = np.zeros((n, seq), dtype=np.int64)
+        types = np.zeros((n, seq), dtype=np.int64)
+        for i, e in enumerate(encodings):
+            ids[i, :len(e.ids)] = e.ids
+            mask[i, :len(e.ids)] = 1
+            types[i, :len(e.ids)] = e.type_ids
+        feeds = {"input_ids": ids, "attention_mask": mask, "token_type_ids": types}
+        return {name: feeds[name] for name in self.input_names}
+
+    def run_batched(self, inputs: list, batch_size: int, fn) -> list:
+        """
+        Tokeniza todo, ordena por longitud para que cada batch tenga el mínimo padding, ejecuta
+        fn(outputs, feeds) por batch y devuelve los resultados en el orden original.
+        """
+        encodings = self.tokenizer.encode_batch(inputs)
+        order = np.argsort([len(e.ids) for e in encodings], kind="stable")
+        out: List[Optional[np.ndarray]] = [None] * len(inputs)
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            feeds = self._feeds([encodings[i] for i in chunk])
+            result = fn(self.session.run(None, feeds)[0], feeds)
+            for pos, i in enumerate(chunk):
+                out[i] = result[pos]
+        return out
+
+
+class OnnxSentenceEncoder(_OnnxModel):
+    """Sustituto de SentenceTransformer.encode (pooling + normalización según el modelo exportado)."""
+    def _pool(self, token_embeddings: np.ndarray, feeds: Dict[str, np.ndarray]) -> np.ndarray:
+        if self.meta.get("pooling") == "cls":
+            emb = token_embeddings[:, 0]
+        else:
+            mask = feeds["attention_mask"][..., None].astype(np.float32)
+            emb = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.meta.get("normalize"):
+            emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        return emb.astype(np.float32)
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_tensor: bool = False, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size=batch_size)[0]
+        if not len(sentences):
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.stack(self.run_batched(list(sentences), batch_size, self._pool))
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        return self.meta.get("dim")
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Sustituto de CrossEncoder.predict para modelos de un solo logit (ms-marco)."""
+    def _scores(self, logits: np.ndarray, feeds) -> np.ndarray:
+        scores = logits[:, 0] if logits.ndim == 2 and logits.shape[1] == 1 else logits
+        if self.meta.get("sigmoid"):
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores.astype(np.float32)
+
+    def predict(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        pairs = [tuple(p) for p in sentences]
+        if not pairs:
+            return np.empty(0, dtype=np.float32)
+        return np.asarray(self.run_batched(pairs, batch_size, self._scores), dtype=np.float32)
+
+
+def load_onnx_model(model_name: str, kind: str, onnx_dir: str, quantize: bool = True, intra_op_threads: int = 0,
+                    export_if_missing: bool = True):
+    """Carga el modelo exportado en onnx_dir/<modelo>/; si no existe lo exporta (requiere torch)."""
+    directory = model_dir(onnx_dir, model_name)
+    if not os.path.exists(_onnx_path(directory, quantize)) or not os.path.exists(os.path.join(directory, META_FILE)):
+        if not export_if_missing:
+            raise FileNotFoundError(f"No ONNX export for {model_name} in {directory}; run `python -m app.cli export-onnx`")
+        logger.info("No ONNX export for %s in %s; exporting now", model_name, directory)
+        export_model(model_name, kind, directory, quantize=quantize)
+    cls = OnnxSentenceEncoder if kind == "embedder" else OnnxCrossEncoder
+    return cls(directory, quantize=quantize, intra_op_threads=intra_op_threads)
+
+
+# ---------------------------------------------------------------------------- parity
+def ranking_agreement(ref_scores: Sequence[float], new_scores: Sequence[float], k: int = 10) -> Dict[str, float]:
+    """
+    Acuerdo entre dos rankings de los mismos candidatos: top-1, overlap@k y Spearman. La clave es
+    siempre 'overlap@k' (para poder promediar queries con menos de k candidatos); el overlap se
+    divide por el k efectivo min(k, nº de candidatos).
+    """
+    ref, new = np.asarray(ref_scores, dtype=np.float64), np.asarray(new_scores, dtype=np.float64)
+    k_eff = min(k, len(ref))
+    ref_top, new_top = np.argsort(-ref, kind="stable"), np.argsort(-new, kind="stable")
+    ref_rank, new_rank = np.empty(len(ref)), np.empty(len(new))
+    ref_rank[ref_top], new_rank[new_top] = np.arange(len(ref)), np.arange(len(new))
+    spearman = float(np.corrcoef(ref_rank, new_rank)[0, 1]) if len(ref) > 1 else 1.0
+    return {
+        "top1": float(ref_top[0] == new_top[0]),
+        "overlap@k": len(set(ref_top[:k_eff]) & set(new_top[:k_eff])) / k_eff,
+        "spearman": spearman,
+    }
+
+
+def parity_report(queries: List[str], candidate_texts: List[List[str]], ref_encoder, new_encoder,
+                  ref_reranker, new_reranker, k: int = 10, batch_size: int = 64) -> Dict[str, Any]:
+    """
+    Compara el backend de referencia (PyTorch) con el nuevo (ONNX) sobre las mismas queries:
+      - encoder: coseno entre embeddings de las queries (media y mínimo)
+      - cross-encoder: top-1, overlap@k y Spearman medios sobre los candidatos de cada query
+    """
+    ref_emb = np.asarray(ref_encoder.encode(queries, batch_size=batch_size), dtype=np.float32)
+    new_emb = np.asarray(new_encoder.encode(queries, batch_size=batch_size), dtype=np.float32)
+    ref_emb /= np.maximum(np.linalg.norm(ref_emb, axis=1, keepdims=True), 1e-12)
+    new_emb /= np.maximum(np.linalg.norm(new_emb, axis=1, keepdims=True), 1e-12)
+    cos = (ref_emb * new_emb).sum(axis=1)
+
+    agreements = []
+    for query, texts in zip(queries, candidate_texts):
+        if len(texts) < 2:
+            continue
+        pairs = [[query, t] for t in texts]
+        agreements.append(ranking_agreement(ref_reranker.predict(pairs, batch_size=batch_size),
+                                            new_reranker.predict(pairs, batch_size=batch_size), k=k))
+    rerank = {key: float(np.mean([a[key] for a in agreements])) for key in agreements[0]} if agreements else {}
+    return {
+        "num_queries": len(queries),
+        "k": k,
+        "embedding_cosine_mean": float(cos.mean()) if len(cos) else None,
+        "embedding_cosine_min": float(cos.min()) if len(cos) else None,
+        "rerank": rerank,
+    }
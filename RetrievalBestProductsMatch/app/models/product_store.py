@@ -0,0 +1,267 @@
+# app/models/product_store.py
+import json
+import logging
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.models.filters import FILTER_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+# índice product_id -> fila: ids ordenados (bytes de ancho fijo) + su fila, memory-mappeables
+ID_INDEX_FILES = ("product_id.sorted.npy", "product_id.rows.npy")
+_ID_INDEX_CHUNK = 1 << 20
+
+
+def _file_stem(column: str) -> str:
+    # 'category hierarchy' -> 'category_hierarchy'
+    return column.replace(" ", "_")
+
+
+def _pack(values: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Empaqueta strings en un blob utf-8 contiguo (uint8) + offsets (int64, len n+1)."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def build_id_index(blob: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ids ordenados como dtype 'S<ancho máximo>', fila de cada uno) a partir de la columna product_id
+    empaquetada, sin decodificar strings en Python: los bytes se copian por chunks a una matriz
+    (filas x ancho) que se reinterpreta como bytes de ancho fijo.
+    """
+    lengths = np.diff(offsets)
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    ids = np.zeros((len(lengths), width), dtype=np.uint8)
+    cols = np.arange(width)
+    for start in range(0, len(lengths), _ID_INDEX_CHUNK):
+        end = min(start + _ID_INDEX_CHUNK, len(lengths))
+        mask = cols < lengths[start:end, None]
+        ids[start:end][mask] = blob[(offsets[start:end, None] + cols)[mask]]
+    ids = ids.view(f"S{width}").ravel()
+    order = np.argsort(ids, kind="stable")
+    return ids[order], order.astype(np.int64)
+
+
+def save_id_index(directory: str, blob: np.ndarray, offsets: np.ndarray):
+    for name, array in zip(ID_INDEX_FILES, build_id_index(blob, offsets)):
+        np.save(os.path.join(directory, name), array)
+
+
+def replace_dir(src: str, dst: str):
+    """
+    Sustituye el directorio dst por src (ya completo) con renames: quien cargue dst ve el store
+    anterior o el nuevo, nunca uno escrito a medias. El anterior se aparta y se borra al final.
+    """
+    dst = dst.rstrip("/")
+    old = f"{dst}.old-{os.getpid()}"
+    if os.path.isdir(dst):
+        os.rename(dst, old)
+    os.replace(src, dst)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class ProductStore:
+    """
+    Almacén columnar y compacto del catálogo para el hot path:
+      - cada columna de texto es un blob utf-8 contiguo + offsets (memory-mappeable desde disco)
+      - 'rerank_text' ("name - description") se precalcula una sola vez
+      - índice product_id -> fila precalculado (ids ordenados + np.searchsorted), persistido junto a las
+        columnas y memory-mappeable: ningún lookup recorre la columna en el path de una request
+      - columnas de metadatos para filtrar (product_class, category hierarchy, ratings), si el CSV las trae
+    Las filas son las posiciones del índice FAISS (mismo orden que product.csv).
+    """
+    TEXT_COLUMNS = ("product_id", "product_name", "product_description")
+    RERANK_COLUMN = "rerank_text"
+    META_COLUMNS = FILTER_COLUMNS
+
+    def __init__(self, columns: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                 id_index: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        self._columns = columns
+        self._num_rows = len(columns["product_id"][1]) - 1
+        self._id_index = id_index if id_index is not None else build_id_index(*columns["product_id"])
+
+    # ------------------------------------------------------------------ build / io
+    @classmethod
+    def text_columns(cls, df: pd.DataFrame) -> Dict[str, List[str]]:
+        """Columnas (ya limpias, en orden) que se guardan para un DataFrame de product.csv."""
+        text = {}
+        for col in cls.TEXT_COLUMNS:
+            values = df[col] if col in df.columns else pd.Series([""] * len(df), index=df.index)
+            text[col] = values.fillna("").astype(str)
+        text[cls.RERANK_COLUMN] = text["product_name"] + " - " + text["product_description"]
+        for col in cls.META_COLUMNS:
+            if col in df.columns:
+                text[col] = df[col].fillna("").astype(str)
+        return {col: values.tolist() for col, values in text.items()}
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List[str]]) -> "ProductStore":
+        """Store en memoria a partir de columnas de strings ya limpias (mismo nº de filas)."""
+        return cls({col: _pack(values) for col, values in columns.items()})
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "ProductStore":
+        return cls.from_columns(cls.text_columns(df))
+
+    @classmethod
+    def from_csv(cls, path: str) -> "ProductStore":
+        df = pd.read_csv(path, sep='\t', dtype={'product_id': object})
+        return cls.from_dataframe(df)
+
+    @staticmethod
+    def write_meta(directory: str, num_rows: int, columns: List[str]):
+        with open(os.path.join(directory, META_FILE), "w") as f:
+            json.dump({"num_rows": num_rows, "columns": columns}, f)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for col, (blob, offsets) in self._columns.items():
+            stem = _file_stem(col)
+            np.save(os.path.join(directory, f"{stem}.bytes.npy"), blob)
+            np.save(os.path.join(directory, f"{stem}.offsets.npy"), offsets)
+        for name, array in zip(ID_INDEX_FILES, self._id_index):
+            np.save(os.path.join(directory, name), array)
+        self.write_meta(directory, self._num_rows, list(self._columns))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ProductStore":
+        """Carga un store guardado con save(); con mmap=True las columnas no se copian a RAM."""
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        columns = {}
+        for col in meta["columns"]:
+            stem = _file_stem(col)
+            columns[col] = (
+                np.load(os.path.join(directory, f"{stem}.bytes.npy"), mmap_mode=mode),
+                np.load(os.path.join(directory, f"{stem}.offsets.npy"), mmap_mode=mode),
+            )
+        paths = [os.path.join(directory, name) for name in ID_INDEX_FILES]
+        id_index = None
+        if all(os.path.exists(path) for path in paths):
+            id_index = tuple(np.load(path, mmap_mode=mode) for path in paths)
+        else:
+            logger.info("No product_id index in %s; building it in memory", directory)
+        return cls(columns, id_index)
+
+    # ------------------------------------------------------------------ access
+    def __len__(self) -> int:
+        return self._num_rows
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def nbytes(self) -> int:
+        columns = sum(blob.nbytes + offsets.nbytes for blob, offsets in self._columns.values())
+        return int(columns + sum(array.nbytes for array in self._id_index))
+
+    def texts(self, column: str, idxs: Sequence[int]) -> List[str]:
+        """Gather vectorizado de offsets + decode de los slices del blob."""
+        blob, offsets = self._columns[column]
+        rows = np.asarray(idxs, dtype=np.int64)
+        starts = offsets[rows].tolist()
+        ends = offsets[rows + 1].tolist()
+        return [blob[s:e].tobytes().decode("utf-8") for s, e in zip(starts, ends)]
+
+    def empty_rows(self, column: str) -> np.ndarray:
+        """Filas con la columna vacía (sin decodificar: offsets consecutivos iguales)."""
+        offsets = self._columns[column][1]
+        return np.flatnonzero(np.diff(offsets) == 0)
+
+    def text(self, column: str, idx: int) -> str:
+        blob, offsets = self._columns[column]
+        return blob[offsets[idx]:offsets[idx + 1]].tobytes().decode("utf-8")
+
+    def column(self, column: str) -> List[str]:
+        return self.texts(column, np.arange(self._num_rows))
+
+    def product_ids(self, idxs: Sequence[int]) -> List[str]:
+        return self.texts("product_id", idxs)
+
+    def rerank_texts(self, idxs: Sequence[int]) -> List[str]:
+        return self.texts(self.RERANK_COLUMN, idxs)
+
+    def get(self, idx: int) -> Dict[str, str]:
+        return {col: self.text(col, idx) for col in self.TEXT_COLUMNS}
+
+    def get_many(self, idxs: Sequence[int]) -> List[Dict[str, str]]:
+        cols = {col: self.texts(col, idxs) for col in self.TEXT_COLUMNS}
+        return [dict(zip(cols, values)) for values in zip(*cols.values())]
+
+    def row_of(self, product_id) -> Optional[int]:
+        """Fila del product_id (acepta int o str) o None si no existe: búsqueda binaria en el índice."""
+        ids, rows = self._id_index
+        key = str(product_id).encode("utf-8")
+        if not key or len(key) > ids.dtype.itemsize:
+            return None
+        # side="right": con ids repetidos gana la última fila, como en el CSV
+        pos = int(np.searchsorted(ids, key, side="right")) - 1
+        if pos >= 0 and ids[pos] == key:
+            return int(rows[pos])
+        return None
+
+
+class ProductStoreWriter:
+    """
+    Escribe un ProductStore en streaming (chunk a chunk de product.csv) sin tener el catálogo
+    entero en memoria: los blobs se vuelcan a disco en cada append y sólo se mantienen los offsets.
+    Todo se escribe en un directorio hermano temporal; close() lo renombra sobre directory y abort()
+    lo descarta, así un build caído o en curso nunca deja a medias el store que sirven los workers.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory.rstrip("/")
+        self._tmp_dir = f"{self.directory}.tmp-{os.getpid()}"
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)  # restos de un build anterior caído
+        os.makedirs(self._tmp_dir)
+        self._raw = {}
+        self._offsets = {}
+        self._sizes = {}
+        self.num_rows = 0
+
+    def append(self, df: pd.DataFrame):
+        for col, values in ProductStore.text_columns(df).items():
+            if col not in self._raw:
+                self._raw[col] = open(os.path.join(self._tmp_dir, f"{_file_stem(col)}.bytes.raw"), "wb")
+                self._offsets[col] = [np.zeros(1, dtype=np.int64)]
+                self._sizes[col] = 0
+            blob, offsets = _pack(values)
+            self._raw[col].write(blob.tobytes())
+            self._offsets[col].append(offsets[1:] + self._sizes[col])
+            self._sizes[col] += len(blob)
+        self.num_rows += len(df)
+
+    def close(self):
+        for col, raw in self._raw.items():
+            raw.close()
+            stem = _file_stem(col)
+            raw_path = os.path.join(self._tmp_dir, f"{stem}.bytes.raw")
+            # .npy = cabecera + bytes crudos: copiamos el raw en streaming tras la cabecera
+            with open(os.path.join(self._tmp_dir, f"{stem}.bytes.npy"), "wb") as out, open(raw_path, "rb") as src:
+                np.lib.format.write_array_header_1_0(
+                    out, {"descr": "|u1", "fortran_order": False, "shape": (self._sizes[col],)}
+                )
+                shutil.copyfileobj(src, out, length=16 << 20)
+            os.remove(raw_path)
+            np.save(os.path.join(self._tmp_dir, f"{stem}.offsets.npy"), np.concatenate(self._offsets[col]))
+        stem = _file_stem("product_id")
+        save_id_index(self._tmp_dir,
+                      np.load(os.path.join(self._tmp_dir, f"{stem}.bytes.npy"), mmap_mode="r"),
+                      np.load(os.path.join(self._tmp_dir, f"{stem}.offsets.npy"), mmap_mode="r"))
+        ProductStore.write_meta(self._tmp_dir, self.num_rows, list(self._raw))
+        replace_dir(self._tmp_dir, self.directory)
+
+    def abort(self):
+        """Descarta lo escrito; el store que hubiera en directory queda intacto."""
+        for raw in self._raw.values():
+            raw.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
@@ -1,35 +1,82 @@
 # app/models/rag.py
+import asyncio
 import logging
-import json
-from typing import List, Dict, Any, Optional
-from app.clients.llm_base import LLMClientProtocol
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+import numpy as np
+
+from app.clients.llm_base import LLMClientProtocol, coerce_answer, extract_json_from_text, is_answer
+from app.clients.llm_pool import LLMPool, LLMTimeoutError
+from app.utils.batching import QueueFullError
+from app.utils.cache import SemanticAnswerCache
+from app.utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# estimación de tokens sin tokenizer (BPE en inglés: ~4 caracteres por token)
+_CHARS_PER_TOKEN = 4
+
+
+def approx_tokens(text: str) -> int:
+    return -(-len(text) // _CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta text a ~max_tokens tokens, en un límite de palabra."""
+    max_chars = max(0, max_tokens) * _CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    if not max_chars:
+        return ""
+    cut = text.rfind(" ", 0, max_chars + 1)
+    return text[:cut if cut > 0 else max_chars].rstrip(" ,.;:") + "..."
+
 
 class RAGService:
     """
     Servicio RAG orquestador:
-      - retriever: objeto con .retrieve(query, top_k) -> (indices, distances) y .get_product(idx)
+      - retriever: objeto con .retrieve(query, top_k) -> (indices, distances), .get_products(idxs) y .store (ProductStore)
       - reranker: objeto con .rerank(query, candidate_texts, candidate_indices, top_m)
       - llm_client: adaptador que cumple LLMClientProtocol (opcional)
+      - llm_pool: LLMPool con N clientes precargados (opcional; usado por answer_async / stream_answer)
+      - answer_cache: SemanticAnswerCache (opcional): reutiliza la respuesta del LLM para paráfrasis
+        con los mismos candidatos en el contexto
+      - context_tokens: presupuesto de tokens de los productos en el prompt del LLM
+      - scheduler: InferenceScheduler (opcional): answer_async / stream_answer embeben la query de la
+        clave de la answer cache a través de él, agrupada con las demás requests
     """
-    def __init__(self, retriever, reranker=None, llm_client: Optional[LLMClientProtocol] = None):
+    def __init__(self, retriever, reranker=None, llm_client: Optional[LLMClientProtocol] = None,
+                 llm_pool: Optional[LLMPool] = None, answer_cache: Optional[SemanticAnswerCache] = None,
+                 context_tokens: int = 700, scheduler=None):
         self.retriever = retriever
         self.reranker = reranker
         self.llm = llm_client
+        self.llm_pool = llm_pool
+        self.answer_cache = answer_cache
+        self.context_tokens = context_tokens
+        self.scheduler = scheduler
 
-    def build_context(self, indices: List[int], max_chars: int = 3000) -> str:
-        parts = []
-        total = 0
-        for idx in indices:
-            p = self.retriever.get_product(idx)
-            text = f"product_id: {p.get('product_id')}\nname: {p.get('product_name')}\n{p.get('product_description')}\n\n"
-            if total + len(text) > max_chars:
-                break
-            parts.append(text)
-            total += len(text)
-        return "\n".join(parts)
+    def build_context(self, indices: List[int], max_tokens: Optional[int] = None) -> str:
+        """
+        Empaqueta los productos (en orden de ranking) en ~max_tokens tokens. En vez de descartar los
+        últimos productos cuando no caben, cada uno recibe una parte del presupuesto que queda y su
+        descripción se recorta a esa parte; lo que no gasta un producto corto pasa a los siguientes.
+        """
+        budget = self.context_tokens if max_tokens is None else max_tokens
+        with metrics.timer("build_context"):
+            products = self.retriever.get_products(indices)
+            parts = []
+            for i, p in enumerate(products):
+                header = f"product_id: {p.get('product_id')}\nname: {p.get('product_name')}\n"
+                share = budget // (len(products) - i)
+                description = truncate_to_tokens(" ".join(str(p.get('product_description') or "").split()),
+                                                 share - approx_tokens(header))
+                text = header + (f"{description}\n" if description else "")
+                if parts and approx_tokens(text) > budget:
+                    break
+                parts.append(text)
+                budget -= approx_tokens(text)
+            return "\n".join(parts)
 
     def _normalize_llm_response(self, resp: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -40,24 +87,34 @@ class RAGService:
         if not resp:
             return {"best_product_id": None, "reasons": [], "top_candidates": []}
 
-        if "best_product_id" in resp and "reasons" in resp and "top_candidates" in resp:
-            return resp
+        if is_answer(resp):
+            return coerce_answer(resp)
 
         # if adapter returned raw text, try to parse json inside it
         raw = resp.get("raw")
         if raw:
-            import re
-            m = re.search(r'\{.*\}', raw, flags=re.DOTALL)
-            if m:
-                try:
-                    parsed = json.loads(m.group(0))
-                    return parsed
-                except Exception:
-                    logger.warning("Could not parse JSON from raw LLM output.")
+            parsed = extract_json_from_text(raw, accept=is_answer)
+            if parsed is not None:
+                return coerce_answer(parsed)
+            logger.warning("Could not parse JSON from raw LLM output.")
         # fallback minimal structured response
+        metrics.inc("llm_json_fallbacks_total", source="rag")
         return {"best_product_id": None, "reasons": ["no structured LLM output"], "top_candidates": []}
 
-    def answer(self, query: str, top_k: int = 50, rerank_top: int = 5) -> Dict[str, Any]:
+    def retrieve_candidates(self, query: str, top_k: int = 50, rerank_top: int = 5,
+                            **search_kwargs) -> Tuple[List[int], List[float]]:
+        """Pasos 1-2 del pipeline: retrieve top_k y (si hay reranker) rerank -> (idxs, scores)."""
+        idxs, scores = self.retriever.retrieve(query, top_k=top_k, **search_kwargs)
+        if idxs and self.reranker:
+            candidate_texts = self.retriever.store.rerank_texts(idxs)
+            try:
+                idxs, scores = self.reranker.rerank(query, candidate_texts, idxs, top_m=rerank_top,
+                                                    cheap_scores=scores)
+            except Exception as e:
+                logger.exception("Reranker failed, continuing with original order: %s", e)
+        return idxs, scores
+
+    def answer(self, query: str, top_k: int = 50, rerank_top: int = 5, **search_kwargs) -> Dict[str, Any]:
         """
         Ejecuta pipeline:
           1. retrieve top_k candidatos
@@ -68,59 +125,178 @@ class RAGService:
         if not isinstance(query, str) or not query.strip():
             raise ValueError("query must be a non-empty string")
 
-        # 1) retrieve
-        idxs, dists = self.retriever.retrieve(query, top_k=top_k)
+        idxs, _ = self.retrieve_candidates(query, top_k=top_k, rerank_top=rerank_top, **search_kwargs)
+        return self.answer_from_candidates(query, idxs, rerank_top=rerank_top)
+
+    def answer_from_candidates(self, query: str, idxs: List[int], rerank_top: int = 5) -> Dict[str, Any]:
+        """
+        Pasos 3-4 del pipeline sobre candidatos ya recuperados/rerankeados (p.ej. por
+        SearchService.rank_async): contexto -> LLM -> respuesta normalizada o fallback.
+        """
         if not idxs:
             return {"best_product_id": None, "reasons": ["no candidates"], "top_candidates": []}
 
-        # 2) rerank (si existe)
-        if self.reranker:
-            candidate_texts = [
-                f"{self.retriever.product_df.iloc[i]['product_name']} - {self.retriever.product_df.iloc[i]['product_description']}"
-                for i in idxs
-            ]
-            try:
-                idxs, scores = self.reranker.rerank(query, candidate_texts, idxs, top_m=rerank_top)
-            except Exception as e:
-                logger.exception("Reranker failed, continuing with original order: %s", e)
-
         # 3) context
-        context = self.build_context(idxs[:rerank_top], max_chars=3500)
+        context = self.build_context(idxs[:rerank_top])
 
-        # 4) call LLM if present
+        # 4) call LLM if present (salvo hit en la answer cache)
         if self.llm:
+            key = self.answer_key(query, idxs, rerank_top)
+            cached = self._cached_answer(key)
+            if cached is not None:
+                return cached
             try:
                 raw_resp = self.llm.generate_answer(query=query, context=context)
-                normalized = self._normalize_llm_response(raw_resp)
-                # Try to enrich best_product metadata if best_product_id is an index into product_df
-                try:
-                    bpid = normalized.get("best_product_id")
-                    if bpid is not None:
-                        # If product_id in dataset is an int stored as string, convert and search
-                        # We assume best_product_id corresponds to product_id (not row idx), try to find row
-                        df = self.retriever.product_df
-                        match = df.loc[df['product_id'].astype(str) == str(bpid)]
-                        if not match.empty:
-                            row = match.iloc[0]
-                            normalized["_best_product_meta"] = {
-                                "product_id": row['product_id'],
-                                "product_name": row.get('product_name'),
-                                "product_description": row.get('product_description')
-                            }
-                except Exception:
-                    logger.debug("Could not enrich LLM best_product metadata (non-fatal).")
-                return normalized
+                return self._remember(key, self.postprocess(raw_resp))
             except Exception as e:
                 logger.exception("LLM generation failed; falling back: %s", e)
 
-        # fallback deterministic response using top candidate indices
-        top_idx = idxs[0]
-        best = self.retriever.get_product(top_idx)
+        return self.fallback_answer(idxs, rerank_top=rerank_top)
+
+    def answer_key(self, query: str, idxs: List[int], rerank_top: int = 5,
+                   embedding: Optional[np.ndarray] = None) -> Optional[Tuple[List[Any], Any]]:
+        """
+        (product_ids del contexto en orden, embedding de la query) o None si no hay answer cache.
+        embedding: el de la query si ya se tiene; si no, se calcula (bloquea: fuera del event loop).
+        """
+        if self.answer_cache is None:
+            return None
+        if embedding is None:
+            # el embedding suele salir de la cache de embeddings (ya se calculó para el retrieval)
+            embedding = self.retriever.encode([query])[0]
+        return self.retriever.store.product_ids(idxs[:rerank_top]), embedding
+
+    async def answer_key_async(self, query: str, idxs: List[int],
+                               rerank_top: int = 5) -> Optional[Tuple[List[Any], Any]]:
+        """
+        answer_key sin bloquear el event loop: el embedding pasa por el scheduler (o por un thread).
+        Con la cola del scheduler llena se sigue sin answer cache (None) en vez de rechazar la request.
+        """
+        if self.answer_cache is None:
+            return None
+        if self.scheduler is None:
+            return await asyncio.to_thread(self.answer_key, query, idxs, rerank_top)
+        try:
+            embedding = await self.scheduler.encode(query)
+        except QueueFullError as e:
+            logger.warning("Answer cache skipped: %s", e)
+            return None
+        return self.answer_key(query, idxs, rerank_top, embedding=embedding)
+
+    def _cached_answer(self, key) -> Optional[Dict[str, Any]]:
+        return self.answer_cache.get(*key) if key is not None else None
+
+    def _remember(self, key, answer: Dict[str, Any]) -> Dict[str, Any]:
+        # sólo se cachean respuestas del LLM que eligieron un producto (no fallbacks ni salidas sin JSON)
+        if key is not None and answer.get("best_product_id") is not None:
+            self.answer_cache.put(key[0], key[1], answer)
+        return answer
+
+    def postprocess(self, raw_resp: Dict[str, Any]) -> Dict[str, Any]:
+        """Normaliza la salida del LLM y añade la metadata del best_product_id (si existe)."""
+        normalized = self._normalize_llm_response(raw_resp)
+        # Try to enrich best_product metadata (best_product_id is a product_id, not a row idx)
+        try:
+            bpid = normalized.get("best_product_id")
+            if bpid is not None:
+                store = self.retriever.store
+                row = store.row_of(bpid)
+                if row is not None:
+                    normalized["_best_product_meta"] = store.get(row)
+        except Exception:
+            logger.debug("Could not enrich LLM best_product metadata (non-fatal).")
+        return normalized
+
+    def _candidate_list(self, idxs: List[int], scores: Optional[List[float]] = None) -> List[Dict[str, Any]]:
         top_candidates = []
-        for i in idxs[:rerank_top]:
+        for i, pid in enumerate(self.retriever.store.product_ids(idxs)):
             try:
-                pid = int(self.retriever.product_df.iloc[i]['product_id'])
-            except Exception:
-                pid = self.retriever.product_df.iloc[i]['product_id']
-            top_candidates.append({"product_id": pid, "score": None})
-        return {"best_product_id": best.get("product_id"), "reasons": ["fallback: top match"], "top_candidates": top_candidates}
+                pid = int(pid)
+            except ValueError:
+                pass
+            score = float(scores[i]) if scores is not None and i < len(scores) else None
+            top_candidates.append({"product_id": pid, "score": score})
+        return top_candidates
+
+    def fallback_answer(self, idxs: List[int], rerank_top: int = 5, reason: str = "fallback: top match") -> Dict[str, Any]:
+        """Respuesta determinística con los candidatos del retrieval (sin LLM, o si el LLM falla)."""
+        if not idxs:
+            return {"best_product_id": None, "reasons": ["no candidates"], "top_candidates": []}
+        best = self.retriever.get_product(idxs[0])
+        return {"best_product_id": best.get("product_id"), "reasons": [reason],
+                "top_candidates": self._candidate_list(idxs[:rerank_top])}
+
+    async def answer_async(self, query: str, idxs: List[int], rerank_top: int = 5) -> Dict[str, Any]:
+        """
+        answer_from_candidates a través del LLMPool: la generación ocupa un cliente del pool con
+        timeout; si vence o falla se devuelve el fallback. QueueFullError se propaga (-> 503).
+        """
+        if self.llm_pool is None:
+            return await asyncio.to_thread(self.answer_from_candidates, query, idxs, rerank_top)
+        if not idxs:
+            return self.fallback_answer(idxs)
+        key = await self.answer_key_async(query, idxs, rerank_top)
+        cached = self._cached_answer(key)
+        if cached is not None:
+            return cached
+        # get_products decodifica el store (mmap): en un thread para no bloquear el event loop
+        context = await asyncio.to_thread(self.build_context, idxs[:rerank_top])
+        try:
+            raw_resp = await self.llm_pool.generate(query, context)
+            return self._remember(key, self.postprocess(raw_resp))
+        except QueueFullError:
+            raise
+        except LLMTimeoutError as e:
+            logger.warning("LLM generation timed out; falling back: %s", e)
+            return self.fallback_answer(idxs, rerank_top=rerank_top, reason="fallback: LLM timeout")
+        except Exception as e:
+            logger.exception("LLM generation failed; falling back: %s", e)
+            return self.fallback_answer(idxs, rerank_top=rerank_top)
+
+    async def stream_answer(self, query: str, idxs: List[int], scores: Optional[List[float]] = None,
+                            rerank_top: int = 5) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Versión streaming para /rag/stream. Emite eventos (nombre, payload):
+          - ("candidates", {...}) en cuanto están los candidatos rerankeados (antes de llamar al LLM)
+          - ("token", {"text": ...}) por cada token del LLM
+          - ("error", {...}) si la generación vence el timeout o falla
+          - ("answer", {...}) respuesta final normalizada (o fallback), siempre la última; con un hit
+            en la answer cache se emite directamente, sin tokens
+        Cerrar el generador (cliente desconectado) cancela la generación en curso.
+        """
+        yield "candidates", {"top_candidates": self._candidate_list(idxs[:rerank_top], scores)}
+        if not idxs:
+            yield "answer", self.fallback_answer(idxs)
+            return
+        if self.llm_pool is None:
+            yield "answer", await asyncio.to_thread(self.answer_from_candidates, query, idxs, rerank_top)
+            return
+        key = await self.answer_key_async(query, idxs, rerank_top)
+        cached = self._cached_answer(key)
+        if cached is not None:
+            yield "answer", cached
+            return
+
+        context = await asyncio.to_thread(self.build_context, idxs[:rerank_top])
+        chunks: List[str] = []
+        raw_resp: Optional[Dict[str, Any]] = None
+        try:
+            async for item in self.llm_pool.stream(query, context):
+                if isinstance(item, dict):
+                    raw_resp = item
+                else:
+                    chunks.append(item)
+                    yield "token", {"text": item}
+        except (LLMTimeoutError, QueueFullError) as e:
+            logger.warning("LLM streaming aborted; falling back: %s", e)
+            reason = "fallback: LLM timeout" if isinstance(e, LLMTimeoutError) else "fallback: LLM busy"
+            yield "error", {"detail": str(e)}
+            yield "answer", self.fallback_answer(idxs, rerank_top=rerank_top, reason=reason)
+            return
+        except Exception as e:
+            logger.exception("LLM streaming failed; falling back: %s", e)
+            yield "error", {"detail": str(e)}
+            yield "answer", self.fallback_answer(idxs, rerank_top=rerank_top)
+            return
+        answer = self.postprocess(raw_resp if raw_resp is not None else {"raw": "".join(chunks)})
+        yield "answer", self._remember(key, answer)
@@ -1,21 +1,214 @@
-from sentence_transformers import CrossEncoder
 import logging
+from typing import List, Optional
+
+import numpy as np
+
+from app.utils.metrics import metrics, SIZE_BUCKETS
 
 logger = logging.getLogger(__name__)
 
+
+class CascadeRanking:
+    """
+    Rerank en cascada de una query con parada temprana:
+      - los candidatos se ordenan por una puntuación barata (score de retrieval o cross-encoder ligero)
+      - el cross-encoder completo puntúa en ese orden: primero top_m + batch_size, luego lotes de batch_size
+      - tras cada lote se ajusta full ≈ a·cheap + b sobre los pares ya puntuados; con el mayor residuo
+        como holgura, a·cheap_siguiente + b + holgura acota la puntuación de cualquier candidato pendiente
+      - se para cuando el m-ésimo mejor score completo supera esa cota en al menos margin: el top_m ya
+        no puede cambiar (salvo que el ajuste se equivoque por más de margin)
+    Si la puntuación barata no está correlacionada (pendiente <= 0) se puntúan todos los candidatos.
+    """
+    MIN_FIT_POINTS = 3
+
+    def __init__(self, candidate_indices: list, cheap_scores, top_m: int, batch_size: int = 8,
+                 margin: float = 1.0):
+        self.candidate_indices = list(candidate_indices)
+        self.cheap = np.asarray(cheap_scores, dtype=np.float64)
+        self.top_m = min(top_m, len(self.candidate_indices))
+        self.batch_size = max(1, batch_size)
+        self.margin = margin
+        self.order = np.argsort(-self.cheap, kind="stable")
+        self.full = np.full(len(self.candidate_indices), np.nan)
+        self.pairs_scored = 0
+        self.done = self.top_m <= 0
+
+    @property
+    def num_candidates(self) -> int:
+        return len(self.candidate_indices)
+
+    def next_batch(self) -> List[int]:
+        """Posiciones (en candidate_indices) que hay que puntuar a continuación; [] si ya ha terminado."""
+        if self.done:
+            return []
+        size = self.batch_size if self.pairs_scored else self.top_m + self.batch_size
+        return self.order[self.pairs_scored:self.pairs_scored + size].tolist()
+
+    def add(self, positions: List[int], scores):
+        self.full[positions] = np.asarray(scores, dtype=np.float64)
+        self.pairs_scored += len(positions)
+        self.done = self.pairs_scored >= self.num_candidates or self._settled()
+
+    def _settled(self) -> bool:
+        scored = self.order[:self.pairs_scored]
+        full, cheap = self.full[scored], self.cheap[scored]
+        theta = np.partition(full, len(full) - self.top_m)[len(full) - self.top_m]
+        return theta - self._upper_bound(cheap, full, self.cheap[self.order[self.pairs_scored]]) >= self.margin
+
+    @classmethod
+    def _upper_bound(cls, cheap: np.ndarray, full: np.ndarray, cheap_next: float) -> float:
+        if len(cheap) < cls.MIN_FIT_POINTS or np.ptp(cheap) <= 0:
+            return np.inf
+        slope, intercept = np.polyfit(cheap, full, 1)
+        if slope <= 0:
+            return np.inf
+        slack = float(np.max(full - (slope * cheap + intercept)))
+        return slope * cheap_next + intercept + slack
+
+    def result(self):
+        scored = self.order[:self.pairs_scored]
+        return Reranker.rank(self.full[scored], [self.candidate_indices[p] for p in scored], self.top_m)
+
+
 class Reranker:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, batch_size: int = 128, inference_backend: str = "torch",
+                 onnx_dir: str = "", onnx_quantize: bool = True, onnx_threads: int = 0,
+                 cascade: bool = False, cascade_batch_size: int = 8, cascade_margin: float = 1.0,
+                 cascade_model_name: str = ""):
         self.model_name = model_name
+        self.batch_size = batch_size
+        # torch (CrossEncoder) | onnx (ONNX Runtime, int8 dinámico); misma interfaz .predict
+        self.inference_backend = inference_backend
+        self.onnx_dir = onnx_dir
+        self.onnx_quantize = onnx_quantize
+        self.onnx_threads = onnx_threads
+        # rerank en cascada (CascadeRanking): etapa barata = cascade_model_name si se indica
+        # (cross-encoder ligero/destilado), si no el score de retrieval de cada candidato
+        self.cascade = cascade
+        self.cascade_batch_size = cascade_batch_size
+        self.cascade_margin = cascade_margin
+        self.cascade_model_name = cascade_model_name
         self.model = None
+        self.cascade_model = None
+
+    def _load_model(self, model_name: str):
+        if self.inference_backend == "onnx":
+            from app.models.onnx_backend import load_onnx_model
+            return load_onnx_model(model_name, "cross_encoder", self.onnx_dir,
+                                   quantize=self.onnx_quantize, intra_op_threads=self.onnx_threads)
+        # import diferido: con INFERENCE_BACKEND=onnx el serving no necesita torch
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
 
     def load(self):
-        logger.info("Cargando reranker %s", self.model_name)
-        self.model = CrossEncoder(self.model_name)
-
-    def rerank(self, query: str, candidate_texts: list, candidate_indices: list, top_m: int = 10):
-        inputs = [[query, txt] for txt in candidate_texts]
-        scores = self.model.predict(inputs)
-        ranked = sorted(range(len(candidate_indices)), key=lambda i: scores[i], reverse=True)
-        ranked_indices = [candidate_indices[i] for i in ranked[:top_m]]
-        ranked_scores = [scores[i] for i in ranked[:top_m]]
-        return ranked_indices, ranked_scores
+        logger.info("Cargando reranker %s (backend=%s)", self.model_name, self.inference_backend)
+        self.model = self._load_model(self.model_name)
+        if self.cascade and self.cascade_model_name:
+            logger.info("Cargando reranker ligero de la cascada %s", self.cascade_model_name)
+            self.cascade_model = self._load_model(self.cascade_model_name)
+
+    def score_pairs(self, pairs: list):
+        metrics.observe_batch("rerank", len(pairs))
+        with metrics.timer("rerank_predict"):
+            return self.model.predict(pairs, batch_size=self.batch_size)
+
+    def cheap_score_pairs(self, pairs: list):
+        metrics.observe_batch("rerank_cheap", len(pairs))
+        metrics.inc("rerank_pairs_total", len(pairs), stage="cheap")
+        with metrics.timer("rerank_cheap_predict"):
+            return self.cascade_model.predict(pairs, batch_size=self.batch_size)
+
+    @staticmethod
+    def rank(scores, candidate_indices: list, top_m: int):
+        """Top top_m por score (argpartition + orden sólo de los seleccionados)."""
+        scores = np.asarray(scores, dtype=np.float32)
+        k = min(top_m, len(scores))
+        if k <= 0:
+            return [], []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [candidate_indices[i] for i in top], scores[top].tolist()
+
+    @staticmethod
+    def report_pairs(num_candidates: int, pairs_scored: int):
+        """Pares puntuados por el cross-encoder completo para una query (métricas + desglose de la request)."""
+        metrics.observe("rerank_pairs_per_query", pairs_scored, buckets=SIZE_BUCKETS)
+        metrics.inc("rerank_pairs_total", pairs_scored, stage="full")
+        metrics.inc("rerank_pairs_skipped_total", num_candidates - pairs_scored)
+        metrics.count("rerank_pairs", pairs_scored)
+        metrics.count("rerank_candidates", num_candidates)
+
+    def cheap_scores(self, queries: List[str], candidate_texts: List[list],
+                     retrieval_scores: Optional[List[list]] = None) -> Optional[List[list]]:
+        """
+        Puntuaciones de la etapa barata por query: el cross-encoder ligero (una sola llamada batched
+        para todas las queries) si está cargado, si no los scores de retrieval tal cual.
+        """
+        if self.cascade_model is None:
+            return retrieval_scores
+        inputs = [[query, txt] for query, texts in zip(queries, candidate_texts) for txt in texts]
+        scores = self.cheap_score_pairs(inputs) if inputs else []
+        result, start = [], 0
+        for texts in candidate_texts:
+            result.append(scores[start:start + len(texts)])
+            start += len(texts)
+        return result
+
+    def start_cascade(self, candidate_indices: list, cheap_scores, top_m: int) -> Optional[CascadeRanking]:
+        """CascadeRanking de la query, o None si la cascada está desactivada o no hay etapa barata."""
+        if not self.cascade or not candidate_indices or cheap_scores is None:
+            return None
+        return CascadeRanking(candidate_indices, cheap_scores, top_m, self.cascade_batch_size, self.cascade_margin)
+
+    def finish_cascade(self, cascade: CascadeRanking):
+        self.report_pairs(cascade.num_candidates, cascade.pairs_scored)
+        return cascade.result()
+
+    def rerank(self, query: str, candidate_texts: list, candidate_indices: list, top_m: int = 10,
+               cheap_scores=None):
+        return self.rerank_batch([query], [candidate_texts], [candidate_indices], top_m=top_m,
+                                 cheap_scores=None if cheap_scores is None else [cheap_scores])[0]
+
+    def rerank_batch(self, queries: List[str], candidate_texts: List[list], candidate_indices: List[list],
+                     top_m: int = 10, cheap_scores: Optional[List[list]] = None):
+        """
+        Puntúa todos los pares (query, candidato) de varias queries en llamadas batched a
+        CrossEncoder.predict y devuelve una lista [(ranked_indices, ranked_scores), ...] en el mismo orden.
+        Con cascada, la etapa barata (cheap_scores: scores de retrieval por query) ordena los candidatos
+        y cada ronda agrupa en una sola llamada los pares pendientes de todas las queries que no han parado.
+        """
+        if self.cascade:
+            cheap_scores = self.cheap_scores(queries, candidate_texts, cheap_scores)
+            if cheap_scores is not None:
+                cascades = [self.start_cascade(idxs, cheap, top_m)
+                            for idxs, cheap in zip(candidate_indices, cheap_scores)]
+                return self._rerank_cascade(queries, candidate_texts, cascades)
+
+        inputs = []
+        offsets = [0]
+        for query, texts in zip(queries, candidate_texts):
+            inputs.extend([query, txt] for txt in texts)
+            offsets.append(len(inputs))
+        scores = self.score_pairs(inputs) if inputs else []
+        results = []
+        for q, idxs in enumerate(candidate_indices):
+            start, end = offsets[q], offsets[q + 1]
+            self.report_pairs(end - start, end - start)
+            results.append(self.rank(scores[start:end], idxs, top_m))
+        return results
+
+    def _rerank_cascade(self, queries: List[str], candidate_texts: List[list], cascades: list):
+        # queries sin candidatos: cascada vacía (ya terminada) para no tratarlas aparte
+        cascades = [c if c is not None else CascadeRanking([], [], 0) for c in cascades]
+        while True:
+            rounds = [(q, cascade.next_batch()) for q, cascade in enumerate(cascades)]
+            rounds = [(q, positions) for q, positions in rounds if positions]
+            if not rounds:
+                break
+            inputs = [[queries[q], candidate_texts[q][p]] for q, positions in rounds for p in positions]
+            scores = self.score_pairs(inputs)
+            start = 0
+            for q, positions in rounds:
+                cascades[q].add(positions, scores[start:start + len(positions)])
+                start += len(positions)
+        return [self.finish_cascade(cascade) for cascade in cascades]
@@ -1,35 +1,475 @@
+import os
 import faiss
 import numpy as np
-import pandas as pd
-from sentence_transformers import SentenceTransformer
 import logging
+from typing import List, Optional, Tuple
+from app.utils.cache import LRUCache, normalize_query
+from app.models.product_store import ProductStore
+from app.models.index_factory import bitmap_selector, search_parameters, describe, read_index
+from app.models.catalog import CatalogView, current_view, merge_topk, pinned_view
+from app.models.lexical import LexicalIndex, reciprocal_rank_fusion
+from app.models.filters import FILTER_COLUMNS, MetadataIndex, ProductFilter
+from app.utils.index_builder import read_manifest, model_basename
+from app.utils.metrics import metrics
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
 
 logger = logging.getLogger(__name__)
 
 class Retriever:
-    def __init__(self, index_path: str, product_csv: str, embed_model_name: str):
+    def __init__(self, index_path: str, product_csv: str, embed_model_name: str, encode_batch_size: int = 64,
+                 embedding_cache: Optional[LRUCache] = None, product_store_dir: str = "",
+                 nprobe: int = 16, ef_search: int = 64, exact_rescore: bool = False, rescore_factor: int = 4,
+                 embeddings_path: str = "", manifest_path: str = "", retrieval_mode: str = "dense",
+                 lexical_index_path: str = "", lexical_build_on_load: bool = False, rrf_k: int = 60,
+                 inference_backend: str = "torch", onnx_dir: str = "", onnx_quantize: bool = True,
+                 onnx_threads: int = 0, index_mmap: bool = False, snapshot_on_load: bool = True,
+                 filter_brute_force_max_rows: int = 5000, filter_cache_size: int = 256):
         self.index_path = index_path
         self.product_csv = product_csv
         self.embed_model_name = embed_model_name
+        self.encode_batch_size = encode_batch_size
+        self.embedding_cache = embedding_cache
+        self.product_store_dir = product_store_dir
+        # knobs de búsqueda ANN por defecto (se pueden sobreescribir por request)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.exact_rescore = exact_rescore
+        self.rescore_factor = rescore_factor
+        self.embeddings_path = embeddings_path
+        self.manifest_path = manifest_path
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}")
+        self.retrieval_mode = retrieval_mode
+        self.lexical_index_path = lexical_index_path
+        self.lexical_build_on_load = lexical_build_on_load
+        self.rrf_k = rrf_k
+        # torch (SentenceTransformer) | onnx (ONNX Runtime, int8 dinámico); misma interfaz .encode
+        self.inference_backend = inference_backend
+        self.onnx_dir = onnx_dir
+        self.onnx_quantize = onnx_quantize
+        self.onnx_threads = onnx_threads
+        # mmap del índice FAISS (arranque rápido, sólo lectura) y escritura del ProductStore si se
+        # tuvo que construir desde el CSV, para que el siguiente arranque lo mapee directamente
+        self.index_mmap = index_mmap
+        self.snapshot_on_load = snapshot_on_load
+        # filtros de metadatos: por debajo de este nº de filas se puntúa el subconjunto por fuerza bruta
+        self.filter_brute_force_max_rows = filter_brute_force_max_rows
+        self.filter_cache = LRUCache(maxsize=filter_cache_size)
+        self.metadata: Optional[MetadataIndex] = None
+        self.lexical: Optional[LexicalIndex] = None
         self.index = None
-        self.product_df = None
+        self._store: Optional[ProductStore] = None
+        # vectores float32 originales (mmap) para re-puntuar exactamente el shortlist ANN
+        self.vectors: Optional[np.ndarray] = None
         self.embedding_model = None
+        # vista publicada del catálogo (base + cambios en vivo); cada búsqueda la captura una vez
+        self.view: Optional[CatalogView] = None
+        # manifest de la base cargada (build o última compactación persistida)
+        self.manifest: Optional[dict] = None
 
     def load(self):
+        """Carga secuencial; main.py usa los pasos por separado para cargarlos en paralelo."""
+        self.load_store()
+        self.load_embedding_model()
+        self.load_index()
+        self.finalize()
+
+    def load_store(self):
+        if self.product_store_dir and os.path.isdir(self.product_store_dir):
+            logger.info("Cargando product store (mmap) desde %s", self.product_store_dir)
+            self.store = ProductStore.load(self.product_store_dir, mmap=True)
+            return
         logger.info("Cargando productos desde %s", self.product_csv)
-        self.product_df = pd.read_csv(self.product_csv, sep='\t', dtype={'product_id': object})
-        logger.info("Cargando modelo de embeddings %s", self.embed_model_name)
-        self.embedding_model = SentenceTransformer(self.embed_model_name)
-        logger.info("Cargando FAISS index desde %s", self.index_path)
-        self.index = faiss.read_index(self.index_path)
-
-    def retrieve(self, query: str, top_k: int = 50):
-        q_emb = self.embedding_model.encode([query], convert_to_tensor=False)
-        q_np = np.array(q_emb).astype('float32')
+        store = ProductStore.from_csv(self.product_csv)
+        if self.product_store_dir and self.snapshot_on_load:
+            try:
+                # se escribe en un directorio temporal y se renombra: otro proceso nunca ve un store a medias
+                tmp_dir = f"{self.product_store_dir.rstrip('/')}.tmp-{os.getpid()}"
+                store.save(tmp_dir)
+                os.rename(tmp_dir, self.product_store_dir)
+                logger.info("Product store snapshot written to %s", self.product_store_dir)
+                store = ProductStore.load(self.product_store_dir, mmap=True)
+            except OSError as e:
+                logger.warning("Could not write product store snapshot to %s: %s", self.product_store_dir, e)
+        self.store = store
+
+    def load_embedding_model(self):
+        logger.info("Cargando modelo de embeddings %s (backend=%s)", self.embed_model_name, self.inference_backend)
+        if self.inference_backend == "onnx":
+            from app.models.onnx_backend import load_onnx_model
+            self.embedding_model = load_onnx_model(self.embed_model_name, "embedder", self.onnx_dir,
+                                                   quantize=self.onnx_quantize, intra_op_threads=self.onnx_threads)
+        else:
+            # import diferido: con INFERENCE_BACKEND=onnx el serving no necesita torch
+            from sentence_transformers import SentenceTransformer
+            self.embedding_model = SentenceTransformer(self.embed_model_name)
+
+    def load_index(self):
+        logger.info("Cargando FAISS index desde %s (mmap=%s)", self.index_path, self.index_mmap)
+        self.index = read_index(self.index_path, mmap=self.index_mmap)
+        logger.info("FAISS index: %s", describe(self.index))
+
+    def finalize(self):
+        """
+        Pasos que necesitan store + índice + modelo: manifest, vectores de re-scoring, índice léxico
+        y bitsets de metadatos para los filtros.
+        """
+        self.manifest = self._check_manifest()
+        if self.exact_rescore:
+            self._load_rescore_vectors()
+        self._load_lexical()
+        self._load_metadata()
+        originals = self._original_vectors(self.index) if self.vectors is None else None
+        self.swap_view(CatalogView.from_base(self.index, self.store, self.lexical, self.metadata, self.vectors,
+                                             self.filter_cache,
+                                             watermark=(self.manifest or {}).get("catalog_watermark") or "",
+                                             originals=originals))
+
+    def load_base(self, manifest: dict, lexical: Optional[LexicalIndex] = None,
+                  metadata: Optional[MetadataIndex] = None) -> CatalogView:
+        """
+        Vista (sin publicar) de la base que describe manifest, persistida por la compactación del catálogo
+        vivo: índice, store y embeddings se mapean de disco como en el arranque, así todos los workers
+        comparten esas páginas. lexical / metadata: los ya construidos para esa base (si no, se cargan).
+        Con los mismos componentes que la vista publicada (BM25, bitsets, re-scoring).
+        """
+        num_rows = manifest["num_rows"]
+        index = read_index(self.index_path, mmap=self.index_mmap)
+        store = ProductStore.load(self.product_store_dir, mmap=True)
+        if index.ntotal != num_rows or len(store) != num_rows:
+            raise ValueError(f"Persisted catalog base mismatch: manifest {num_rows} rows, index {index.ntotal}, "
+                             f"product store {len(store)}")
+        vectors = None
+        if self.view.vectors is not None:
+            vectors = np.load(self.embeddings_path, mmap_mode='r')
+            if vectors.shape != (num_rows, index.d):
+                raise ValueError(f"Embeddings {self.embeddings_path} shape {vectors.shape} does not match index "
+                                 f"({num_rows}, {index.d})")
+        if lexical is None and self.view.lexical is not None:
+            if self.lexical_index_path and os.path.exists(self.lexical_index_path):
+                lexical = LexicalIndex.load(self.lexical_index_path)
+            else:
+                lexical = LexicalIndex.build_from_store(store)
+            if lexical.num_docs != num_rows:
+                raise ValueError(f"Lexical index has {lexical.num_docs} docs but the persisted base has {num_rows}")
+        if metadata is None and self.view.metadata is not None:
+            metadata = MetadataIndex.from_store(store)
+        if vectors is None and metadata is not None:
+            self._make_direct_map(index)
+        return CatalogView.from_base(index, store, lexical, metadata, vectors, LRUCache(self.filter_cache.maxsize),
+                                     watermark=manifest.get("catalog_watermark") or "",
+                                     originals=vectors if vectors is not None else self._original_vectors(index))
+
+    def _original_vectors(self, index) -> Optional[np.ndarray]:
+        """
+        EMBEDDINGS_PATH mapeado si está alineado con index, aunque no haya re-scoring: la compactación del
+        catálogo vivo necesita los vectores originales si el índice no los reconstruye exactos (PQ).
+        """
+        if not self.embeddings_path or not os.path.exists(self.embeddings_path):
+            return None
+        vectors = np.load(self.embeddings_path, mmap_mode='r')
+        if vectors.shape != (index.ntotal, index.d):
+            logger.warning("Embeddings %s shape %s does not match index (%d, %d); the live catalog will not use them.",
+                           self.embeddings_path, vectors.shape, index.ntotal, index.d)
+            return None
+        return vectors
+
+    def swap_view(self, view: CatalogView):
+        """
+        Publica una vista nueva del catálogo (una asignación: las búsquedas en curso terminan con la que
+        capturaron). index / lexical / metadata / vectors apuntan a la base de la vista.
+        """
+        self.view = view
+        self.index, self.lexical, self.metadata, self.vectors = view.index, view.lexical, view.metadata, view.vectors
+
+    def read_view(self) -> Optional[CatalogView]:
+        """Vista fijada por la request en curso (CatalogViewMiddleware) o, si no hay, la publicada."""
+        return current_view() or self.view
+
+    def pinned(self):
+        """Context manager que fija la vista publicada (búsqueda + resolución de filas fuera de una request)."""
+        return pinned_view(self.view)
+
+    @property
+    def store(self) -> Optional[ProductStore]:
+        """Store que resuelve las filas devueltas por las búsquedas: el overlay base + delta de read_view()."""
+        view = self.read_view()
+        return view.store if view is not None else self._store
+
+    @store.setter
+    def store(self, store: ProductStore):
+        self._store = store
+
+    def _load_metadata(self):
+        if not any(col in self.store.columns for col in FILTER_COLUMNS):
+            logger.info("El product store no tiene columnas de metadatos; búsqueda filtrada desactivada "
+                        "(borra %s para regenerarlo desde el CSV).", self.product_store_dir)
+            return
+        if self.index.ntotal != len(self.store):
+            logger.warning("Índice (%d) y product store (%d) no coinciden; búsqueda filtrada desactivada.",
+                           self.index.ntotal, len(self.store))
+            return
+        self.metadata = MetadataIndex.from_store(self.store)
+        if self.vectors is None:
+            self._make_direct_map(self.index)
+
+    @staticmethod
+    def _make_direct_map(index):
+        # fuerza bruta sobre subconjuntos filtrados con index.reconstruct_batch: IVF necesita el direct map
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            try:
+                ivf.make_direct_map()
+            except RuntimeError as e:
+                logger.warning("Could not build the IVF direct map (%s); filtered searches will use "
+                               "the ANN index only.", e)
+
+    def _load_lexical(self):
+        if self.lexical_index_path and os.path.exists(self.lexical_index_path):
+            logger.info("Cargando índice léxico BM25 desde %s", self.lexical_index_path)
+            self.lexical = LexicalIndex.load(self.lexical_index_path)
+        elif self.lexical_build_on_load:
+            logger.info("Construyendo índice léxico BM25 desde el product store")
+            self.lexical = LexicalIndex.build_from_store(self.store)
+            if self.lexical_index_path and self.snapshot_on_load:
+                try:
+                    self.lexical.save(self.lexical_index_path)
+                except OSError as e:
+                    logger.warning("Could not write lexical index to %s: %s", self.lexical_index_path, e)
+        if self.lexical is not None and self.lexical.num_docs != len(self.store):
+            raise ValueError(f"Lexical index has {self.lexical.num_docs} docs but product store has {len(self.store)} rows")
+        if self.lexical is None and self.retrieval_mode != "dense":
+            logger.warning("RETRIEVAL_MODE=%s sin índice léxico; se usará 'dense'.", self.retrieval_mode)
+            self.retrieval_mode = "dense"
+
+    def _check_manifest(self) -> Optional[dict]:
+        """Valida que índice, product store y modelo de embeddings provienen del mismo build."""
+        manifest = read_manifest(self.manifest_path)
+        if manifest is None:
+            if self.index.ntotal != len(self.store):
+                logger.warning("Sin manifest y el índice (%d) no coincide con el catálogo (%d filas).",
+                               self.index.ntotal, len(self.store))
+            return None
+        errors = []
+        if model_basename(manifest["model_name"]) != model_basename(self.embed_model_name):
+            errors.append(f"model {manifest['model_name']!r} != EMBED_MODEL {self.embed_model_name!r}")
+        if manifest["dim"] != self.index.d:
+            errors.append(f"dim {manifest['dim']} != index dim {self.index.d}")
+        if manifest["num_rows"] != self.index.ntotal:
+            errors.append(f"num_rows {manifest['num_rows']} != index ntotal {self.index.ntotal}")
+        if manifest["num_rows"] != len(self.store):
+            errors.append(f"num_rows {manifest['num_rows']} != product store rows {len(self.store)}")
+        get_dim = getattr(self.embedding_model, "get_sentence_embedding_dimension", None)
+        if get_dim is not None and get_dim() not in (None, manifest["dim"]):
+            errors.append(f"embedding model dim {get_dim()} != manifest dim {manifest['dim']}")
+        if errors:
+            raise ValueError(f"Index manifest {self.manifest_path} mismatch: " + "; ".join(errors))
+        logger.info("Manifest OK: %s, dim=%d, rows=%d", manifest["model_name"], manifest["dim"], manifest["num_rows"])
+        return manifest
+
+    def _load_rescore_vectors(self):
+        if not self.embeddings_path or not os.path.exists(self.embeddings_path):
+            logger.warning("EXACT_RESCORE activo pero no existe %s; se desactiva el re-scoring.", self.embeddings_path)
+            return
+        vectors = np.load(self.embeddings_path, mmap_mode='r')
+        if vectors.shape != (self.index.ntotal, self.index.d):
+            raise ValueError(
+                f"Embeddings {self.embeddings_path} shape {vectors.shape} does not match index "
+                f"({self.index.ntotal}, {self.index.d})"
+            )
+        self.vectors = vectors
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        """
+        Codifica las queries en una sola llamada batched y normaliza L2 (matriz float32 n x d).
+        Si hay embedding_cache, sólo se codifican las queries normalizadas que no estén en cache.
+        """
+        if self.embedding_cache is None:
+            return self._encode(queries)
+        keys = [normalize_query(q) for q in queries]
+        cached = {}
+        for k in keys:
+            if k not in cached:
+                v = self.embedding_cache.get(k)
+                if v is not None:
+                    cached[k] = v
+        missing = [k for k in dict.fromkeys(keys) if k not in cached]
+        if missing:
+            for k, v in zip(missing, self._encode(missing)):
+                self.embedding_cache.put(k, v)
+                cached[k] = v
+        return np.ascontiguousarray(np.stack([cached[k] for k in keys]))
+
+    def encode_documents(self, texts: List[str]) -> np.ndarray:
+        """Embeddings de productos para el catálogo vivo (mismo modelo y normalización, sin cache)."""
+        return self._encode(texts)
+
+    def _encode(self, queries: List[str]) -> np.ndarray:
+        metrics.observe_batch("encode", len(queries))
+        with metrics.timer("encode"):
+            q_emb = self.embedding_model.encode(queries, batch_size=self.encode_batch_size, convert_to_tensor=False)
+        q_np = np.ascontiguousarray(np.asarray(q_emb, dtype='float32').reshape(len(queries), -1))
         faiss.normalize_L2(q_np)
-        D, I = self.index.search(q_np.reshape(1, -1), top_k)
-        return I.flatten().tolist(), D.flatten().tolist()
+        return q_np
+
+    def search(self, q_np: np.ndarray, top_k: int = 50, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, filters: Optional[ProductFilter] = None,
+               view: Optional[CatalogView] = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        Una única búsqueda matricial en FAISS; devuelve (indices, distances) por fila, en orden.
+        nprobe / ef_search sobreescriben los valores por defecto sólo para esta llamada.
+        Con re-scoring exacto se pide un shortlist de top_k * rescore_factor y se re-puntúa
+        contra los vectores originales.
+        filters: sólo se devuelven filas que cumplen el filtro (ver _search_filtered).
+        view: vista del catálogo (None -> read_view()); las filas del delta se buscan aparte y se
+        mezclan por score, y los tombstones del índice base se excluyen con un selector.
+        """
+        view = view or self.read_view()
+        if filters is not None:
+            return self._search_filtered(view, q_np, top_k, filters, nprobe, ef_search)
+        live = view.live_bitmap()
+        params = search_parameters(view.index, nprobe=nprobe or self.nprobe, ef_search=ef_search or self.ef_search,
+                                   sel=bitmap_selector(live) if live is not None else None)
+        return self._with_delta(view, q_np, top_k, self._ann_search(view, q_np, top_k, params))
+
+    def _ann_search(self, view: CatalogView, q_np: np.ndarray, top_k: int,
+                    params) -> List[Tuple[List[int], List[float]]]:
+        rescore = view.vectors is not None
+        k = top_k * self.rescore_factor if rescore else top_k
+        with metrics.timer("faiss_search"):
+            D, I = view.index.search(q_np, k, params=params)
+        results = []
+        for q, d_row, i_row in zip(q_np, D, I):
+            # FAISS rellena con -1 cuando hay menos de k resultados
+            keep = i_row >= 0
+            ids, dists = i_row[keep], d_row[keep]
+            if rescore and len(ids):
+                with metrics.timer("exact_rescore"):
+                    ids, dists = self._rescore(view.vectors, q, ids, top_k)
+            results.append((ids.tolist(), dists.tolist()))
+        return results
+
+    @staticmethod
+    def _with_delta(view: CatalogView, q_np: np.ndarray, top_k: int, results: List[Tuple[List[int], List[float]]],
+                    packed: Optional[np.ndarray] = None) -> List[Tuple[List[int], List[float]]]:
+        delta = view.search_delta(q_np, top_k, packed)
+        if delta is None:
+            return results
+        return [merge_topk(base, new, top_k) for base, new in zip(results, delta)]
+
+    def filter_bitmap(self, filters: ProductFilter) -> Tuple[np.ndarray, int]:
+        """(bitmap empaquetado, nº de filas) del filtro en read_view(); cacheado por filtro."""
+        return self.read_view().filter_bitmap(filters)
+
+    def _search_filtered(self, view: CatalogView, q_np: np.ndarray, top_k: int, filters: ProductFilter,
+                         nprobe: Optional[int], ef_search: Optional[int]) -> List[Tuple[List[int], List[float]]]:
+        """
+        Búsqueda restringida a las filas del filtro:
+          - filtro vacío -> sin resultados
+          - filtro muy selectivo (<= filter_brute_force_max_rows filas) -> producto escalar exacto
+            contra los vectores del subconjunto (más barato y exacto que recorrer el grafo/listas)
+          - si no, la búsqueda ANN con un faiss.IDSelectorBitmap: FAISS descarta los ids fuera del
+            filtro mientras recorre el índice, con un coste parecido al de la búsqueda sin filtro
+        IVF/HNSW pueden quedarse cortos con filtros raros (las listas/vecinos visitados no tienen
+        suficientes filas del filtro): esas queries se completan por fuerza bruta.
+        """
+        packed, count = view.filter_bitmap(filters)
+        if count == 0:
+            metrics.inc("filtered_searches_total", len(q_np), path="empty")
+            return [([], []) for _ in range(len(q_np))]
+        if count <= self.filter_brute_force_max_rows:
+            results = self._brute_force(view, q_np, view.rows(packed), top_k)
+            if results is not None:
+                metrics.inc("filtered_searches_total", len(q_np), path="brute_force")
+                return results
+        params = search_parameters(view.index, nprobe=nprobe or self.nprobe, ef_search=ef_search or self.ef_search,
+                                   sel=bitmap_selector(packed))
+        results = self._with_delta(view, q_np, top_k, self._ann_search(view, q_np, top_k, params), packed)
+        metrics.inc("filtered_searches_total", len(q_np), path="ann")
+        short = [i for i, (ids, _) in enumerate(results) if len(ids) < min(top_k, count)]
+        if short:
+            exact = self._brute_force(view, q_np[short], view.rows(packed), top_k)
+            if exact is not None:
+                metrics.inc("filtered_searches_total", len(short), path="brute_force_fallback")
+                for i, result in zip(short, exact):
+                    results[i] = result
+        return results
+
+    def _brute_force(self, view: CatalogView, q_np: np.ndarray, rows: np.ndarray,
+                     top_k: int) -> Optional[List[Tuple[List[int], List[float]]]]:
+        with metrics.timer("filter_brute_force"):
+            vectors = view.subset_vectors(rows)
+            if vectors is None:
+                return None
+            scores = q_np @ vectors.T  # (n_queries, n_rows)
+            k = min(top_k, len(rows))
+            if k < len(rows):
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(len(rows)), (len(q_np), len(rows)))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [(rows[t].tolist(), s.tolist()) for t, s in zip(top, top_scores)]
+
+    @staticmethod
+    def _rescore(vectors: np.ndarray, q: np.ndarray, ids: np.ndarray, top_k: int):
+        ids = np.sort(ids)  # acceso secuencial sobre el mmap
+        exact = vectors[ids] @ q
+        if len(ids) > top_k:
+            top = np.argpartition(-exact, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-exact[top], kind='stable')]
+        return ids[top], exact[top]
+
+    def retrieve(self, query: str, top_k: int = 50, **search_kwargs):
+        return self.retrieve_batch([query], top_k, **search_kwargs)[0]
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 50, mode: Optional[str] = None,
+                       embeddings: Optional[np.ndarray] = None, filters: Optional[ProductFilter] = None,
+                       **search_kwargs) -> List[Tuple[List[int], List[float]]]:
+        """
+        mode: 'dense' (FAISS), 'lexical' (BM25) o 'hybrid' (RRF de ambos); None -> retrieval_mode.
+        En hybrid las distancias devueltas son los scores RRF.
+        embeddings: vectores de las queries ya calculados (p.ej. por el InferenceScheduler).
+        filters: filtro de metadatos (mismo filtro para todas las queries del batch).
+        """
+        if not queries:
+            return []
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"mode must be one of {RETRIEVAL_MODES}")
+        # una sola vista para todo el batch aunque se publique otra mientras tanto
+        view = self.read_view()
+        if mode != "dense" and view.lexical is None:
+            raise ValueError(f"mode={mode!r} requires a lexical index (LEXICAL_INDEX_PATH)")
+
+        mask = None
+        if filters is not None and mode != "dense":
+            packed, count = view.filter_bitmap(filters)
+            if count == 0:
+                return [([], []) for _ in queries]
+            mask = view.mask(packed)
+        if mode == "lexical":
+            with metrics.timer("bm25_search"):
+                return [view.lexical_search(q, top_k, mask=mask) for q in queries]
+        if embeddings is None:
+            embeddings = self.encode(queries)
+        dense = self.search(embeddings, top_k, filters=filters, view=view, **search_kwargs)
+        if mode == "dense":
+            return dense
+        with metrics.timer("bm25_search"):
+            lexical = [view.lexical_search(q, top_k, mask=mask)[0] for q in queries]
+        return [
+            reciprocal_rank_fusion([d_idxs, l_idxs], k=self.rrf_k, top_k=top_k)
+            for (d_idxs, _), l_idxs in zip(dense, lexical)
+        ]
 
     def get_product(self, idx: int):
-        row = self.product_df.iloc[idx]
-        return {"product_id": row['product_id'], "product_name": row.get('product_name',''), "product_description": row.get('product_description','')}
+        return self.store.get(idx)
+
+    def get_products(self, idxs: List[int]):
+        return self.store.get_many(idxs)
@@ -0,0 +1,55 @@
+# app/models/scheduler.py
+import logging
+from typing import List
+
+import numpy as np
+
+from app.utils.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceScheduler:
+    """
+    Agrupa el trabajo de modelo de requests concurrentes en batches:
+      - encoder: queries -> embeddings (retriever.encode), hasta max_batch_size queries por batch
+      - scorer: listas de pares (query, texto) -> scores del cross-encoder, hasta max_batch_pairs pares
+    Cada batcher corre en su propio thread, de modo que el event loop nunca ejecuta un forward.
+    """
+    def __init__(self, retriever, reranker=None, max_batch_size: int = 64, max_batch_pairs: int = 512,
+                 max_wait_ms: float = 5.0, max_queue: int = 256):
+        self.retriever = retriever
+        self.reranker = reranker
+        self.encoder = MicroBatcher(self._encode_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    max_queue=max_queue, name="encode-batcher")
+        self.scorer = MicroBatcher(self._score_batch, max_batch_size=max_batch_pairs, max_wait_ms=max_wait_ms,
+                                   max_queue=max_queue, weight_fn=len, name="rerank-batcher")
+
+    async def start(self):
+        await self.encoder.start()
+        await self.scorer.start()
+
+    async def stop(self):
+        await self.encoder.stop()
+        await self.scorer.stop()
+
+    def _encode_batch(self, queries: List[str]) -> List[np.ndarray]:
+        return list(self.retriever.encode(queries))
+
+    def _score_batch(self, pair_lists: List[list]) -> List[np.ndarray]:
+        flat = [pair for pairs in pair_lists for pair in pairs]
+        scores = np.asarray(self.reranker.score_pairs(flat), dtype=np.float32) if flat else np.empty(0, np.float32)
+        out, start = [], 0
+        for pairs in pair_lists:
+            out.append(scores[start:start + len(pairs)])
+            start += len(pairs)
+        return out
+
+    async def encode(self, query: str) -> np.ndarray:
+        return await self.encoder.submit(query)
+
+    async def score(self, query: str, texts: List[str]) -> np.ndarray:
+        return await self.scorer.submit([[query, t] for t in texts])
+
+    def stats(self) -> dict:
+        return {"encode_queue_depth": self.encoder.depth, "rerank_queue_depth": self.scorer.depth}
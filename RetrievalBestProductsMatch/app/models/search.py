@@ -0,0 +1,158 @@
+# app/models/search.py
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from app.utils.batching import QueueFullError
+from app.utils.cache import QueryCache
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SearchService:
+    """
+    Orquestador de búsqueda (retrieve -> rerank opcional -> top_m):
+      - retriever: objeto con .retrieve_batch(queries, top_k), .get_products(idxs) y .store (ProductStore)
+      - reranker: Reranker (.rerank_batch(queries, candidate_texts, candidate_indices, top_m, cheap_scores)
+        y, para rank_async, la cascada paso a paso); opcional
+      - cache: QueryCache para las listas finales de resultados (opcional)
+      - scheduler: InferenceScheduler para agrupar encode/rerank de requests concurrentes (opcional,
+        usado por search_async / rank_async)
+    """
+    def __init__(self, retriever, reranker=None, cache: Optional[QueryCache] = None, scheduler=None):
+        self.retriever = retriever
+        self.reranker = reranker
+        self.cache = cache
+        self.scheduler = scheduler
+
+    def candidate_texts(self, idxs: List[int]) -> List[str]:
+        with metrics.timer("candidate_texts"):
+            return self.retriever.store.rerank_texts(idxs)
+
+    def _format_results(self, idxs: List[int], scores: List[float], rerank_m: int) -> List[Dict[str, Any]]:
+        products = self.retriever.get_products(idxs[:rerank_m])
+        return [{**p, "score": float(score)} for p, score in zip(products, scores[:rerank_m])]
+
+    @staticmethod
+    def _options_key(search_kwargs: Dict[str, Any]) -> tuple:
+        return tuple(sorted((k, v) for k, v in search_kwargs.items() if v is not None))
+
+    def search(self, query: str, top_k: int = 50, rerank_m: int = 10, use_rerank: bool = True,
+               **search_kwargs) -> List[Dict[str, Any]]:
+        return self.search_batch([query], top_k=top_k, rerank_m=rerank_m, use_rerank=use_rerank, **search_kwargs)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 50, rerank_m: int = 10, use_rerank: bool = True,
+                     **search_kwargs) -> List[List[Dict[str, Any]]]:
+        """
+        Ejecuta el pipeline para varias queries a la vez: un encode batched, una búsqueda
+        matricial en FAISS y un rerank batched. Devuelve los resultados por query, en orden.
+        search_kwargs (nprobe, ef_search, ...) se pasan tal cual a retriever.retrieve_batch.
+        """
+        if not queries:
+            return []
+        if self.cache is None:
+            return self._run_batch(queries, top_k, rerank_m, use_rerank, search_kwargs)
+
+        options = self._options_key(search_kwargs)
+        results: List[Optional[List[Dict[str, Any]]]] = [
+            self.cache.get_results(q, top_k, rerank_m, use_rerank, options) for q in queries
+        ]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            computed = self._run_batch([queries[i] for i in missing], top_k, rerank_m, use_rerank, search_kwargs)
+            for i, r in zip(missing, computed):
+                self.cache.put_results(queries[i], top_k, rerank_m, use_rerank, r, options)
+                results[i] = r
+        return results
+
+    def _run_batch(self, queries: List[str], top_k: int, rerank_m: int, use_rerank: bool,
+                   search_kwargs: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+        candidates = self.retriever.retrieve_batch(queries, top_k=top_k, **search_kwargs)
+        if use_rerank and self.reranker:
+            texts = [self.candidate_texts(idxs) for idxs, _ in candidates]
+            all_idxs = [idxs for idxs, _ in candidates]
+            candidates = self.reranker.rerank_batch(queries, texts, all_idxs, top_m=rerank_m,
+                                                    cheap_scores=[scores for _, scores in candidates])
+        return [self._format_results(idxs, scores, rerank_m) for idxs, scores in candidates]
+
+    async def rank_async(self, query: str, top_k: int = 50, rerank_m: int = 10, use_rerank: bool = True,
+                         mode: Optional[str] = None, **search_kwargs):
+        """
+        Versión async de retrieve -> rerank para una query: encode y cross-encoder pasan por el
+        scheduler (micro-batching con otras requests); FAISS/BM25 corren en un thread.
+        Devuelve (indices, scores) ya ordenados; si el reranker falla, el orden de retrieval.
+        """
+        idxs, scores, _ = await self._rank_async(query, top_k, rerank_m, use_rerank, mode, **search_kwargs)
+        return idxs, scores
+
+    async def _rank_async(self, query: str, top_k: int, rerank_m: int, use_rerank: bool, mode: Optional[str],
+                          **search_kwargs):
+        """(indices, scores, ok): ok=False si el rerank pedido ha fallado y se devuelve el orden de retrieval."""
+        mode = mode or self.retriever.retrieval_mode
+        embeddings = None
+        if mode != "lexical":
+            # esperas por el batch compartido: sólo cuentan en el desglose de la request (el
+            # histograma lo registra el thread del batcher)
+            with metrics.timer("encode", histogram=False):
+                embeddings = (await self.scheduler.encode(query))[np.newaxis, :]
+        idxs, scores = (await asyncio.to_thread(
+            self.retriever.retrieve_batch, [query], top_k, mode=mode, embeddings=embeddings, **search_kwargs
+        ))[0]
+        if use_rerank and self.reranker and idxs:
+            try:
+                return (*await self._rerank_async(query, idxs, scores, rerank_m), True)
+            except QueueFullError:
+                raise
+            except Exception as e:
+                # como RAGService.retrieve_candidates: un fallo del reranker no tumba la request
+                logger.exception("Reranker failed, continuing with retrieval order: %s", e)
+                metrics.inc("rerank_failures_total")
+                return idxs, scores, False
+        return idxs, scores, True
+
+    async def _rerank_async(self, query: str, idxs: List[int], scores: List[float], rerank_m: int):
+        texts = self.candidate_texts(idxs)
+        cascade = None
+        if self.reranker.cascade:
+            cheap_scores = [scores]
+            if self.reranker.cascade_model is not None:
+                cheap_scores = await asyncio.to_thread(self.reranker.cheap_scores, [query], [texts])
+            cascade = self.reranker.start_cascade(idxs, cheap_scores[0], rerank_m)
+        if cascade is not None:
+            # cada lote de la cascada se agrupa en el scheduler con los de otras requests
+            positions = cascade.next_batch()
+            while positions:
+                with metrics.timer("rerank_predict", histogram=False):
+                    ce_scores = await self.scheduler.score(query, [texts[p] for p in positions])
+                cascade.add(positions, ce_scores)
+                positions = cascade.next_batch()
+            return self.reranker.finish_cascade(cascade)
+        with metrics.timer("rerank_predict", histogram=False):
+            ce_scores = await self.scheduler.score(query, texts)
+        self.reranker.report_pairs(len(idxs), len(idxs))
+        return self.reranker.rank(ce_scores, idxs, rerank_m)
+
+    async def search_async(self, query: str, top_k: int = 50, rerank_m: int = 10, use_rerank: bool = True,
+                           **search_kwargs) -> List[Dict[str, Any]]:
+        options = self._options_key(search_kwargs)
+        if self.cache is not None:
+            cached = self.cache.get_results(query, top_k, rerank_m, use_rerank, options)
+            if cached is not None:
+                return cached
+        mode = search_kwargs.pop("mode", None)
+        idxs, scores, ok = await self._rank_async(query, top_k, rerank_m, use_rerank, mode, **search_kwargs)
+        results = self._format_results(idxs, scores, rerank_m)
+        # el orden de retrieval de un rerank fallido no se cachea con la clave use_rerank=True
+        if self.cache is not None and ok:
+            self.cache.put_results(query, top_k, rerank_m, use_rerank, results, options)
+        return results
+
+    def warm_up(self, queries: List[str], top_k: int = 50, rerank_m: int = 10, use_rerank: bool = True,
+                batch_size: int = 64) -> int:
+        """Precalcula (y deja en cache) los resultados de una lista de queries, en lotes."""
+        for start in range(0, len(queries), batch_size):
+            self.search_batch(queries[start:start + batch_size], top_k=top_k, rerank_m=rerank_m, use_rerank=use_rerank)
+        return len(queries)
@@ -1,11 +1,30 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import List, Literal, Optional, Union
+
+RetrievalMode = Literal["dense", "lexical", "hybrid"]
+
+class SearchFilters(BaseModel):
+    # clase exacta y prefijo de 'category hierarchy' por niveles ("Furniture / Bedroom Furniture"),
+    # sin distinguir mayúsculas
+    product_class: Optional[str] = None
+    category: Optional[str] = None
+    min_rating: Optional[float] = None
+    max_rating: Optional[float] = None
+    min_rating_count: Optional[float] = None
+    min_review_count: Optional[float] = None
 
 class SearchRequest(BaseModel):
     query: str
     top_k: Optional[int] = 50
     rerank_m: Optional[int] = 10
     use_rerank: Optional[bool] = True
+    # knobs ANN por request (None -> valores de Settings)
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # dense | lexical | hybrid (None -> RETRIEVAL_MODE)
+    mode: Optional[RetrievalMode] = None
+    # filtro de metadatos aplicado dentro de la búsqueda (no sobre el top-k global)
+    filters: Optional[SearchFilters] = None
 
 class SearchResult(BaseModel):
     product_id: str
@@ -16,3 +35,31 @@ class SearchResult(BaseModel):
 class SearchResponse(BaseModel):
     query: str
     results: List[SearchResult]
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = 50
+    rerank_m: Optional[int] = 10
+    use_rerank: Optional[bool] = True
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # dense | lexical | hybrid (None -> RETRIEVAL_MODE)
+    mode: Optional[RetrievalMode] = None
+    # mismo filtro para todas las queries
+    filters: Optional[SearchFilters] = None
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResponse]
+
+class CatalogProduct(BaseModel):
+    # mismas columnas que product.csv; las extra (product_class, "category hierarchy", ratings...) se guardan
+    model_config = ConfigDict(extra="allow")
+    product_id: Union[str, int]
+    product_name: str = ""
+    product_description: str = ""
+
+class CatalogUpsertRequest(BaseModel):
+    products: List[CatalogProduct]
+
+class CatalogDeleteRequest(BaseModel):
+    product_ids: List[Union[str, int]]
@@ -0,0 +1,101 @@
+# app/utils/batching.py
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """La cola del batcher está llena: el caller debe rechazar la request (503)."""
+
+
+class MicroBatcher:
+    """
+    Micro-batching dinámico sobre asyncio:
+      - las requests concurrentes hacen `await submit(item)` y esperan su resultado en un future
+      - un loop colector agrupa items hasta max_batch_size (medido con weight_fn) o hasta que pasan
+        max_wait_ms desde el primer item, y ejecuta fn(items) -> results en un thread dedicado
+      - si hay más de max_queue items esperando, submit lanza QueueFullError en vez de encolar
+    fn recibe la lista de items y debe devolver una lista de resultados del mismo tamaño y orden.
+    """
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 64, max_wait_ms: float = 5.0,
+                 max_queue: int = 1024, weight_fn: Optional[Callable[[Any], int]] = None, name: str = "batcher"):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self.weight_fn = weight_fn or (lambda item: 1)
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, item: Any) -> Any:
+        if self._queue is None:
+            raise RuntimeError(f"{self.name} not started")
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFullError(f"{self.name} queue is full ({self.max_queue})")
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, fut))
+        return await fut
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        first = await self._queue.get()
+        batch = [first]
+        weight = self.weight_fn(first[0])
+        deadline = loop.time() + self.max_wait_s
+        while weight < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                entry = self._queue.get_nowait()
+            batch.append(entry)
+            weight += self.weight_fn(entry[0])
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # requests canceladas (cliente desconectado) no se procesan
+            live = [(item, fut) for item, fut in batch if not fut.cancelled()]
+            if not live:
+                continue
+            try:
+                results = await loop.run_in_executor(self._executor, self.fn, [item for item, _ in live])
+            except Exception as e:
+                logger.exception("%s batch of %d failed: %s", self.name, len(live), e)
+                for _, fut in live:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(live, results):
+                if not fut.done():
+                    fut.set_result(result)
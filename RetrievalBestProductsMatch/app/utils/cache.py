@@ -0,0 +1,258 @@
+# app/utils/cache.py
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza una query para usarla como clave de cache (minúsculas, espacios colapsados)."""
+    return " ".join(str(query).lower().split())
+
+
+class LRUCache:
+    """
+    Cache LRU thread-safe con tamaño acotado y TTL opcional (ttl_s <= 0 -> sin expiración).
+    Lleva contadores de hits/misses/evictions para exponerlos en /cache/stats.
+    """
+    def __init__(self, maxsize: int = 1024, ttl_s: float = 0.0):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class QueryCache:
+    """
+    Cache de dos niveles para la búsqueda:
+      - embeddings: query normalizada -> vector de la query (LRU)
+      - results: (query normalizada, top_k, rerank_m, use_rerank, options) -> lista final de resultados (LRU + TTL)
+        donde options son los knobs de búsqueda extra (nprobe, ef_search, ...) como tupla ordenada
+    """
+    def __init__(self, embedding_size: int = 10000, result_size: int = 5000, result_ttl_s: float = 3600.0):
+        self.embeddings = LRUCache(maxsize=embedding_size)
+        self.results = LRUCache(maxsize=result_size, ttl_s=result_ttl_s)
+
+    @staticmethod
+    def result_key(query: str, top_k: int, rerank_m: int, use_rerank: bool, options: tuple = ()) -> tuple:
+        return (normalize_query(query), top_k, rerank_m, bool(use_rerank), options)
+
+    def get_results(self, query: str, top_k: int, rerank_m: int, use_rerank: bool, options: tuple = ()) -> Optional[list]:
+        return self.results.get(self.result_key(query, top_k, rerank_m, use_rerank, options))
+
+    def put_results(self, query: str, top_k: int, rerank_m: int, use_rerank: bool, results: list, options: tuple = ()):
+        self.results.put(self.result_key(query, top_k, rerank_m, use_rerank, options), results)
+
+    def clear(self):
+        self.embeddings.clear()
+        self.results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respuestas RAG normalizadas para paráfrasis:
+      - clave exacta: los product_id ordenados de los candidatos que se pasan al LLM (mismo contexto)
+      - dentro de cada clave, hit si el coseno entre la query y alguna query cacheada >= threshold
+        (los embeddings vienen L2-normalizados, así que coseno = producto escalar)
+    Los vectores de cada clave se guardan apilados en una matriz pequeña (un matmul por lookup).
+    Evicción LRU por número de entradas + TTL; save/load a .npz para sobrevivir reinicios
+    (las expiraciones son de reloj de pared para que sigan valiendo tras reiniciar).
+    """
+    def __init__(self, maxsize: int = 2000, ttl_s: float = 86400.0, threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        # entry_id -> (signature, vector, answer, expires_at)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # signature -> (entry_ids, matriz de vectores apilados)
+        self._buckets: Dict[tuple, tuple] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.near_misses = 0   # mismos candidatos pero query por debajo del umbral
+        self.evictions = 0
+
+    @staticmethod
+    def signature(product_ids: Sequence[Any]) -> tuple:
+        return tuple(str(pid) for pid in product_ids)
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def _remove(self, entry_id: int):
+        signature = self._entries.pop(entry_id)[0]
+        ids, _ = self._buckets[signature]
+        ids = [i for i in ids if i != entry_id]
+        if ids:
+            self._buckets[signature] = (ids, np.stack([self._entries[i][1] for i in ids]))
+        else:
+            del self._buckets[signature]
+
+    def get(self, product_ids: Sequence[Any], query_vec: np.ndarray) -> Optional[Dict[str, Any]]:
+        signature = self.signature(product_ids)
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(signature)
+            if bucket is None:
+                self.misses += 1
+                return None
+            for entry_id in [i for i in bucket[0] if self._expired(self._entries[i][3], now)]:
+                self._remove(entry_id)
+            bucket = self._buckets.get(signature)
+            if bucket is not None:
+                ids, matrix = bucket
+                sims = matrix @ np.asarray(query_vec, dtype=np.float32)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return dict(self._entries[ids[best]][2])
+                self.near_misses += 1
+            self.misses += 1
+            return None
+
+    def put(self, product_ids: Sequence[Any], query_vec: np.ndarray, answer: Dict[str, Any],
+            expires_at: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        signature = self.signature(product_ids)
+        vec = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+        if expires_at is None and self.ttl_s > 0:
+            expires_at = time.time() + self.ttl_s
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, vec, answer, expires_at)
+            ids, _ = self._buckets.get(signature, ([], None))
+            ids = ids + [entry_id]
+            self._buckets[signature] = (ids, np.stack([self._entries[i][1] for i in ids]))
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self, path: str):
+        """Persiste las entradas vigentes en un .npz (vectores + metadata JSON)."""
+        now = time.time()
+        with self._lock:
+            live = [e for e in self._entries.values() if not self._expired(e[3], now)]
+        vectors = np.stack([e[1] for e in live]) if live else np.zeros((0, 0), dtype=np.float32)
+        meta = [{"signature": list(e[0]), "answer": e[2], "expires_at": e[3]} for e in live]
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, vectors=vectors, meta=np.asarray(json.dumps(meta, default=str)))
+        os.replace(tmp, path)
+        logger.info("Answer cache saved: %d entries -> %s", len(live), path)
+
+    def load(self, path: str) -> int:
+        if not path or not os.path.exists(path):
+            return 0
+        data = np.load(path)
+        meta: List[Dict[str, Any]] = json.loads(str(data["meta"]))
+        now = time.time()
+        n = 0
+        for vec, m in zip(data["vectors"], meta):
+            if not self._expired(m["expires_at"], now):
+                self.put(m["signature"], vec, m["answer"], expires_at=m["expires_at"])
+                n += 1
+        logger.info("Answer cache loaded: %d entries from %s", n, path)
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "signatures": len(self._buckets),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "near_misses": self.near_misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def read_query_log(path: str, limit: int = 0) -> list:
+    """
+    Lee un log de queries (p.ej. WANDS query.csv, separado por tabs con columna 'query')
+    y devuelve las queries únicas (por forma normalizada) en orden de aparición.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path, sep='\t', usecols=['query'])
+    seen = set()
+    queries = []
+    for q in df['query'].dropna().astype(str):
+        key = normalize_query(q)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        queries.append(q)
+        if limit and len(queries) >= limit:
+            break
+    return queries
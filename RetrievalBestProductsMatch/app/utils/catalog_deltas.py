@@ -0,0 +1,96 @@
+# app/utils/catalog_deltas.py
+"""
+Log de cambios del catálogo en disco (CATALOG_DELTA_DIR), compartido por todos los procesos:
+  - un fichero JSONL por lote: {"op": "upsert", "product": {...}} | {"op": "delete", "product_id": "..."}
+  - nombre '<time_ns 20 dígitos>-<pid>-<seq>.jsonl': el orden lexicográfico es el orden de aplicación
+  - se escribe en un temporal oculto y se renombra: un lector nunca ve un lote a medias
+Cada worker aplica los ficheros con nombre mayor que el último que aplicó (su watermark); la
+compactación que persiste el índice guarda el watermark en el manifest para no re-aplicarlos al arrancar.
+"""
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+DELTA_SUFFIX = ".jsonl"
+OPS = ("upsert", "delete")
+
+_seq = itertools.count()
+
+
+def validate_ops(ops: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normaliza las operaciones (product_id como str); ValueError si alguna no es válida."""
+    valid = []
+    for op in ops:
+        kind = op.get("op")
+        if kind == "upsert":
+            product = dict(op.get("product") or {})
+            if product.get("product_id") in (None, ""):
+                raise ValueError("upsert needs a product with a product_id")
+            product["product_id"] = str(product["product_id"])
+            valid.append({"op": kind, "product": product})
+        elif kind == "delete":
+            if op.get("product_id") in (None, ""):
+                raise ValueError("delete needs a product_id")
+            valid.append({"op": kind, "product_id": str(op["product_id"])})
+        else:
+            raise ValueError(f"unknown catalog op {kind!r}; expected one of {OPS}")
+    return valid
+
+
+def write_delta_file(directory: str, ops: List[Dict[str, Any]]) -> str:
+    """Escribe un lote de operaciones como un nuevo fichero del log; devuelve su nombre."""
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.time_ns():020d}-{os.getpid()}-{next(_seq):06d}{DELTA_SUFFIX}"
+    tmp = os.path.join(directory, f".{name}.tmp")
+    with open(tmp, "w") as f:
+        for op in ops:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+    os.replace(tmp, os.path.join(directory, name))
+    return name
+
+
+def list_delta_files(directory: str, after: str = "") -> List[str]:
+    """Nombres (ordenados) de los ficheros del log posteriores a after."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(n for n in os.listdir(directory)
+                  if n.endswith(DELTA_SUFFIX) and not n.startswith(".") and n > after)
+
+
+def read_delta_file(directory: str, name: str) -> List[Dict[str, Any]]:
+    ops = []
+    with open(os.path.join(directory, name)) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                ops.extend(validate_ops([json.loads(line)]))
+            except ValueError as e:
+                # una línea corrupta no debe bloquear el resto del log
+                logger.warning("Skipping invalid catalog op %s:%d: %s", name, lineno, e)
+    return ops
+
+
+def prune_delta_files(directory: str, upto: str, min_age_s: float) -> int:
+    """
+    Borra los ficheros <= upto con más de min_age_s de antigüedad (los demás workers ya los han leído);
+    los más recientes se borran en la siguiente compactación.
+    """
+    removed = 0
+    cutoff = time.time() - min_age_s
+    for name in list_delta_files(directory):
+        if name > upto:
+            break
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
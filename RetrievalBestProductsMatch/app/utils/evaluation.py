@@ -0,0 +1,173 @@
+# app/utils/evaluation.py
+"""
+Métricas de ranking vectorizadas con NumPy (mismas definiciones que el notebook de evaluación):
+todas operan sobre matrices (n_queries x k) de relevancia alineadas con el ranking predicho, de modo
+que evaluar las ~480 queries de WANDS es un puñado de operaciones matriciales en vez de bucles Python.
+
+  - binary: 1.0 si el producto en esa posición es 'Exact', 0.0 si no
+  - gains:  peso graduado (Exact=exact_w, Partial=partial_w, resto 0)
+"""
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EXACT, PARTIAL = "Exact", "Partial"
+
+
+class Qrels:
+    """
+    Juicios de relevancia (label.csv de WANDS: query_id, product_id, label) indexados por
+    (query_id, product_id) para construir las matrices de relevancia con un único reindex.
+    Si un par aparece como Exact y Partial, gana Exact (como en el notebook).
+    """
+    def __init__(self, labels: pd.DataFrame, exact_w: float = 1.0, partial_w: float = 0.5):
+        self.exact_w = exact_w
+        self.partial_w = partial_w
+        df = labels[labels["label"].isin([EXACT, PARTIAL])].copy()
+        df["query_id"] = df["query_id"].astype(str)
+        df["product_id"] = df["product_id"].astype(str)
+        df["exact"] = (df["label"] == EXACT).astype(np.float64)
+        df["gain"] = np.where(df["exact"] > 0, exact_w, partial_w)
+        df = df.groupby(["query_id", "product_id"], sort=False)[["exact", "gain"]].max()
+        self._pairs = df
+        per_query = df.groupby(level="query_id")
+        self._n_exact = per_query["exact"].sum()
+        self._total_gain = per_query["gain"].sum()
+
+    @classmethod
+    def from_csv(cls, path: str, exact_w: float = 1.0, partial_w: float = 0.5) -> "Qrels":
+        labels = pd.read_csv(path, sep='\t', usecols=["query_id", "product_id", "label"])
+        return cls(labels, exact_w=exact_w, partial_w=partial_w)
+
+    def matrices(self, query_ids: Sequence, predicted_ids: Sequence[Sequence[str]], k: int) -> Dict[str, np.ndarray]:
+        """
+        predicted_ids: ranking de product_ids por query (se rellena con '' hasta k).
+        Devuelve binary / gains (n x k) y los totales por query n_exact / total_gain.
+        """
+        qids = [str(q) for q in query_ids]
+        n = len(qids)
+        padded = np.full((n, k), "", dtype=object)
+        for row, ids in enumerate(predicted_ids):
+            ids = [str(p) for p in ids[:k]]
+            padded[row, :len(ids)] = ids
+        keys = pd.MultiIndex.from_arrays([np.repeat(qids, k), padded.ravel()])
+        looked_up = self._pairs.reindex(keys).fillna(0.0)
+        return {
+            "binary": looked_up["exact"].to_numpy().reshape(n, k),
+            "gains": looked_up["gain"].to_numpy().reshape(n, k),
+            "n_exact": self._n_exact.reindex(qids).fillna(0.0).to_numpy(),
+            "total_gain": self._total_gain.reindex(qids).fillna(0.0).to_numpy(),
+        }
+
+
+def _ranks(k: int) -> np.ndarray:
+    return np.arange(1, k + 1, dtype=np.float64)
+
+
+def precision_at_k(binary: np.ndarray, k: int = 10) -> np.ndarray:
+    return binary[:, :k].sum(axis=1) / k
+
+
+def recall_at_k(binary: np.ndarray, n_relevant: np.ndarray, k: int = 10) -> np.ndarray:
+    return binary[:, :k].sum(axis=1) / np.maximum(1.0, n_relevant)
+
+
+def map_at_k(binary: np.ndarray, n_relevant: np.ndarray, k: int = 10) -> np.ndarray:
+    """AP@k por query (MAP@k = media): sum(hits_i / i en los aciertos) / min(n_relevant, k)."""
+    b = binary[:, :k]
+    hits = np.cumsum(b, axis=1)
+    score = (b * hits / _ranks(b.shape[1])).sum(axis=1)
+    denom = np.minimum(n_relevant, k)
+    return np.divide(score, denom, out=np.zeros_like(score), where=denom > 0)
+
+
+def weighted_map_at_k(gains: np.ndarray, total_gain: np.ndarray, k: int = 10) -> np.ndarray:
+    """AP graduada: ganancia acumulada / i en las posiciones relevantes, sobre min(ganancia total, k)."""
+    g = gains[:, :k]
+    cum = np.cumsum(g, axis=1)
+    score = np.where(g > 0, cum / _ranks(g.shape[1]), 0.0).sum(axis=1)
+    denom = np.minimum(total_gain, k)
+    return np.divide(score, denom, out=np.zeros_like(score), where=denom > 0)
+
+
+def ndcg_at_k(gains: np.ndarray, k: int = 10) -> np.ndarray:
+    """
+    NDCG@k con ganancia 2^rel - 1. Como en el notebook, el ranking ideal se obtiene ordenando la
+    relevancia de la propia lista predicha (mide la calidad del orden, no la cobertura del recall).
+    """
+    g = gains[:, :k]
+    discounts = 1.0 / np.log2(np.arange(2, g.shape[1] + 2, dtype=np.float64))
+    dcg = ((np.power(2.0, g) - 1.0) * discounts).sum(axis=1)
+    ideal = -np.sort(-gains, axis=1)[:, :k]
+    idcg = ((np.power(2.0, ideal) - 1.0) * discounts[:ideal.shape[1]]).sum(axis=1)
+    return np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+
+
+def ranking_metrics(m: Dict[str, np.ndarray], k: int = 10) -> Dict[str, np.ndarray]:
+    """Métricas por query (arrays de longitud n) a partir de Qrels.matrices."""
+    return {
+        f"map@{k}": map_at_k(m["binary"], m["n_exact"], k),
+        f"weighted_map@{k}": weighted_map_at_k(m["gains"], m["total_gain"], k),
+        f"ndcg@{k}": ndcg_at_k(m["gains"], k),
+        f"precision@{k}": precision_at_k(m["binary"], k),
+        f"recall@{k}": recall_at_k(m["binary"], m["n_exact"], k),
+    }
+
+
+def bootstrap_paired_diff(a: Sequence[float], b: Sequence[float], n_boot: int = 2000, seed: int = 42,
+                          chunk: int = 256) -> Dict[str, float]:
+    """
+    Bootstrap pareado de mean(a) - mean(b) sobre las mismas queries: remuestrea índices (n_boot x n)
+    en bloques de `chunk` réplicas para acotar memoria. Devuelve la diferencia media, el IC 95% y un
+    p-valor bilateral aproximado (fracción de réplicas al otro lado del cero).
+    """
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    n = len(diff)
+    if n == 0:
+        return {"mean_diff": 0.0, "ci95_low": 0.0, "ci95_high": 0.0, "p_value": 1.0, "n": 0}
+    rng = np.random.default_rng(seed)
+    means = np.empty(n_boot)
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        means[start:start + size] = diff[rng.integers(0, n, size=(size, n))].mean(axis=1)
+    means.sort()
+    p_value = 2.0 * min((means <= 0).mean(), (means >= 0).mean())
+    return {
+        "mean_diff": float(means.mean()),
+        "ci95_low": float(means[int(0.025 * n_boot)]),
+        "ci95_high": float(means[min(int(0.975 * n_boot), n_boot - 1)]),
+        "p_value": float(min(1.0, p_value)),
+        "n": n,
+    }
+
+
+def latency_summary(samples_s: Sequence[float], items: Optional[int] = None) -> Dict[str, float]:
+    """p50/p95/p99/mean/max en ms de una lista de duraciones (s); con items, throughput = items / total."""
+    arr = np.asarray(samples_s, dtype=np.float64)
+    if arr.size == 0:
+        return {"calls": 0}
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99]) * 1000.0
+    out = {
+        "calls": int(arr.size),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(arr.mean() * 1000.0),
+        "max_ms": float(arr.max() * 1000.0),
+        "total_s": float(arr.sum()),
+    }
+    if items is not None and arr.sum() > 0:
+        out["throughput_qps"] = float(items / arr.sum())
+    return out
+
+
+def summarize(per_query: Dict[str, np.ndarray]) -> Dict[str, float]:
+    return {name: float(np.mean(values)) if len(values) else 0.0 for name, values in per_query.items()}
+
+
+def to_lists(per_query: Dict[str, np.ndarray]) -> Dict[str, List[float]]:
+    return {name: np.round(values, 6).tolist() for name, values in per_query.items()}
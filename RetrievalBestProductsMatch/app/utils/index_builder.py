@@ -0,0 +1,186 @@
+# app/utils/index_builder.py
+"""
+Construcción offline del índice (sustituye las celdas del notebook):
+  1. stream de product.csv en chunks -> ProductStore (sin cargar el CSV entero)
+  2. encode de cada chunk en un pool de procesos CPU, checkpoint en un .npy memory-mapped
+     (un build caído se reanuda saltando los chunks ya codificados)
+  3. índice FAISS (index_factory) + índice léxico BM25 opcional + manifest (modelo, dimensión, filas)
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from app.models.product_store import ProductStore, ProductStoreWriter
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+_worker_model = None
+_worker_batch_size = 64
+
+
+def write_json_atomic(path: str, payload: Dict[str, Any]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def model_basename(model_name: str) -> str:
+    """'sentence-transformers/all-MiniLM-L6-v2' y 'all-MiniLM-L6-v2' son el mismo modelo."""
+    return str(model_name).rstrip("/").split("/")[-1]
+
+
+def _iter_chunks(product_csv: str, chunk_size: int) -> Iterator[Tuple[int, pd.DataFrame]]:
+    reader = pd.read_csv(product_csv, sep='\t', dtype={'product_id': object}, chunksize=chunk_size)
+    for chunk_id, chunk in enumerate(reader):
+        yield chunk_id, chunk
+
+
+def embedding_texts(df: pd.DataFrame) -> list:
+    # mismo texto que el notebook: product_name + ' ' + product_description
+    return (df['product_name'].fillna('') + ' ' + df['product_description'].fillna('')).astype(str).tolist()
+
+
+def _init_worker(model_name: str, batch_size: int, threads: int):
+    global _worker_model, _worker_batch_size
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+    _worker_batch_size = batch_size
+
+
+def _encode_chunk(chunk_id: int, start: int, texts: list) -> Tuple[int, int, np.ndarray]:
+    emb = _worker_model.encode(texts, batch_size=_worker_batch_size, convert_to_tensor=False, show_progress_bar=False)
+    emb = np.asarray(emb, dtype='float32')
+    # L2 normalizado -> inner product == coseno (como faiss.normalize_L2 en el notebook)
+    emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+    return chunk_id, start, emb
+
+
+def build_index_offline(product_csv: str, index_path: str, store_dir: str, embeddings_path: str,
+                        manifest_path: str, model_name: str, index_params: Dict[str, Any],
+                        chunk_size: int = 10000, batch_size: int = 64, workers: int = 0,
+                        threads_per_worker: int = 0, resume: bool = True, lexical_path: str = "",
+                        bm25_k1: float = 1.2, bm25_b: float = 0.75) -> Dict[str, Any]:
+    """
+    Construye ProductStore + embeddings + índice FAISS + manifest a partir de product.csv.
+    workers=0 codifica en el proceso actual; lexical_path vacío omite el índice BM25.
+    """
+    import faiss
+    from app.models.index_factory import build_index
+
+    # 1) product store en streaming (barato; se rehace siempre para que quede alineado con el CSV).
+    # Se escribe en un directorio temporal que sólo sustituye a store_dir al completarse.
+    logger.info("Writing product store to %s", store_dir)
+    writer = ProductStoreWriter(store_dir)
+    starts = []
+    try:
+        for _, chunk in _iter_chunks(product_csv, chunk_size):
+            starts.append(writer.num_rows)
+            writer.append(chunk)
+        if writer.num_rows == 0:
+            raise ValueError(f"No products found in {product_csv}")
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    num_rows = writer.num_rows
+    num_chunks = len(starts)
+    logger.info("%d products in %d chunks", num_rows, num_chunks)
+
+    # 2) embeddings con checkpoint
+    state_path = f"{embeddings_path}.state.json"
+    state = read_manifest(state_path) if resume else None
+    expected = {"model_name": model_name, "num_rows": num_rows, "chunk_size": chunk_size}
+    if state and any(state.get(k) != v for k, v in expected.items()):
+        logger.warning("Checkpoint %s does not match this build; starting from scratch.", state_path)
+        state = None
+    if state is None or not os.path.exists(embeddings_path):
+        state = {**expected, "dim": None, "done": []}
+    done = set(state["done"])
+    emb = None
+    if state["dim"]:
+        emb = np.lib.format.open_memmap(embeddings_path, mode="r+")
+        logger.info("Resuming build: %d/%d chunks already encoded", len(done), num_chunks)
+
+    def _store(chunk_id: int, start: int, vectors: np.ndarray):
+        nonlocal emb
+        if emb is None:
+            state["dim"] = int(vectors.shape[1])
+            emb = np.lib.format.open_memmap(embeddings_path, mode="w+", dtype=np.float32,
+                                            shape=(num_rows, state["dim"]))
+        emb[start:start + len(vectors)] = vectors
+        emb.flush()
+        done.add(chunk_id)
+        state["done"] = sorted(done)
+        write_json_atomic(state_path, state)
+
+    t0 = time.perf_counter()
+    pending_chunks = ((cid, starts[cid], embedding_texts(chunk))
+                      for cid, chunk in _iter_chunks(product_csv, chunk_size) if cid not in done)
+    if workers and workers > 0:
+        ctx = mp.get_context("spawn")  # torch no es fork-safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(model_name, batch_size, threads_per_worker)) as pool:
+            in_flight = set()
+            for cid, start, texts in pending_chunks:
+                # acotamos los chunks en vuelo para no acumular el CSV entero en memoria
+                if len(in_flight) >= workers * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        _store(*fut.result())
+                in_flight.add(pool.submit(_encode_chunk, cid, start, texts))
+            for fut in wait(in_flight).done:
+                _store(*fut.result())
+    else:
+        _init_worker(model_name, batch_size, threads_per_worker)
+        for cid, start, texts in pending_chunks:
+            _store(*_encode_chunk(cid, start, texts))
+            logger.info("Encoded chunk %d/%d", len(done), num_chunks)
+    logger.info("Embeddings ready in %.1fs -> %s", time.perf_counter() - t0, embeddings_path)
+
+    # 3) índice + manifest
+    vectors = np.load(embeddings_path, mmap_mode="r")
+    index = build_index(vectors, **index_params)
+    faiss.write_index(index, index_path)
+    if lexical_path:
+        from app.models.lexical import LexicalIndex
+        lexical = LexicalIndex.build_from_store(ProductStore.load(store_dir), k1=bm25_k1, b=bm25_b)
+        lexical.save(lexical_path)
+        logger.info("Lexical index written to %s", lexical_path)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "model_name": model_name,
+        "dim": int(vectors.shape[1]),
+        "num_rows": int(num_rows),
+        "normalized": True,
+        "index_type": index_params.get("index_type", "flat"),
+        "index_path": index_path,
+        "product_store_dir": store_dir,
+        "embeddings_path": embeddings_path,
+        "lexical_index_path": lexical_path or None,
+        "product_csv": product_csv,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    write_json_atomic(manifest_path, manifest)
+    os.remove(state_path)
+    logger.info("Index written to %s; manifest %s", index_path, manifest_path)
+    return manifest
@@ -36,11 +36,13 @@ def load_gpt4all_instance_with_download_support(model_identifier: str, allow_dow
         logger.exception("Instanciación GPT4All fallida para %s: %s", model_identifier, e)
         raise
 
-def load_local_gpt4all_adapter(model_identifier: str, allow_download: bool = True) -> Optional[GPT4AllClient]:
+def load_local_gpt4all_adapter(model_identifier: str, allow_download: bool = True,
+                               structured: bool = True) -> Optional[GPT4AllClient]:
     """
     Devuelve un GPT4AllClient (adaptador) o None si no se consiguió instanciar.
     - model_identifier: nombre del modelo reconocible por gpt4all (o ruta .gguf).
     - allow_download: si True, permite que el SDK descargue el modelo.
+    - structured: modo de generación estructurada del adaptador (ver GPT4AllClient).
     """
     if not model_identifier or str(model_identifier).lower() == "none":
         logger.info("LLM model identifier empty or 'none' -> skipping load.")
@@ -48,7 +50,7 @@ def load_local_gpt4all_adapter(model_identifier: str, allow_download: bool = Tru
 
     try:
         gpt_inst = load_gpt4all_instance_with_download_support(model_identifier, allow_download=allow_download)
-        client = GPT4AllClient(gpt_inst)
+        client = GPT4AllClient(gpt_inst, structured=structured)
         logger.info("gpt4all adapter initialized for model: %s", model_identifier)
         return client
     except Exception as e:
@@ -0,0 +1,237 @@
+# app/utils/loadtest.py
+"""
+Harness de carga para /search, /rag y /rag/stream:
+  - target: la app en proceso (httpx.ASGITransport + lifespan), un uvicorn lanzado por el harness
+    o un servidor ya levantado (base_url)
+  - modo cerrado (concurrency workers, cada uno envía la siguiente request al recibir la anterior)
+    o abierto (llegadas Poisson a rate req/s, independientes de lo que tarde el servidor)
+  - mezcla de endpoints y queries determinística (seed) a partir de un log de queries
+En modo abierto la latencia se mide desde la llegada programada, no desde el envío, para no
+esconder la espera cuando el harness se retrasa (coordinated omission). Si hay más de max_inflight
+requests en vuelo, la llegada se cuenta como 'dropped' en vez de frenar el ritmo.
+Requiere httpx (no es dependencia del servicio).
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.utils.evaluation import latency_summary
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = {"search": "/search", "rag": "/rag", "rag_stream": "/rag/stream"}
+READY_LLM_STATES = ("ready", "failed", "disabled")
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError as e:
+        raise RuntimeError("the load test harness needs httpx (pip install httpx)") from e
+    return httpx
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'search=0.8,rag=0.2' -> {'search': 0.8, 'rag': 0.2} (pesos normalizados)."""
+    mix: Dict[str, float] = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint {name!r}; expected one of {sorted(ENDPOINTS)}")
+        mix[name] = float(weight or 1.0)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("mix weights must add up to a positive number")
+    return {name: w / total for name, w in mix.items()}
+
+
+def workload(queries: Sequence[str], mix: Dict[str, float], n: int = 0, seed: int = 42,
+             **payload) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """(endpoint, body) pseudoaleatorios y reproducibles; n=0 -> infinito (se corta por duración)."""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    i = 0
+    while not n or i < n:
+        yield rng.choices(names, weights)[0], {"query": rng.choice(queries), **payload}
+        i += 1
+
+
+def _is_fallback(answer: Dict[str, Any]) -> bool:
+    reasons = answer.get("reasons") or []
+    return bool(reasons) and str(reasons[0]).startswith("fallback")
+
+
+async def _send(client, endpoint: str, body: Dict[str, Any], timeout_s: float,
+                scheduled: Optional[float] = None) -> Dict[str, Any]:
+    httpx = _httpx()
+    start = scheduled if scheduled is not None else time.perf_counter()
+    record: Dict[str, Any] = {"endpoint": endpoint, "start": start, "fallback": False, "first_token_s": None}
+    try:
+        if endpoint == "rag_stream":
+            async with client.stream("POST", ENDPOINTS[endpoint], json=body, timeout=timeout_s) as r:
+                record["status"] = r.status_code
+                event = None
+                async for line in r.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                        if event == "token" and record["first_token_s"] is None:
+                            record["first_token_s"] = time.perf_counter() - start
+                    elif line.startswith("data: ") and event == "answer":
+                        record["fallback"] = _is_fallback(json.loads(line[6:]))
+        else:
+            r = await client.post(ENDPOINTS[endpoint], json=body, timeout=timeout_s)
+            record["status"] = r.status_code
+            if endpoint == "rag" and r.status_code == 200:
+                record["fallback"] = _is_fallback(r.json())
+    except httpx.TimeoutException:
+        record["status"] = "timeout"
+    except Exception as e:
+        record["status"] = f"error:{type(e).__name__}"
+    record["latency_s"] = time.perf_counter() - start
+    return record
+
+
+async def run_closed_loop(client, requests: Iterator[Tuple[str, Dict[str, Any]]], concurrency: int,
+                          duration_s: float = 0.0, timeout_s: float = 120.0) -> List[Dict[str, Any]]:
+    """concurrency workers en bucle hasta agotar requests o duration_s (0 = sin límite de tiempo)."""
+    records: List[Dict[str, Any]] = []
+    deadline = time.perf_counter() + duration_s if duration_s > 0 else float("inf")
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            item = next(requests, None)
+            if item is None:
+                return
+            records.append(await _send(client, *item, timeout_s=timeout_s))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return records
+
+
+async def run_open_loop(client, requests: Iterator[Tuple[str, Dict[str, Any]]], rate: float,
+                        duration_s: float = 0.0, timeout_s: float = 120.0, max_inflight: int = 1000,
+                        seed: int = 42) -> List[Dict[str, Any]]:
+    """Llegadas Poisson a `rate` req/s hasta agotar requests o duration_s."""
+    rng = random.Random(seed)
+    records: List[Dict[str, Any]] = []
+    inflight: set = set()
+    deadline = time.perf_counter() + duration_s if duration_s > 0 else float("inf")
+    arrival = time.perf_counter()
+
+    async def send(item, scheduled):
+        records.append(await _send(client, *item, timeout_s=timeout_s, scheduled=scheduled))
+
+    while True:
+        arrival += rng.expovariate(rate)
+        if arrival >= deadline:
+            break
+        item = next(requests, None)
+        if item is None:
+            break
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(inflight) >= max_inflight:
+            records.append({"endpoint": item[0], "start": arrival, "status": "dropped", "latency_s": 0.0,
+                            "fallback": False, "first_token_s": None})
+            continue
+        task = asyncio.create_task(send(item, arrival))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    if inflight:
+        await asyncio.gather(*inflight)
+    return records
+
+
+def summarize(records: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    """Por endpoint y total: throughput (respuestas 200/s), latencias de las 200, errores por status."""
+    groups: Dict[str, List[Dict[str, Any]]] = {"all": records}
+    for r in records:
+        groups.setdefault(r["endpoint"], []).append(r)
+    report: Dict[str, Any] = {}
+    for name, group in groups.items():
+        ok = [r for r in group if r["status"] == 200]
+        out: Dict[str, Any] = {
+            "requests": len(group),
+            "ok": len(ok),
+            "error_rate": 1.0 - len(ok) / len(group) if group else 0.0,
+            "status": {str(k): v for k, v in sorted(Counter(str(r["status"]) for r in group).items())},
+            "throughput_rps": len(ok) / wall_s if wall_s > 0 else 0.0,
+            "latency": latency_summary([r["latency_s"] for r in ok]),
+        }
+        if name in ("rag", "rag_stream", "all") and any(r["endpoint"] != "search" for r in group):
+            llm_ok = [r for r in ok if r["endpoint"] != "search"]
+            out["fallback_rate"] = sum(r["fallback"] for r in llm_ok) / len(llm_ok) if llm_ok else 0.0
+        first_tokens = [r["first_token_s"] for r in ok if r["first_token_s"] is not None]
+        if first_tokens:
+            out["first_token"] = latency_summary(first_tokens)
+        report[name] = out
+    return report
+
+
+async def wait_ready(client, need_llm: bool = False, timeout_s: float = 600.0, poll_s: float = 0.5,
+                     alive: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+    """
+    Espera a /ready == 200 (y al LLM si la mezcla incluye /rag) y devuelve el último snapshot.
+    alive: comprobación del proceso servidor (p.ej. el uvicorn lanzado) para no esperar a un muerto.
+    """
+    httpx = _httpx()
+    deadline = time.monotonic() + timeout_s
+    while True:
+        if alive is not None and not alive():
+            raise RuntimeError("server process exited before becoming ready")
+        try:
+            r = await client.get("/ready", timeout=10.0)
+            state = r.json()
+            llm = state.get("components", {}).get("llm", {}).get("status")
+            if r.status_code == 200 and (not need_llm or llm in READY_LLM_STATES):
+                return state
+        except (httpx.TransportError, ValueError):
+            pass  # el servidor aún no acepta conexiones
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"service not ready after {timeout_s:.0f}s")
+        await asyncio.sleep(poll_s)
+
+
+@asynccontextmanager
+async def inprocess_client(app) -> AsyncIterator[Any]:
+    """La app FastAPI en este proceso (startup/shutdown incluidos). Cliente y servidor comparten event loop."""
+    httpx = _httpx()
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest") as client:
+            yield client
+
+
+@asynccontextmanager
+async def http_client(base_url: str, max_connections: int = 1000) -> AsyncIterator[Any]:
+    httpx = _httpx()
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        yield client
+
+
+@contextmanager
+def uvicorn_server(host: str = "127.0.0.1", port: int = 8765, workers: int = 1,
+                   env: Optional[Dict[str, str]] = None,
+                   cwd: Optional[str] = None) -> Iterator[Tuple[str, subprocess.Popen]]:
+    """Lanza `uvicorn main:app` en un subproceso y lo para al salir; devuelve (base_url, proceso)."""
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    logger.info("Starting %s", " ".join(cmd))
+    proc = subprocess.Popen(cmd, env={**os.environ, **(env or {})}, cwd=cwd)
+    try:
+        yield f"http://{host}:{port}", proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
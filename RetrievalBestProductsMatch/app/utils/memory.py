@@ -0,0 +1,69 @@
+# app/utils/memory.py
+"""
+Uso de memoria por proceso a partir de /proc/<pid>/smaps_rollup (Linux):
+  - rss: páginas residentes (cuenta entera cada página compartida: sumar RSS de N workers sobreestima)
+  - pss: RSS con cada página compartida dividida entre los procesos que la mapean (la suma es el total real)
+  - uss: páginas privadas del proceso (lo que se liberaría al matarlo)
+  - shared: páginas compartidas (mmap del índice / product store, pesos heredados por fork)
+Fuera de Linux sólo se informa el pico de RSS del propio proceso (resource.getrusage).
+"""
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, float]:
+    """Memoria (MB) de pid (None = este proceso)."""
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    try:
+        with open(path) as f:
+            kb = {}
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in _FIELDS:
+                    kb[key] = int(rest.split()[0])
+    except OSError:
+        if pid not in (None, os.getpid()):
+            raise
+        import resource
+        return {"max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+    mb = {key: round(value / 1024.0, 1) for key, value in kb.items()}
+    return {
+        "rss_mb": mb.get("Rss", 0.0),
+        "pss_mb": mb.get("Pss", 0.0),
+        "uss_mb": round(mb.get("Private_Clean", 0.0) + mb.get("Private_Dirty", 0.0), 1),
+        "shared_mb": round(mb.get("Shared_Clean", 0.0) + mb.get("Shared_Dirty", 0.0), 1),
+        "swap_mb": mb.get("Swap", 0.0),
+    }
+
+
+def child_pids(pid: int) -> List[int]:
+    children: List[int] = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def group_memory(root_pid: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Memoria del proceso raíz (p.ej. el padre prefork) y sus hijos directos (los workers), con totales.
+    total.pss_mb es la memoria real del grupo; total.rss_mb la que se gastaría sin compartir nada.
+    """
+    root = root_pid or os.getpid()
+    processes = []
+    for role, pid in [("parent", root)] + [("worker", c) for c in child_pids(root)]:
+        try:
+            processes.append({"pid": pid, "role": role, **process_memory(pid)})
+        except OSError:
+            continue  # el proceso terminó mientras se leía
+    keys = ("rss_mb", "pss_mb", "uss_mb", "shared_mb")
+    total = {key: round(sum(p.get(key, 0.0) for p in processes), 1) for key in keys}
+    return {"processes": processes, "total": total}
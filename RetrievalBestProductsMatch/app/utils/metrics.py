@@ -0,0 +1,246 @@
+# app/utils/metrics.py
+"""
+Instrumentación ligera (sin dependencias) con salida en formato de texto Prometheus:
+  - histogramas de latencia por etapa (encode, faiss_search, candidate_texts, rerank_predict,
+    build_context, llm_generate, ...) y de tamaño de batch
+  - contadores (tokens generados por el LLM, fallbacks de parseo JSON, requests)
+  - gauges calculados al hacer scrape mediante collectors (hit rate de caches, colas, pool LLM)
+  - desglose de tiempos y contadores por request (contextvar) para la cabecera Server-Timing
+Uso: `with metrics.timer("encode"): ...`, `metrics.inc("llm_tokens_total", n)`,
+`metrics.count("rerank_pairs", n)` (sólo desglose de la request).
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# desglose de la request actual: etapa -> segundos acumulados (None fuera de una request)
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None)
+# contadores de la request actual (p.ej. pares puntuados por el cross-encoder)
+_request_counts: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_counts", default=None)
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "retrieval"):
+        self.prefix = prefix
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, object], float]]]] = []
+
+    # ------------------------------------------------------------------ recording
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, buckets: Iterable[float] = LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe_batch(self, stage: str, size: int):
+        self.observe("batch_size", size, buckets=SIZE_BUCKETS, stage=stage)
+
+    def register_collector(self, fn: Callable[[], Iterable[Tuple[str, Dict[str, object], float]]]):
+        """fn() -> [(nombre, labels, valor), ...] se evalúa en cada scrape y se expone como gauge."""
+        self._collectors.append(fn)
+
+    @contextmanager
+    def timer(self, stage: str, histogram: bool = True) -> Iterator[None]:
+        """
+        Mide la etapa: la observa en stage_seconds{stage=...} y la suma al desglose de la request actual.
+        histogram=False sólo la suma al desglose (p.ej. esperas de una request por un batch compartido,
+        cuyo histograma ya registra el thread que ejecuta el batch).
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            if histogram:
+                self.observe("stage_seconds", elapsed, stage=stage)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    @staticmethod
+    def count(name: str, value: float = 1):
+        """Suma value al contador name de la request actual (no se exporta a Prometheus)."""
+        counts = _request_counts.get()
+        if counts is not None:
+            counts[name] = counts.get(name, 0) + value
+
+    # ------------------------------------------------------------------ per-request breakdown
+    @staticmethod
+    def start_request() -> Tuple[Dict[str, float], tuple]:
+        timings: Dict[str, float] = {}
+        return timings, (_request_timings.set(timings), _request_counts.set({}))
+
+    @staticmethod
+    def end_request(token: tuple):
+        timings_token, counts_token = token
+        _request_counts.reset(counts_token)
+        _request_timings.reset(timings_token)
+
+    @staticmethod
+    def request_counts() -> Optional[Dict[str, float]]:
+        """Contadores de la request actual (metrics.count); None fuera de una request."""
+        return _request_counts.get()
+
+    @staticmethod
+    def server_timing(timings: Dict[str, float], total: Optional[float] = None,
+                      counts: Optional[Dict[str, float]] = None) -> str:
+        """Cabecera Server-Timing (ms) a partir del desglose de la request; los contadores van en desc."""
+        parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+        parts.extend(f'{name};desc="{value:g}"' for name, value in (counts or {}).items())
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+    # ------------------------------------------------------------------ export
+    def render(self) -> str:
+        lines: List[str] = []
+        p = self.prefix
+        with self._lock:
+            histograms = {n: {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in s.items()}
+                          for n, s in self._histograms.items()}
+            counters = {n: dict(s) for n, s in self._counters.items()}
+        for name, series in sorted(histograms.items()):
+            full = f"{p}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+            for key, (counts, total, count, buckets) in sorted(series.items()):
+                cumulative = 0
+                for bound, c in zip(buckets, counts):
+                    cumulative += c
+                    lines.append(f"{full}_bucket{_format_labels(key, ('le', repr(float(bound))))} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{full}_sum{_format_labels(key)} {total}")
+                lines.append(f"{full}_count{_format_labels(key)} {count}")
+        for name, series in sorted(counters.items()):
+            full = f"{p}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{full}{_format_labels(key)} {value}")
+        gauges: Dict[str, List[Tuple[LabelKey, float]]] = {}
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    if value is not None:
+                        gauges.setdefault(name, []).append((_label_key(labels), float(value)))
+            except Exception as e:
+                logger.debug("Metrics collector failed: %s", e)
+        for name, series in sorted(gauges.items()):
+            full = f"{p}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} gauge")
+            for key, value in series:
+                lines.append(f"{full}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry()
+metrics.describe("stage_seconds", "Latency per pipeline stage")
+metrics.describe("batch_size", "Items per model call (queries to encode, pairs to rerank)")
+metrics.describe("http_request_seconds", "End-to-end request latency")
+metrics.describe("llm_tokens_total", "Tokens generated by the LLM")
+metrics.describe("llm_first_token_seconds", "Time to first LLM token")
+metrics.describe("llm_json_fallbacks_total", "LLM outputs without parseable JSON")
+
+
+class TimingMiddleware:
+    """
+    Middleware ASGI: abre el desglose por request (contextvar), mide la latencia total por ruta y,
+    si header=True, añade `Server-Timing: encode;dur=.., faiss_search;dur=.., rerank_pairs;desc="..", total;dur=..`.
+    """
+    def __init__(self, app, registry: MetricsRegistry = metrics, header: bool = True):
+        self.app = app
+        self.registry = registry
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings, token = self.registry.start_request()
+        counts = self.registry.request_counts()
+        t0 = time.perf_counter()
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.header:
+                    value = self.registry.server_timing(timings, time.perf_counter() - t0, counts)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            # la ruta (plantilla) y no el path, para no disparar la cardinalidad con 404s
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.registry.observe("http_request_seconds", time.perf_counter() - t0, route=route, status=status)
+            self.registry.end_request(token)
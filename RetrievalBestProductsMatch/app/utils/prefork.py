@@ -0,0 +1,163 @@
+# app/utils/prefork.py
+"""
+Servidor multi-proceso con carga única en el padre (estilo gunicorn --preload):
+  1. el padre abre el socket y ejecuta preload() (product store e índice por mmap, modelos de
+     embeddings y cross-encoder en el heap)
+  2. hace fork de N workers que heredan el socket y todo lo cargado: las páginas mmap se comparten
+     vía page cache y los pesos de los modelos por copy-on-write (nadie los escribe)
+  3. cada worker sirve la app con uvicorn sobre el socket compartido (el kernel reparte las conexiones)
+El padre no atiende requests: supervisa a los workers (los relanza si mueren), reenvía SIGTERM/SIGINT
+y, si memory_report_s > 0, registra periódicamente la memoria (RSS/PSS/USS) de cada worker.
+Sólo POSIX (os.fork). El padre no debe ejecutar inferencia antes del fork: los pools de threads
+(OpenMP de torch/FAISS, llama.cpp) no sobreviven al fork; el LLM y el warm-up se cargan en cada worker.
+"""
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from app.utils.memory import group_memory
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID_ENV = "PREFORK_WORKER_ID"
+PARENT_PID_ENV = "PREFORK_PARENT_PID"
+# un worker que muere antes de este tiempo cuenta como fallo de arranque (no se relanza en bucle)
+MIN_UPTIME_S = 5.0
+
+
+class PreforkServer:
+    def __init__(self, app, host: str = "0.0.0.0", port: int = 8000, workers: int = 2,
+                 preload: Optional[Callable[[], None]] = None, child_init: Optional[Callable[[int], None]] = None,
+                 memory_report_s: float = 0.0, log_level: str = "info", backlog: int = 2048):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.preload = preload
+        self.child_init = child_init
+        self.memory_report_s = memory_report_s
+        self.log_level = log_level
+        self.backlog = backlog
+        self._sock: Optional[socket.socket] = None
+        self._children: Dict[int, Tuple[int, float]] = {}  # pid -> (worker_id, started_at)
+        self._stopping = False
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.set_inheritable(True)
+        return sock
+
+    def run(self):
+        self._sock = self._bind()
+        logger.info("Prefork server listening on %s:%d (pid=%d, workers=%d)", self.host, self.port, os.getpid(),
+                    self.workers)
+        if self.preload is not None:
+            t0 = time.perf_counter()
+            self.preload()
+            logger.info("Preload done in %.1fs; forking workers", time.perf_counter() - t0)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        try:
+            self._supervise()
+        finally:
+            self._sock.close()
+        logger.info("Prefork server stopped.")
+
+    def _handle_stop(self, signum, frame):
+        if not self._stopping:
+            logger.info("Received signal %d; stopping %d worker(s)", signum, len(self._children))
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(worker_id)
+            except BaseException:
+                logger.exception("Worker %d crashed", worker_id)
+                code = 1
+            finally:
+                # sin atexit ni finalizadores heredados del padre
+                os._exit(code)
+        self._children[pid] = (worker_id, time.monotonic())
+        logger.info("Started worker %d (pid=%d)", worker_id, pid)
+
+    def _run_worker(self, worker_id: int):
+        import uvicorn
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        os.environ[WORKER_ID_ENV] = str(worker_id)
+        os.environ[PARENT_PID_ENV] = str(os.getppid())
+        if self.child_init is not None:
+            self.child_init(worker_id)
+        # log_config=None: conserva el logging de la app (setup_logging) en vez del de uvicorn
+        config = uvicorn.Config(self.app, log_level=self.log_level, log_config=None, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self._sock])
+
+    def _supervise(self):
+        next_report = time.monotonic() + self.memory_report_s if self.memory_report_s > 0 else None
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self._reap(pid, status)
+                continue
+            if next_report is not None and time.monotonic() >= next_report:
+                self.log_memory()
+                next_report = time.monotonic() + self.memory_report_s
+            time.sleep(0.2)
+
+    def _reap(self, pid: int, status: int):
+        worker_id, started_at = self._children.pop(pid, (None, 0.0))
+        if worker_id is None:
+            return
+        code = os.waitstatus_to_exitcode(status)
+        if self._stopping:
+            logger.info("Worker %d (pid=%d) exited with %d", worker_id, pid, code)
+            return
+        if time.monotonic() - started_at < MIN_UPTIME_S:
+            logger.error("Worker %d (pid=%d) exited with %d right after starting; shutting down", worker_id, pid,
+                         code)
+            self._handle_stop(signal.SIGTERM, None)
+            return
+        logger.warning("Worker %d (pid=%d) exited with %d; restarting", worker_id, pid, code)
+        self._spawn(worker_id)
+
+    def log_memory(self):
+        report = group_memory(os.getpid())
+        for proc in report["processes"]:
+            logger.info("memory %s pid=%d rss=%.1fMB pss=%.1fMB uss=%.1fMB shared=%.1fMB", proc["role"], proc["pid"],
+                        proc.get("rss_mb", 0.0), proc.get("pss_mb", 0.0), proc.get("uss_mb", 0.0),
+                        proc.get("shared_mb", 0.0))
+        total = report["total"]
+        logger.info("memory total: pss=%.1fMB (real) vs rss=%.1fMB (sum without sharing)", total["pss_mb"],
+                    total["rss_mb"])
+
+
+def set_worker_threads(n: int):
+    """Hilos de inferencia por worker (torch / FAISS) para no sobresuscribir la CPU con N workers."""
+    if n <= 0:
+        return
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(n)
+    if "faiss" in sys.modules:
+        sys.modules["faiss"].omp_set_num_threads(n)
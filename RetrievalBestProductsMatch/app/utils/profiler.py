@@ -0,0 +1,88 @@
+# app/utils/profiler.py
+import collections
+import logging
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """
+    Profiler por muestreo activable en caliente (sin reiniciar el proceso):
+    un thread daemon lee sys._current_frames() cada interval_ms y cuenta las pilas de todos los threads
+    del proceso. El resultado sale en formato "collapsed" (frame;frame;frame N), que aceptan
+    flamegraph.pl / speedscope. El coste es proporcional a la frecuencia de muestreo, no al tráfico.
+    """
+    def __init__(self, max_depth: int = 64):
+        self.max_depth = max_depth
+        self.interval_s = 0.01
+        self._counts: "collections.Counter[str]" = collections.Counter()
+        self._samples = 0
+        self._started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = 10.0):
+        if self.running:
+            return
+        self.interval_s = max(interval_ms, 0.5) / 1000.0
+        with self._lock:
+            self._counts.clear()
+            self._samples = 0
+        self._stop.clear()
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info("Sampling profiler started (interval=%.1fms)", self.interval_s * 1000)
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        logger.info("Sampling profiler stopped after %d samples", self._samples)
+
+    def _stack(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        own = threading.get_ident()
+        thread_names = {}
+        while not self._stop.wait(self.interval_s):
+            if len(thread_names) != threading.active_count():
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = [f"{thread_names.get(ident, ident)};{self._stack(frame)}"
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._lock:
+                self._counts.update(stacks)
+                self._samples += 1
+
+    def collapsed(self, limit: int = 0) -> str:
+        with self._lock:
+            items = self._counts.most_common(limit or None)
+        return "\n".join(f"{stack} {count}" for stack, count in items) + "\n"
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval_s * 1000,
+            "samples": self._samples,
+            "unique_stacks": len(self._counts),
+            "started_at": self._started_at,
+        }
+
+
+profiler = SamplingProfiler()
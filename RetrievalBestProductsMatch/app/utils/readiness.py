@@ -0,0 +1,82 @@
+# app/utils/readiness.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING, LOADING, READY, FAILED, DISABLED = "pending", "loading", "ready", "failed", "disabled"
+
+
+class Readiness:
+    """
+    Estado de carga por componente (product_store, faiss_index, embedder, reranker, llm, ...) para /ready.
+    required: componentes sin los que el servicio no puede atender /search.
+    """
+    def __init__(self, components: Iterable[str], required: Iterable[str] = ()):
+        self._status: Dict[str, Dict[str, Any]] = {c: {"status": PENDING} for c in components}
+        self.required = set(required)
+        self._lock = threading.Lock()
+
+    def set(self, component: str, status: str, **info):
+        with self._lock:
+            self._status[component] = {"status": status, **info}
+
+    def status(self, component: str) -> str:
+        return self._status.get(component, {}).get("status", PENDING)
+
+    def is_ready(self, component: Optional[str] = None) -> bool:
+        if component is not None:
+            return self.status(component) == READY
+        return all(self.status(c) == READY for c in self.required)
+
+    def run(self, component: str, fn: Callable[[], Any]) -> Any:
+        """Ejecuta fn marcando el componente loading -> ready/failed (con duración); relanza el error."""
+        self.set(component, LOADING)
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self.set(component, FAILED, error=str(e), seconds=round(time.perf_counter() - t0, 3))
+            raise
+        self.set(component, READY, seconds=round(time.perf_counter() - t0, 3))
+        logger.info("%s ready in %.2fs", component, time.perf_counter() - t0)
+        return result
+
+    def run_parallel(self, tasks: Dict[str, Callable[[], Any]], max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Carga componentes independientes a la vez (lectura de disco / deserialización de modelos liberan
+        el GIL). Espera a todos y relanza el primer error.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or len(tasks), thread_name_prefix="load") as pool:
+            futures = {name: pool.submit(self.run, name, fn) for name, fn in tasks.items()}
+            results, errors = {}, []
+            for name, fut in futures.items():
+                try:
+                    results[name] = fut.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        return results
+
+    def start_background(self, component: str, fn: Callable[[], Any]) -> threading.Thread:
+        """Carga lazy en un thread daemon; los errores quedan en el estado del componente."""
+        self.set(component, LOADING)
+
+        def _target():
+            try:
+                self.run(component, fn)
+            except Exception as e:
+                logger.exception("Background load of %s failed: %s", component, e)
+
+        thread = threading.Thread(target=_target, name=f"load-{component}", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            components = {c: dict(s) for c, s in self._status.items()}
+        return {"ready": self.is_ready(), "components": components}
@@ -1,88 +1,516 @@
 # app/main.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import json
 import logging
+import os
+import threading
 
 from app.logger import setup_logging
 from app.config import settings
 from app.models.retriever import Retriever
 from app.models.reranker import Reranker
 from app.models.rag import RAGService
-from app.schemas import SearchRequest, SearchResponse
+from app.models.search import SearchService
+from app.models.scheduler import InferenceScheduler
+from app.models.filters import ProductFilter
+from app.models.catalog import CatalogViewMiddleware, LiveCatalog
+from app.models.index_factory import build_index
+from app.clients.llm_pool import LLMPool
+from app.clients.fake_llm import FakeLLMClient
+from app.schemas import (SearchRequest, SearchResponse, BatchSearchRequest, BatchSearchResponse, CatalogUpsertRequest,
+                         CatalogDeleteRequest)
 from app.utils.llm_loader import load_local_gpt4all_adapter  # tu loader aquí
+from app.utils.cache import QueryCache, SemanticAnswerCache, read_query_log
+from app.utils.index_builder import read_manifest
+from app.utils.batching import QueueFullError
+from app.utils.readiness import Readiness, DISABLED, LOADING
+from app.utils.metrics import metrics, TimingMiddleware
+from app.utils.profiler import profiler
+from app.utils.memory import group_memory, process_memory
+from app.utils.prefork import PARENT_PID_ENV, WORKER_ID_ENV
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Retrieval RAG Service")
+metrics.enabled = settings.METRICS_ENABLED
+if settings.METRICS_ENABLED:
+    app.add_middleware(TimingMiddleware, header=settings.SERVER_TIMING_HEADER)
 
 # Instantiate model objects (but don't perform heavy loads yet)
-retriever = Retriever(settings.FAISS_INDEX_PATH, settings.PRODUCT_CSV, settings.EMBED_MODEL)
-reranker = Reranker(settings.RERANKER_MODEL)
+query_cache = QueryCache(
+    embedding_size=settings.EMBED_CACHE_SIZE,
+    result_size=settings.RESULT_CACHE_SIZE,
+    result_ttl_s=settings.RESULT_CACHE_TTL_S,
+) if settings.CACHE_ENABLED else None
+retriever = Retriever(settings.FAISS_INDEX_PATH, settings.PRODUCT_CSV, settings.EMBED_MODEL,
+                      encode_batch_size=settings.EMBED_BATCH_SIZE,
+                      embedding_cache=query_cache.embeddings if query_cache else None,
+                      product_store_dir=settings.PRODUCT_STORE_DIR,
+                      nprobe=settings.FAISS_NPROBE,
+                      ef_search=settings.FAISS_EF_SEARCH,
+                      exact_rescore=settings.EXACT_RESCORE,
+                      rescore_factor=settings.RESCORE_FACTOR,
+                      embeddings_path=settings.EMBEDDINGS_PATH,
+                      manifest_path=settings.MANIFEST_PATH,
+                      retrieval_mode=settings.RETRIEVAL_MODE,
+                      lexical_index_path=settings.LEXICAL_INDEX_PATH,
+                      lexical_build_on_load=settings.LEXICAL_BUILD_ON_LOAD,
+                      rrf_k=settings.RRF_K,
+                      inference_backend=settings.INFERENCE_BACKEND,
+                      onnx_dir=settings.ONNX_DIR,
+                      onnx_quantize=settings.ONNX_QUANTIZE,
+                      onnx_threads=settings.ONNX_INTRA_OP_THREADS,
+                      index_mmap=settings.FAISS_MMAP,
+                      snapshot_on_load=settings.SNAPSHOT_ON_LOAD,
+                      filter_brute_force_max_rows=settings.FILTER_BRUTE_FORCE_MAX_ROWS,
+                      filter_cache_size=settings.FILTER_CACHE_SIZE)
+reranker = Reranker(settings.RERANKER_MODEL, batch_size=settings.RERANK_BATCH_SIZE,
+                    inference_backend=settings.INFERENCE_BACKEND, onnx_dir=settings.ONNX_DIR,
+                    onnx_quantize=settings.ONNX_QUANTIZE, onnx_threads=settings.ONNX_INTRA_OP_THREADS,
+                    cascade=settings.RERANK_CASCADE, cascade_batch_size=settings.RERANK_CASCADE_BATCH,
+                    cascade_margin=settings.RERANK_CASCADE_MARGIN, cascade_model_name=settings.RERANK_CASCADE_MODEL)
+scheduler = InferenceScheduler(
+    retriever, reranker,
+    max_batch_size=settings.BATCH_MAX_SIZE,
+    max_batch_pairs=settings.BATCH_MAX_PAIRS,
+    max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+    max_queue=settings.BATCH_MAX_QUEUE,
+) if settings.BATCHING_ENABLED else None
+answer_cache = SemanticAnswerCache(
+    maxsize=settings.ANSWER_CACHE_SIZE,
+    ttl_s=settings.ANSWER_CACHE_TTL_S,
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+) if settings.ANSWER_CACHE_ENABLED else None
+search_service = SearchService(retriever=retriever, reranker=reranker, cache=query_cache, scheduler=scheduler)
+
+def _compaction_index(vectors):
+    """Índice de la compactación del catálogo vivo: mismo tipo que el build (manifest)."""
+    manifest = read_manifest(settings.MANIFEST_PATH) or {}
+    return build_index(vectors, index_type=manifest.get("index_type", settings.INDEX_TYPE), nlist=settings.IVF_NLIST,
+                       pq_m=settings.PQ_M, pq_nbits=settings.PQ_NBITS, hnsw_m=settings.HNSW_M,
+                       ef_construction=settings.HNSW_EF_CONSTRUCTION, train_size=settings.INDEX_TRAIN_SIZE)
+
+def _invalidate_caches():
+    # resultados y respuestas pueden contener productos cambiados o borrados (los embeddings de queries valen)
+    if query_cache is not None:
+        query_cache.results.clear()
+    if answer_cache is not None:
+        answer_cache.clear()
+
+catalog = LiveCatalog(
+    retriever,
+    delta_dir=settings.CATALOG_DELTA_DIR,
+    poll_s=settings.CATALOG_POLL_S,
+    embed_batch_size=settings.CATALOG_EMBED_BATCH,
+    compact_tombstone_ratio=settings.CATALOG_COMPACT_TOMBSTONE_RATIO,
+    compact_delta_rows=settings.CATALOG_COMPACT_DELTA_ROWS,
+    index_builder=_compaction_index,
+    # un solo proceso compacta y reescribe los ficheros (flock); los demás mapean la base que escribe
+    elect_persister=settings.CATALOG_PERSIST,
+    on_swap=[_invalidate_caches],
+) if settings.CATALOG_LIVE_ENABLED else None
+if catalog is not None:
+    # la compactación renumera las filas: cada request las resuelve contra la vista con la que empezó
+    app.add_middleware(CatalogViewMiddleware, retriever=retriever)
 rag_service: RAGService | None = None
 llm_client = None
+llm_pool: LLMPool | None = None
+_REQUIRED = ["product_store", "faiss_index", "embedder", "reranker", "retriever"] + (["catalog"] if catalog else [])
+readiness = Readiness(_REQUIRED + ["llm"], required=_REQUIRED)
+
+def _collect_service_metrics():
+    """Gauges calculados en cada scrape de /metrics (caches, colas, pool LLM, readiness)."""
+    if query_cache is not None:
+        for name, stats in query_cache.stats().items():
+            yield "cache_hit_rate", {"cache": name}, stats["hit_rate"]
+            yield "cache_entries", {"cache": name}, stats["size"]
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        yield "cache_hit_rate", {"cache": "answers"}, stats["hit_rate"]
+        yield "cache_entries", {"cache": "answers"}, stats["size"]
+    if scheduler is not None:
+        for name, depth in scheduler.stats().items():
+            yield "queue_depth", {"queue": name.replace("_queue_depth", "")}, depth
+    if catalog is not None and retriever.view is not None:
+        stats = retriever.view.stats()
+        for kind in ("rows", "live_rows", "delta_rows", "tombstones"):
+            yield "catalog_rows", {"kind": kind}, stats[kind]
+        yield "catalog_version", {}, stats["version"]
+    if llm_pool is not None:
+        stats = llm_pool.stats()
+        yield "llm_pool_idle", {}, stats["idle"]
+        yield "llm_pool_waiting", {}, stats["waiting"]
+    for component, state in readiness.snapshot()["components"].items():
+        yield "component_ready", {"component": component}, float(state["status"] == "ready")
+    for kind, mb in process_memory().items():
+        yield "process_memory_bytes", {"kind": kind.replace("_mb", "")}, mb * 1024 * 1024
+
+metrics.register_collector(_collect_service_metrics)
+
+def _load_llm_adapter():
+    if settings.LLM_BACKEND == "fake":
+        return FakeLLMClient(first_token_s=settings.FAKE_LLM_FIRST_TOKEN_MS / 1000.0,
+                             tokens_per_s=settings.FAKE_LLM_TOKENS_PER_S,
+                             output_tokens=settings.FAKE_LLM_OUTPUT_TOKENS)
+    # allow_download comes from config (True to allow download)
+    return load_local_gpt4all_adapter(settings.LLM_MODEL_NAME, allow_download=settings.LLM_ALLOW_DOWNLOAD,
+                                      structured=settings.LLM_STRUCTURED)
+
+def load_llm():
+    """Carga los adaptadores LLM y el pool (non-fatal si falla) y los engancha a rag_service."""
+    global llm_client, llm_pool
+    # Una instancia GPT4All por slot del pool: no son thread-safe.
+    llm_clients = []
+    logger.info("Attempting to load %d LLM adapter(s) (backend=%s, model=%s)", settings.LLM_POOL_SIZE,
+                settings.LLM_BACKEND, settings.LLM_MODEL_NAME)
+    for _ in range(max(1, settings.LLM_POOL_SIZE)):
+        client = _load_llm_adapter()
+        if client is None:
+            break
+        llm_clients.append(client)
+    if not llm_clients:
+        raise RuntimeError("LLM adapter not available; /rag will fallback to deterministic responses.")
+    pool = LLMPool(llm_clients, max_queue=settings.LLM_QUEUE_MAX, timeout_s=settings.LLM_TIMEOUT_S,
+                   max_tokens=settings.LLM_STRUCTURED_MAX_TOKENS if settings.LLM_STRUCTURED else settings.LLM_MAX_TOKENS)
+    llm_client, llm_pool = llm_clients[0], pool
+    rag_service.llm, rag_service.llm_pool = llm_client, pool
+    logger.info("LLM pool ready with %d adapter(s).", len(llm_clients))
+
+def load_components():
+    """
+    Carga store, índice y modelos. La llama startup_event o, en modo prefork (`python -m app.cli serve`),
+    el proceso padre antes del fork para que los workers compartan lo cargado.
+    """
+    # componentes independientes en paralelo: store (mmap), índice (mmap), embedder, cross-encoder
+    logger.info("Loading product store, index and models...")
+    readiness.run_parallel({
+        "product_store": retriever.load_store,
+        "faiss_index": retriever.load_index,
+        "embedder": retriever.load_embedding_model,
+        "reranker": reranker.load,
+    })
+    readiness.run("retriever", retriever.finalize)
+
+def load_and_start():
+    """
+    Store, índice y modelos (salvo que los haya precargado el padre prefork), cambios del catálogo
+    posteriores al último build y warm-up de la cache. /ready da 200 al terminar.
+    """
+    if readiness.is_ready("retriever"):
+        logger.info("Store, index and models preloaded by the parent process (pid=%s).", os.getppid())
+    else:
+        load_components()
+    if catalog is not None:
+        # cambios del log posteriores al último build/compactación + watcher (por worker)
+        readiness.run("catalog", catalog.start)
+
+    if query_cache and settings.CACHE_WARMUP_QUERY_LOG:
+        try:
+            queries = read_query_log(settings.CACHE_WARMUP_QUERY_LOG, limit=settings.CACHE_WARMUP_LIMIT)
+            with retriever.pinned():
+                n = search_service.warm_up(queries, top_k=settings.TOP_K_RETRIEVER, rerank_m=settings.RERANK_TOP_M)
+            logger.info("Cache warm-up done: %d queries from %s", n, settings.CACHE_WARMUP_QUERY_LOG)
+        except Exception as e:
+            # warm-up es best-effort; no debe impedir el arranque
+            logger.exception("Cache warm-up failed: %s", e)
+    logger.info("Store, index and models ready.")
+
+def _load_and_start_background():
+    try:
+        load_and_start()
+    except Exception as e:
+        # el componente queda en 'failed' en /ready; el proceso sigue vivo para poder diagnosticarlo
+        logger.exception("Background load failed: %s", e)
 
 @app.on_event("startup")
 def startup_event():
-    global rag_service, llm_client
+    global rag_service
     try:
-        logger.info("Loading retriever...")
-        retriever.load()
-        logger.info("Loading reranker...")
-        reranker.load()
-
-        # Load LLM adapter (non-fatal if fails). Use settings values.
-        llm_client = None
-        if settings.LLM_MODEL_NAME and str(settings.LLM_MODEL_NAME).lower() != "none":
-            logger.info("Attempting to load LLM adapter for model name: %s", settings.LLM_MODEL_NAME)
-            # allow_download comes from config (True to allow download)
-            llm_client = load_local_gpt4all_adapter(settings.LLM_MODEL_NAME, allow_download=settings.LLM_ALLOW_DOWNLOAD)
-            if llm_client is None:
-                logger.warning("LLM adapter not available; /rag will fallback to deterministic responses.")
-            else:
-                logger.info("LLM adapter loaded.")
+        if answer_cache is not None and settings.ANSWER_CACHE_PATH:
+            try:
+                answer_cache.load(settings.ANSWER_CACHE_PATH)
+            except Exception as e:
+                logger.exception("Could not load answer cache from %s: %s", settings.ANSWER_CACHE_PATH, e)
+        rag_service = RAGService(retriever=retriever, reranker=reranker, answer_cache=answer_cache,
+                                 context_tokens=settings.LLM_CONTEXT_TOKENS, scheduler=scheduler)
+
+        if settings.COMPONENTS_LAZY_LOAD:
+            # uvicorn acepta conexiones en cuanto termina este hook: /ready muestra la carga en curso
+            logger.info("Loading product store, index and models in the background.")
+            threading.Thread(target=_load_and_start_background, name="load-components", daemon=True).start()
         else:
-            logger.info("No LLM model configured; skipping LLM load.")
+            load_and_start()
 
-        rag_service = RAGService(retriever=retriever, reranker=reranker, llm_client=llm_client)
+        # Load LLM adapters (non-fatal if fails). Use settings values.
+        if settings.LLM_BACKEND != "fake" and (not settings.LLM_MODEL_NAME
+                                               or str(settings.LLM_MODEL_NAME).lower() == "none"):
+            logger.info("No LLM model configured; skipping LLM load.")
+            readiness.set("llm", DISABLED)
+        elif settings.LLM_LAZY_LOAD:
+            # /search atiende ya; /rag responde 503 hasta que el LLM termine de cargar
+            logger.info("Loading LLM in the background.")
+            readiness.start_background("llm", load_llm)
+        else:
+            try:
+                readiness.run("llm", load_llm)
+            except Exception as e:
+                logger.warning("%s", e)
         logger.info("Service started.")
     except Exception as e:
         logger.exception("Startup failed: %s", e)
         raise
 
+@app.on_event("startup")
+async def start_scheduler():
+    if scheduler is not None:
+        await scheduler.start()
+        logger.info("Inference scheduler started (max_batch=%d, max_wait=%.1fms).",
+                    settings.BATCH_MAX_SIZE, settings.BATCH_MAX_WAIT_MS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if scheduler is not None:
+        await scheduler.stop()
+    if catalog is not None:
+        catalog.stop()
+    if llm_pool is not None:
+        llm_pool.shutdown()
+    if answer_cache is not None and settings.ANSWER_CACHE_PATH:
+        try:
+            answer_cache.save(settings.ANSWER_CACHE_PATH)
+        except Exception as e:
+            logger.exception("Could not save answer cache to %s: %s", settings.ANSWER_CACHE_PATH, e)
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    """Readiness por componente: 200 cuando /search puede atender (el LLM no es requisito)."""
+    state = readiness.snapshot()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.get("/memory")
+def memory():
+    """
+    Memoria de este worker y, en modo prefork, del padre y de todos los workers (RSS/PSS/USS/compartida).
+    La suma de PSS es la memoria real del grupo; la de RSS, la que ocuparía sin compartir páginas.
+    """
+    parent = os.environ.get(PARENT_PID_ENV)
+    return {
+        "pid": os.getpid(),
+        "worker_id": os.environ.get(WORKER_ID_ENV),
+        "self": process_memory(),
+        "group": group_memory(int(parent)) if parent else None,
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Formato de texto Prometheus: latencias por etapa, tamaños de batch, tokens LLM, caches, colas."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _check_profiler_enabled():
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="profiler endpoints are disabled (PROFILER_ENABLED)")
+
+@app.post("/debug/profiler/start")
+def profiler_start(interval_ms: float = 10.0):
+    _check_profiler_enabled()
+    profiler.start(interval_ms=interval_ms)
+    return profiler.stats()
+
+@app.post("/debug/profiler/stop")
+def profiler_stop(limit: int = 0):
+    """Para el muestreo y devuelve las pilas en formato collapsed (flamegraph.pl / speedscope)."""
+    _check_profiler_enabled()
+    profiler.stop()
+    return Response(profiler.collapsed(limit=limit), media_type="text/plain")
+
+@app.get("/debug/profiler")
+def profiler_status():
+    _check_profiler_enabled()
+    return profiler.stats()
+
+def _check_ready():
+    """503 mientras store, índice, modelos o catálogo siguen cargando (o han fallado; ver /ready)."""
+    if not readiness.is_ready():
+        raise HTTPException(status_code=503, detail="service is still loading (see /ready)",
+                            headers={"Retry-After": "10"})
+
+def _check_llm_ready():
+    if readiness.status("llm") == LOADING:
+        raise HTTPException(status_code=503, detail="LLM is still loading", headers={"Retry-After": "10"})
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = {"enabled": query_cache is not None, **(query_cache.stats() if query_cache else {})}
+    stats["answers"] = answer_cache.stats() if answer_cache is not None else None
+    return stats
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    if scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, **scheduler.stats()}
+
+@app.get("/llm/stats")
+def llm_stats():
+    if llm_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_pool.stats()}
+
+def _check_catalog_enabled():
+    if catalog is None:
+        raise HTTPException(status_code=404, detail="live catalog updates are disabled (CATALOG_LIVE_ENABLED)")
+    _check_ready()
+
+@app.post("/catalog/upsert")
+def catalog_upsert(req: CatalogUpsertRequest):
+    """Alta o modificación de productos (por product_id); visibles en la búsqueda al responder."""
+    _check_catalog_enabled()
+    try:
+        return catalog.upsert([p.model_dump() for p in req.products])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/catalog/delete")
+def catalog_delete(req: CatalogDeleteRequest):
+    _check_catalog_enabled()
+    try:
+        return catalog.delete(req.product_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/catalog/compact")
+def catalog_compact():
+    """Compacta ya (síncrono); normalmente se dispara sola al pasar los umbrales."""
+    _check_catalog_enabled()
+    return catalog.compact()
+
+@app.get("/catalog/stats")
+def catalog_stats():
+    if catalog is None:
+        return {"enabled": False}
+    if retriever.view is None:
+        return {"enabled": True, "loaded": False}
+    return {"enabled": True, **catalog.stats()}
+
+def _search_kwargs(req) -> dict:
+    """
+    Knobs de búsqueda de la request; 400 si pide filtros y el catálogo no tiene metadatos (o la columna
+    de un rango), o mode lexical/hybrid sin índice léxico.
+    """
+    filters = ProductFilter.from_dict(req.filters.model_dump()) if req.filters is not None else None
+    if filters is not None:
+        if retriever.metadata is None:
+            raise HTTPException(status_code=400, detail="metadata filters are not available for this catalog")
+        try:
+            retriever.metadata.validate(filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if req.mode in ("lexical", "hybrid") and retriever.lexical is None:
+        raise HTTPException(status_code=400, detail=f"mode={req.mode!r} requires a lexical index (LEXICAL_INDEX_PATH)")
+    return dict(nprobe=req.nprobe, ef_search=req.ef_search, mode=req.mode, filters=filters)
+
 @app.post("/search", response_model=SearchResponse)
-def search(req: SearchRequest):
+async def search(req: SearchRequest):
+    _check_ready()
+    search_kwargs = _search_kwargs(req)
     try:
-        idxs, dists = retriever.retrieve(req.query, top_k=req.top_k)
-        if req.use_rerank:
-            candidate_texts = [
-                retriever.product_df.iloc[i]['product_name'] + " - " + str(retriever.product_df.iloc[i]['product_description'])
-                for i in idxs
-            ]
-            idxs, scores = reranker.rerank(req.query, candidate_texts, idxs, top_m=req.rerank_m)
-            dists = scores
-        results = []
-        for idx, score in zip(idxs[:req.rerank_m], dists[:req.rerank_m]):
-            p = retriever.get_product(idx)
-            results.append({
-                "product_id": str(p['product_id']),
-                "product_name": p['product_name'],
-                "product_description": p['product_description'],
-                "score": float(score)
-            })
+        if scheduler is not None:
+            results = await search_service.search_async(req.query, top_k=req.top_k, rerank_m=req.rerank_m,
+                                                        use_rerank=req.use_rerank, **search_kwargs)
+        else:
+            results = await run_in_threadpool(search_service.search, req.query, top_k=req.top_k, rerank_m=req.rerank_m,
+                                              use_rerank=req.use_rerank, **search_kwargs)
         return {"query": req.query, "results": results}
+    except QueueFullError as e:
+        logger.warning("Search rejected: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.exception("Search error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search/batch", response_model=BatchSearchResponse)
+def search_batch(req: BatchSearchRequest):
+    if not req.queries:
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list")
+    if len(req.queries) > settings.MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"at most {settings.MAX_BATCH_QUERIES} queries per batch")
+    _check_ready()
+    search_kwargs = _search_kwargs(req)
+    try:
+        batch = search_service.search_batch(req.queries, top_k=req.top_k, rerank_m=req.rerank_m, use_rerank=req.use_rerank,
+                                            **search_kwargs)
+        return {"results": [{"query": q, "results": r} for q, r in zip(req.queries, batch)]}
+    except Exception as e:
+        logger.exception("Batch search error: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _rag_candidates(req: SearchRequest, search_kwargs: dict):
+    """retrieve -> rerank para /rag y /rag/stream: vía scheduler si existe, si no en un thread."""
+    if scheduler is not None:
+        return await search_service.rank_async(req.query, top_k=req.top_k, rerank_m=req.rerank_m, **search_kwargs)
+    return await run_in_threadpool(rag_service.retrieve_candidates, req.query, top_k=req.top_k,
+                                   rerank_top=req.rerank_m, **search_kwargs)
+
 @app.post("/rag")
-def rag(req: SearchRequest):
+async def rag(req: SearchRequest):
+    if not req.query.strip():
+        raise HTTPException(status_code=400, detail="query must be a non-empty string")
+    _check_llm_ready()
+    _check_ready()
+    search_kwargs = _search_kwargs(req)
     try:
-        answer = rag_service.answer(req.query, top_k=req.top_k, rerank_top=req.rerank_m)
-        return answer
+        idxs, _ = await _rag_candidates(req, search_kwargs)
+        return await rag_service.answer_async(req.query, idxs, rerank_top=req.rerank_m)
+    except QueueFullError as e:
+        logger.warning("RAG rejected: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.exception("RAG error: %s", e)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/rag/stream")
+async def rag_stream(req: SearchRequest, request: Request):
+    """
+    Server-Sent Events: `candidates` en cuanto termina el rerank, luego un `token` por token del
+    LLM y por último `answer` (mismo JSON que /rag). Si el cliente se desconecta, la generación
+    se cancela y el cliente LLM vuelve al pool.
+    """
+    if not req.query.strip():
+        raise HTTPException(status_code=400, detail="query must be a non-empty string")
+    _check_llm_ready()
+    if llm_pool is not None and llm_pool.saturated():
+        raise HTTPException(status_code=503, detail="LLM pool queue is full")
+    _check_ready()
+    search_kwargs = _search_kwargs(req)
+    try:
+        idxs, scores = await _rag_candidates(req, search_kwargs)
+    except QueueFullError as e:
+        logger.warning("RAG stream rejected: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.exception("RAG stream error: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        stream = rag_service.stream_answer(req.query, idxs, scores, rerank_top=req.rerank_m)
+        try:
+            async for event, data in stream:
+                if await request.is_disconnected():
+                    logger.info("RAG stream client disconnected; cancelling generation.")
+                    break
+                yield _sse(event, data)
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
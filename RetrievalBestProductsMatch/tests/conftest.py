@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# los tests importan el paquete app/ igual que main.py (desde RetrievalBestProductsMatch/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,180 @@
+# tests/test_batching.py
+"""MicroBatcher / InferenceScheduler: cortes por tamaño, peso y max_wait, cola llena (503) y futures cancelados."""
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.models.scheduler import InferenceScheduler
+from app.schemas import SearchRequest
+from app.utils.batching import MicroBatcher, QueueFullError
+
+
+class RecordingFn:
+    """fn del batcher: registra cada batch y devuelve item * 10; con gate, espera a que se abra."""
+    def __init__(self, gate: threading.Event = None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, items):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(items))
+        return [item * 10 for item in items]
+
+
+async def _with_batcher(batcher, body):
+    await batcher.start()
+    try:
+        return await body()
+    finally:
+        await batcher.stop()
+
+
+def test_batch_is_cut_at_max_batch_size():
+    fn = RecordingFn()
+    batcher = MicroBatcher(fn, max_batch_size=3, max_wait_ms=200)
+
+    async def body():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(7))), 5)
+
+    # sólo el último batch (incompleto) espera al plazo
+    assert asyncio.run(_with_batcher(batcher, body)) == [i * 10 for i in range(7)]
+    assert fn.batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_batch_is_cut_by_weight():
+    fn = RecordingFn()
+    batcher = MicroBatcher(fn, max_batch_size=5, max_wait_ms=50, weight_fn=len)
+    items = [["a"] * 3, ["b"] * 2, ["c"] * 4, ["d"]]
+
+    async def body():
+        return await asyncio.gather(*(batcher.submit(item) for item in items))
+
+    asyncio.run(_with_batcher(batcher, body))
+    # el item que supera el peso entra en el batch y lo cierra: 3+2, luego 4+1
+    assert [[len(item) for item in batch] for batch in fn.batches] == [[3, 2], [4, 1]]
+
+
+def test_partial_batch_flushes_after_max_wait():
+    fn = RecordingFn()
+    batcher = MicroBatcher(fn, max_batch_size=64, max_wait_ms=20)
+
+    async def body():
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        first = await batcher.submit(1)
+        elapsed = loop.time() - t0
+        second = await batcher.submit(2)
+        return first, second, elapsed
+
+    first, second, elapsed = asyncio.run(_with_batcher(batcher, body))
+    assert (first, second) == (10, 20) and fn.batches == [[1], [2]]
+    assert 0.015 <= elapsed < 1.0
+
+
+def test_full_queue_rejects_instead_of_queueing():
+    gate = threading.Event()
+    fn = RecordingFn(gate)
+    batcher = MicroBatcher(fn, max_batch_size=1, max_wait_ms=0, max_queue=2)
+
+    async def body():
+        busy = asyncio.ensure_future(batcher.submit(0))
+        await asyncio.sleep(0.05)  # el colector ya lo ha sacado de la cola y fn está bloqueada
+        queued = [asyncio.ensure_future(batcher.submit(i)) for i in (1, 2)]
+        await asyncio.sleep(0)
+        assert batcher.depth == 2
+        with pytest.raises(QueueFullError):
+            await batcher.submit(3)
+        gate.set()
+        return await asyncio.gather(busy, *queued)
+
+    assert asyncio.run(_with_batcher(batcher, body)) == [0, 10, 20]
+
+
+def test_cancelled_requests_are_skipped():
+    gate = threading.Event()
+    fn = RecordingFn(gate)
+    batcher = MicroBatcher(fn, max_batch_size=1, max_wait_ms=0)
+
+    async def body():
+        busy = asyncio.ensure_future(batcher.submit(0))
+        await asyncio.sleep(0.05)
+        cancelled = asyncio.ensure_future(batcher.submit(1))
+        kept = asyncio.ensure_future(batcher.submit(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()  # cliente desconectado mientras esperaba en la cola
+        gate.set()
+        return await asyncio.gather(busy, kept)
+
+    assert asyncio.run(_with_batcher(batcher, body)) == [0, 20]
+    assert fn.batches == [[0], [2]]
+
+
+def test_failed_batch_fails_every_request():
+    def boom(items):
+        raise RuntimeError("model crashed")
+
+    batcher = MicroBatcher(boom, max_batch_size=4, max_wait_ms=20)
+
+    async def body():
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    results = asyncio.run(_with_batcher(batcher, body))
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+class StubRetriever:
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, queries):
+        self.batches.append(list(queries))
+        return np.array([[len(q), 1.0] for q in queries], dtype=np.float32)
+
+
+class StubReranker:
+    def __init__(self):
+        self.batches = []
+
+    def score_pairs(self, pairs):
+        self.batches.append(len(pairs))
+        return [len(text) for _, text in pairs]
+
+
+def test_scheduler_groups_concurrent_requests():
+    retriever, reranker = StubRetriever(), StubReranker()
+    scheduler = InferenceScheduler(retriever, reranker, max_batch_size=8, max_batch_pairs=5, max_wait_ms=20)
+
+    async def run():
+        await scheduler.start()
+        try:
+            vectors = await asyncio.gather(*(scheduler.encode(q) for q in ("a", "bb", "ccc")))
+            scores = await asyncio.gather(scheduler.score("q", ["x", "yy"]), scheduler.score("q", ["zzz"]),
+                                          scheduler.score("q", ["1", "22", "333"]), scheduler.score("q", []))
+            return vectors, scores
+        finally:
+            await scheduler.stop()
+
+    vectors, scores = asyncio.run(run())
+    assert retriever.batches == [["a", "bb", "ccc"]]
+    assert [v[0] for v in vectors] == [1, 2, 3]
+    # 2 + 1 + 3 pares superan max_batch_pairs=5: el tercero cierra el primer batch
+    assert reranker.batches == [6]
+    assert [s.tolist() for s in scores] == [[1, 2], [3], [1, 2, 3], []]
+
+
+def test_search_returns_503_when_the_scheduler_queue_is_full(monkeypatch):
+    import main
+
+    async def full(*args, **kwargs):
+        raise QueueFullError("encode-batcher queue is full (256)")
+
+    monkeypatch.setattr(main, "scheduler", object())
+    monkeypatch.setattr(main, "_check_ready", lambda: None)
+    monkeypatch.setattr(main.search_service, "search_async", full)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(main.search(SearchRequest(query="sofa")))
+    assert e.value.status_code == 503 and "queue is full" in e.value.detail
@@ -0,0 +1,107 @@
+# tests/test_cache.py
+"""LRUCache (TTL y evicción), claves de QueryCache, read_query_log y warm-up de SearchService."""
+import pandas as pd
+
+from app.models.search import SearchService
+from app.utils import cache as cache_module
+from app.utils.cache import LRUCache, QueryCache, read_query_log
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = LRUCache(maxsize=4, ttl_s=10.0)
+    cache.put("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.2
+    assert cache.get("a", "gone") == "gone" and len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_no_ttl_never_expires(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = LRUCache(maxsize=4, ttl_s=0)
+    cache.put("a", 1)
+    clock.now += 1e9
+    assert cache.get("a") == 1
+
+
+def test_evicts_the_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")  # "b" pasa a ser la menos usada
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    cache.put("a", 10)  # reescribir una clave no expulsa nada
+    assert len(cache) == 2 and cache.stats()["evictions"] == 1
+
+
+def test_zero_maxsize_disables_the_cache():
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None and len(cache) == 0
+
+
+def test_result_key_normalizes_the_query_and_keeps_options_apart():
+    cache = QueryCache()
+    cache.put_results("Red  Sofa", 50, 10, True, ["r1"])
+    cache.put_results("red sofa", 50, 10, True, ["r2"], options=(("nprobe", 8),))
+    assert cache.get_results(" red sofa ", 50, 10, True) == ["r1"]
+    assert cache.get_results("RED SOFA", 50, 10, True, options=(("nprobe", 8),)) == ["r2"]
+    assert cache.get_results("red sofa", 50, 10, False) is None
+    assert cache.get_results("red sofa", 50, 5, True) is None
+    assert cache.get_results("red sofa", 20, 10, True) is None
+
+
+def test_search_options_key_ignores_unset_knobs():
+    key = SearchService._options_key
+    assert key({"nprobe": None, "ef_search": None}) == ()
+    assert key({"nprobe": 8, "ef_search": None}) == key({"ef_search": None, "nprobe": 8}) == (("nprobe", 8),)
+
+
+def test_read_query_log_dedupes_normalized_queries(tmp_path):
+    path = tmp_path / "query.csv"
+    pd.DataFrame({"query": ["Red Sofa", "red  sofa", None, "lamp", "oak table", "LAMP"]}).to_csv(
+        path, sep="\t", index=False)
+    assert read_query_log(str(path)) == ["Red Sofa", "lamp", "oak table"]
+    assert read_query_log(str(path), limit=2) == ["Red Sofa", "lamp"]
+
+
+class CountingRetriever:
+    """Retriever mínimo: cuenta los lotes y devuelve siempre las filas 0..top_k-1."""
+    store = None
+
+    def __init__(self):
+        self.batches = []
+
+    def retrieve_batch(self, queries, top_k=50, **kwargs):
+        self.batches.append(len(queries))
+        return [(list(range(top_k)), [1.0] * top_k) for _ in queries]
+
+    def get_products(self, idxs):
+        return [{"product_id": str(i)} for i in idxs]
+
+
+def test_warm_up_fills_the_result_cache_in_batches():
+    retriever = CountingRetriever()
+    service = SearchService(retriever, cache=QueryCache())
+    queries = [f"query {i}" for i in range(5)]
+    assert service.warm_up(queries, top_k=3, rerank_m=2, batch_size=2) == 5
+    assert retriever.batches == [2, 2, 1]
+    # las requests con los mismos parámetros salen de la cache
+    assert service.search_batch(queries, top_k=3, rerank_m=2) == [[{"product_id": "0", "score": 1.0},
+                                                                  {"product_id": "1", "score": 1.0}]] * 5
+    assert retriever.batches == [2, 2, 1]
+    assert service.cache.stats()["results"]["size"] == 5
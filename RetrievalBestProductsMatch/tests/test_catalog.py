@@ -0,0 +1,333 @@
+# tests/test_catalog.py
+"""
+Catálogo vivo (CatalogView / LiveCatalog) sobre un catálogo pequeño construido en tmp_path, con un
+embedder de bolsa de palabras en lugar de sentence-transformers.
+"""
+import json
+import os
+import zlib
+
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models.catalog import LiveCatalog, pinned_view
+from app.models.filters import ProductFilter
+from app.models.lexical import LexicalIndex
+from app.models.product_store import ProductStore
+from app.models.retriever import Retriever
+from app.utils.index_builder import embedding_texts, write_json_atomic
+
+DIM = 64
+MODEL = "fake-bow"
+MODES = ("dense", "lexical", "hybrid")
+
+
+class BagOfWordsEmbedder:
+    """Interfaz mínima de SentenceTransformer: cada palabra suma 1 en la dimensión crc32(palabra) % DIM."""
+    def encode(self, texts, batch_size=32, convert_to_tensor=False):
+        out = np.zeros((len(texts), DIM), dtype="float32")
+        for i, text in enumerate(texts):
+            for word in str(text).lower().split():
+                out[i, zlib.crc32(word.encode()) % DIM] += 1.0
+        return out
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+
+def _products(n: int) -> pd.DataFrame:
+    classes = ["Sofas", "Chairs", "Beds"]
+    return pd.DataFrame({
+        "product_id": [str(i) for i in range(n)],
+        "product_name": [f"item{i} {classes[i % 3].lower()} model{i % 7}" for i in range(n)],
+        "product_description": [f"plain furniture piece number{i}" for i in range(n)],
+        "product_class": [classes[i % 3] for i in range(n)],
+        "category hierarchy": [f"Furniture / {classes[i % 3]}" for i in range(n)],
+        "average_rating": [str(1 + i % 5) for i in range(n)],
+    })
+
+
+@pytest.fixture
+def paths(tmp_path):
+    """Build offline (como build-index) de 60 productos: store, índice plano, embeddings, BM25 y manifest."""
+    df = _products(60)
+    p = {
+        "index": str(tmp_path / "faiss.index"),
+        "store": str(tmp_path / "product_store"),
+        "embeddings": str(tmp_path / "embeddings.npy"),
+        "lexical": str(tmp_path / "lexical.npz"),
+        "manifest": str(tmp_path / "manifest.json"),
+        "deltas": str(tmp_path / "deltas"),
+    }
+    store = ProductStore.from_dataframe(df)
+    store.save(p["store"])
+    vectors = BagOfWordsEmbedder().encode(embedding_texts(df))
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(DIM)
+    index.add(vectors)
+    faiss.write_index(index, p["index"])
+    np.save(p["embeddings"], vectors)
+    LexicalIndex.build_from_store(store).save(p["lexical"])
+    write_json_atomic(p["manifest"], {"model_name": MODEL, "dim": DIM, "num_rows": len(df), "index_type": "flat"})
+    return p
+
+
+def make_retriever(paths, **kwargs) -> Retriever:
+    r = Retriever(paths["index"], "", MODEL, product_store_dir=paths["store"], manifest_path=paths["manifest"],
+                  embeddings_path=paths["embeddings"], lexical_index_path=paths["lexical"],
+                  **{"exact_rescore": True, **kwargs})
+    r.embedding_model = BagOfWordsEmbedder()
+    r.load_store()
+    r.load_index()
+    r.finalize()
+    return r
+
+
+def make_catalog(retriever, **kwargs) -> LiveCatalog:
+    # umbrales altos: las compactaciones las lanza cada test
+    kwargs = {"compact_tombstone_ratio": 10.0, "compact_delta_rows": 0, "poll_s": 0, **kwargs}
+    catalog = LiveCatalog(retriever, **kwargs)
+    catalog.start()
+    return catalog
+
+
+def search_ids(retriever, query, mode, top_k=10, filters=None):
+    with retriever.pinned():
+        idxs, _ = retriever.retrieve(query, top_k, mode=mode, filters=filters)
+        return [p["product_id"] for p in retriever.get_products(idxs)]
+
+
+def product(pid, name, description="brand new", product_class="Sofas"):
+    return {"product_id": pid, "product_name": name, "product_description": description,
+            "product_class": product_class, "category hierarchy": f"Furniture / {product_class}",
+            "average_rating": "5"}
+
+
+def test_upsert_new_product_is_searchable(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    result = catalog.upsert([product("N1", "zebra lamp", "striped zebra lamp")])
+    assert result["upserted"] == 1 and result["delta_rows"] == 1
+    assert r.store.row_of("N1") == 60
+    for mode in MODES:
+        assert search_ids(r, "zebra lamp", mode)[0] == "N1"
+
+
+def test_upsert_existing_product_replaces_it(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    catalog.upsert([product("4", "zebra lamp")])
+    view = r.view
+    assert view.deleted[4] and view.num_deleted == 1
+    assert r.store.row_of("4") == 60
+    assert r.get_product(r.store.row_of("4"))["product_name"] == "zebra lamp"
+    for mode in MODES:
+        ids = search_ids(r, "item4 sofas model4 zebra lamp", mode, top_k=60)
+        assert ids.count("4") == 1
+
+
+def test_delete_hides_product_in_every_mode(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    catalog.upsert([product("N1", "zebra lamp")])
+    result = catalog.delete(["1", "N1", "missing"])
+    assert result["deleted"] == 2 and result["unknown_deletes"] == 1
+    assert r.store.row_of("1") is None and r.store.row_of("N1") is None
+    for mode in MODES:
+        assert "1" not in search_ids(r, "item1 chairs model1", mode, top_k=60)
+        assert "N1" not in search_ids(r, "zebra lamp", mode, top_k=60)
+        assert "1" not in search_ids(r, "item1 chairs model1", mode, top_k=60,
+                                     filters=ProductFilter(product_class="chairs"))
+
+
+def test_batches_append_to_the_delta(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    catalog.upsert([product("N1", "zebra lamp"), product("N2", "tiger rug")])
+    old_view = r.view
+    delta = old_view.delta
+    catalog.upsert([product("N1", "zebra lamp v2"), product("N3", "lion chair")])
+    catalog.delete(["N2"])
+    view = r.view
+    # mismo segmento: las filas se añaden y el índice sólo conserva las vivas (N1 v2 y N3)
+    assert view.delta is delta and len(delta) == view.num_delta == 4
+    assert delta.index.ntotal == 2 and view.num_deleted == 2
+    # la vista anterior sigue viendo sólo sus dos filas
+    assert old_view.num_delta == 2 and old_view.store.row_of("N3") is None
+    assert old_view.store.row_of("N1") == 60 and view.store.row_of("N1") == 62
+    with pinned_view(old_view):
+        idxs, _ = r.retrieve("lion chair", 60, mode="dense")
+        assert 63 not in idxs
+    for mode in MODES:
+        assert search_ids(r, "lion chair", mode)[0] == "N3"
+        assert "N2" not in search_ids(r, "tiger rug", mode, top_k=60)
+
+
+@pytest.mark.parametrize("brute_force_max_rows", [0, 5000])
+def test_filters_cover_the_delta(paths, brute_force_max_rows):
+    # 0 -> búsqueda ANN con selector; 5000 -> fuerza bruta sobre el subconjunto filtrado
+    r = make_retriever(paths, filter_brute_force_max_rows=brute_force_max_rows)
+    catalog = make_catalog(r)
+    catalog.upsert([product("N1", "zebra lamp", product_class="Beds"), product("N2", "zebra lamp deluxe")])
+    beds = ProductFilter(product_class="beds")
+    for mode in MODES:
+        ids = search_ids(r, "zebra lamp", mode, filters=beds)
+        assert "N1" in ids and "N2" not in ids
+        assert all(r.store.get(r.store.row_of(pid)) for pid in ids)
+    packed, count = r.view.filter_bitmap(beds)
+    assert count == 21  # 20 camas de la base + N1
+    catalog.delete(["N1"])
+    assert r.view.filter_bitmap(beds)[1] == 20
+    for mode in MODES:
+        assert "N1" not in search_ids(r, "zebra lamp", mode, filters=beds)
+
+
+def test_compaction_renumbers_live_rows(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    products = [product(f"P{i}", f"reupserted thing{i}") for i in range(20)]
+    for _ in range(3):
+        catalog.upsert(products)
+    catalog.delete(["0"])
+    assert r.view.num_rows == 60 + 60 and r.view.num_deleted == 41
+
+    result = catalog.compact(persist=False)
+    assert result["status"] == "done" and result["removed_rows"] == 41
+    view = r.view
+    assert view.num_rows == view.num_base == 79 and view.num_deleted == 0
+    assert view.index.ntotal == len(view.base_store) == len(view.vectors) == view.lexical.num_docs == 79
+    assert r.store.row_of("0") is None
+    assert r.get_product(r.store.row_of("P7"))["product_name"] == "reupserted thing7"
+    for mode in MODES:
+        assert search_ids(r, "reupserted thing7", mode)[0] == "P7"
+
+
+def test_in_flight_request_keeps_its_view_across_compaction(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    for _ in range(2):
+        catalog.upsert([product(f"P{i}", f"reupserted thing{i}") for i in range(20)])
+    with r.pinned():
+        idxs, _ = r.retrieve("reupserted thing3", 5, mode="hybrid")
+        before = [p["product_id"] for p in r.get_products(idxs)]
+        catalog.compact(persist=False)
+        assert [p["product_id"] for p in r.get_products(idxs)] == before
+    assert before[0] == "P3"
+
+
+def test_batches_applied_during_compaction_survive(paths, monkeypatch):
+    r = make_retriever(paths)
+    catalog = make_catalog(r)
+    catalog.upsert([product("P1", "first thing")])
+    build = catalog.index_builder
+
+    def build_and_write(vectors):
+        # un lote llega mientras se construye la base nueva
+        catalog.upsert([product("LATE", "late arrival"), product("P1", "first thing updated")])
+        catalog.delete(["2"])
+        return build(vectors)
+
+    monkeypatch.setattr(catalog, "index_builder", build_and_write)
+    catalog.compact(persist=False)
+    view = r.view
+    assert view.num_base == 61 and view.num_delta == 2
+    assert r.store.row_of("2") is None and view.deleted[2]
+    assert r.get_product(r.store.row_of("P1"))["product_name"] == "first thing updated"
+    for mode in MODES:
+        assert search_ids(r, "late arrival", mode)[0] == "LATE"
+        assert "2" not in search_ids(r, "item2 beds model2", mode, top_k=60)
+
+
+def _pq_index(vectors):
+    # índice con pérdida: reconstruct() sólo devuelve la aproximación PQ
+    index = faiss.index_factory(DIM, "PQ8x4", faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def _use_pq_index(paths):
+    vectors = np.load(paths["embeddings"])
+    faiss.write_index(_pq_index(vectors), paths["index"])
+    return vectors
+
+
+def test_lossy_index_compacts_from_the_original_vectors(paths):
+    vectors = _use_pq_index(paths)
+    r = make_retriever(paths, exact_rescore=False)
+    assert r.view.vectors is None
+    catalog = make_catalog(r, index_builder=_pq_index)
+    catalog.upsert([product("N1", "zebra lamp")])
+    catalog.delete(["0"])
+    assert catalog.compact(persist=False)["status"] == "done"
+    view = r.view
+    np.testing.assert_array_equal(view.originals[:59], vectors[1:])
+    # la base nueva sólo vive en memoria: conserva sus vectores para la siguiente compactación
+    catalog.delete(["1"])
+    assert catalog.compact(persist=False)["status"] == "done"
+    np.testing.assert_array_equal(r.view.originals[:58], vectors[2:])
+
+
+def test_lossy_index_without_original_vectors_is_not_compacted(paths):
+    _use_pq_index(paths)
+    os.remove(paths["embeddings"])
+    r = make_retriever(paths, exact_rescore=False)
+    catalog = make_catalog(r)
+    catalog.delete(["0"])
+    result = catalog.compact(persist=False)
+    assert result == {"status": "skipped", "reason": "original vectors not available for a lossy index"}
+    assert r.view.num_deleted == 1
+
+
+def test_restart_starts_from_persisted_watermark(paths):
+    r = make_retriever(paths)
+    catalog = make_catalog(r, delta_dir=paths["deltas"], persist=True)
+    catalog.upsert([product(f"P{i}", f"thing{i}") for i in range(5)])
+    catalog.delete(["3"])
+    result = catalog.compact()
+    assert result["persisted"] is True
+    manifest = json.load(open(paths["manifest"]))
+    assert manifest["num_rows"] == 64 and manifest["catalog_watermark"] == r.view.watermark
+    catalog.upsert([product("AFTER", "after the compaction")])
+
+    restarted = make_retriever(paths)
+    assert restarted.view.num_rows == 64
+    make_catalog(restarted, delta_dir=paths["deltas"])
+    # sólo se re-aplica el lote posterior a la compactación
+    assert restarted.view.num_delta == 1 and restarted.view.num_deleted == 0
+    assert restarted.store.row_of("3") is None
+    for mode in MODES:
+        assert search_ids(restarted, "after the compaction", mode)[0] == "AFTER"
+        assert search_ids(restarted, "thing4", mode)[0] == "P4"
+
+
+def test_stale_base_is_reloaded_from_disk(paths):
+    follower = make_retriever(paths)  # p.ej. la base que precargó el padre prefork
+    leader = make_retriever(paths)
+    leader_catalog = make_catalog(leader, delta_dir=paths["deltas"], persist=True)
+    leader_catalog.upsert([product(f"P{i}", f"thing{i}") for i in range(5)])
+    leader_catalog.delete(["7"])
+    leader_catalog.compact()
+    assert isinstance(leader.view.vectors, np.memmap)  # el persistidor sirve los ficheros escritos
+    leader_catalog.upsert([product("AFTER", "after the compaction")])
+
+    follower_catalog = make_catalog(follower, delta_dir=paths["deltas"], follow_persisted=True)
+    assert follower_catalog.compact()["status"] == "skipped"
+    assert follower.view.num_base == leader.view.num_base == 64
+    assert follower.view.num_delta == 1 and follower.store.row_of("7") is None
+    for mode in MODES:
+        assert search_ids(follower, "after the compaction", mode) == search_ids(leader, "after the compaction", mode)
+
+
+def test_single_persister_is_elected_with_a_flock(paths):
+    first = make_catalog(make_retriever(paths), delta_dir=paths["deltas"], elect_persister=True)
+    second = make_catalog(make_retriever(paths), delta_dir=paths["deltas"], elect_persister=True)
+    assert (first.persist, first.follow_persisted) == (True, False)
+    assert (second.persist, second.follow_persisted) == (False, True)
+    # el persistidor se va: el siguiente poll de otro proceso toma el relevo
+    first.stop()
+    second.poll()
+    assert (second.persist, second.follow_persisted) == (True, False)
+    second.stop()
@@ -0,0 +1,125 @@
+# tests/test_evaluation.py
+"""Qrels + ranking_metrics (vectorizado) contra las funciones por query del notebook de evaluación."""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.evaluation import Qrels, bootstrap_paired_diff, ranking_metrics
+
+K, EXACT_W, PARTIAL_W = 10, 1.0, 0.5
+
+
+# --- funciones del notebook (AIEngineer_retrieval_assignment_JuanCamarena.ipynb), tal cual ---
+
+def nb_map_at_k(true_ids, predicted_ids, k=10):
+    if not len(true_ids) or not len(predicted_ids):
+        return 0.0
+    score = 0.0
+    num_hits = 0.0
+    for i, p_id in enumerate(predicted_ids[:k]):
+        if p_id in true_ids and p_id not in predicted_ids[:i]:
+            num_hits += 1.0
+            score += num_hits / (i + 1.0)
+    return score / min(len(true_ids), k)
+
+
+def nb_dcg_from_scores(rels):
+    return sum((2**r - 1) / math.log2(i + 2) for i, r in enumerate(rels))
+
+
+def nb_ndcg_at_k_from_relevance_list(relevance_list, k=10):
+    dcg = nb_dcg_from_scores(relevance_list[:k])
+    idcg = nb_dcg_from_scores(sorted(relevance_list, reverse=True)[:k])
+    return dcg / idcg if idcg > 0 else 0.0
+
+
+def nb_precision_at_k(predicted_ids, relevant_set, k=10):
+    return sum(1 for pid in predicted_ids[:k] if pid in relevant_set) / k
+
+
+def nb_recall_at_k(predicted_ids, relevant_set, k=10):
+    return sum(1 for pid in predicted_ids[:k] if pid in relevant_set) / max(1, len(relevant_set))
+
+
+def nb_weighted_map_at_k(relevance_dict, predicted_ids, k=10):
+    if not relevance_dict or not predicted_ids:
+        return 0.0
+    cum_gain = 0.0
+    score = 0.0
+    total_possible = sum(relevance_dict.values())
+    for i, pid in enumerate(predicted_ids[:k], start=1):
+        rel = relevance_dict.get(pid, 0.0)
+        if rel > 0:
+            cum_gain += rel
+            score += cum_gain / i
+    return score / min(total_possible, k) if total_possible > 0 else 0.0
+
+
+def nb_metrics(labels: pd.DataFrame, query_id, predicted_ids):
+    """Cuerpo del bucle de evaluate_pipeline para una query."""
+    group = labels[labels["query_id"] == query_id]
+    exact_set = set(group.loc[group["label"] == "Exact", "product_id"])
+    partial_set = set(group.loc[group["label"] == "Partial", "product_id"])
+    relevance_dict = {pid: EXACT_W for pid in exact_set}
+    for pid in partial_set:
+        if pid not in relevance_dict:
+            relevance_dict[pid] = PARTIAL_W
+    rel_list = [relevance_dict.get(pid, 0.0) for pid in predicted_ids]
+    return {
+        f"map@{K}": nb_map_at_k(list(exact_set), predicted_ids, k=K),
+        f"weighted_map@{K}": nb_weighted_map_at_k(relevance_dict, predicted_ids, k=K),
+        f"ndcg@{K}": nb_ndcg_at_k_from_relevance_list(rel_list, k=K),
+        f"precision@{K}": nb_precision_at_k(predicted_ids, exact_set, k=K),
+        f"recall@{K}": nb_recall_at_k(predicted_ids, exact_set, k=K),
+    }
+
+
+def _random_case(n_queries=40, n_products=80, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for q in range(n_queries):
+        for pid in rng.choice(n_products, size=rng.integers(0, 30), replace=False):
+            rows.append((q, str(pid), rng.choice(["Exact", "Partial", "Irrelevant"], p=[0.3, 0.3, 0.4])))
+    # par etiquetado Exact y Partial a la vez: gana Exact
+    rows += [(0, "5", "Partial"), (0, "5", "Exact")]
+    labels = pd.DataFrame(rows, columns=["query_id", "product_id", "label"])
+    # rankings sin repetidos; algunos más cortos que k
+    predicted = [[str(p) for p in rng.choice(n_products, size=rng.integers(1, K + 1), replace=False)]
+                 for _ in range(n_queries)]
+    predicted[0] = ["5"] + [p for p in predicted[0] if p != "5"][:K - 1]
+    return labels, list(range(n_queries)), predicted
+
+
+def test_ranking_metrics_match_notebook():
+    labels, query_ids, predicted = _random_case()
+    qrels = Qrels(labels, exact_w=EXACT_W, partial_w=PARTIAL_W)
+    per_query = ranking_metrics(qrels.matrices(query_ids, predicted, K), K)
+    for name, values in per_query.items():
+        expected = [nb_metrics(labels, q, ids)[name] for q, ids in zip(query_ids, predicted)]
+        np.testing.assert_allclose(values, expected, atol=1e-12, err_msg=name)
+
+
+def test_exact_wins_over_partial():
+    labels, query_ids, predicted = _random_case()
+    m = Qrels(labels, exact_w=EXACT_W, partial_w=PARTIAL_W).matrices(query_ids[:1], predicted[:1], K)
+    assert m["binary"][0, 0] == 1.0 and m["gains"][0, 0] == EXACT_W
+
+
+def test_unknown_query_and_empty_ranking_score_zero():
+    labels = pd.DataFrame([(1, "a", "Exact")], columns=["query_id", "product_id", "label"])
+    m = Qrels(labels).matrices([1, 99], [[], ["a"]], K)
+    assert m["binary"].shape == (2, K)
+    for values in ranking_metrics(m, K).values():
+        np.testing.assert_array_equal(values, [0.0, 0.0])
+
+
+def test_bootstrap_paired_diff():
+    rng = np.random.default_rng(0)
+    a = rng.uniform(0.5, 1.0, 200)
+    b = a - 0.1 + rng.normal(0, 0.05, 200)
+    result = bootstrap_paired_diff(a, b)
+    assert result["mean_diff"] == pytest.approx(np.mean(a - b), abs=0.01)
+    assert 0.0 < result["ci95_low"] < result["mean_diff"] < result["ci95_high"] and result["p_value"] == 0.0
+    assert bootstrap_paired_diff([], [])["n"] == 0
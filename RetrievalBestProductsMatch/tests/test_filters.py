@@ -0,0 +1,65 @@
+# tests/test_filters.py
+"""MetadataIndex / ProductFilter sobre un ProductStore pequeño y el 400 de la API para filtros no disponibles."""
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.models.filters import MetadataIndex, ProductFilter
+from app.models.product_store import ProductStore
+from app.schemas import SearchRequest
+
+
+def _store(**extra):
+    columns = {
+        "product_id": ["1", "2", "3", "4"],
+        "product_name": ["a", "b", "c", "d"],
+        "product_description": ["", "", "", ""],
+        "rerank_text": ["a - ", "b - ", "c - ", "d - "],
+        "product_class": ["Sofas", "Beds", "sofas ", ""],
+        "category hierarchy": ["Furniture / Sofas", "Furniture / Beds", "Furniture/Sofas", ""],
+    }
+    columns.update(extra)
+    return ProductStore.from_columns(columns)
+
+
+def _rows(index, **filters):
+    packed, count = index.bitmap(ProductFilter(**filters))
+    rows = index.rows(packed)
+    assert count == len(rows)
+    return rows.tolist()
+
+
+def test_class_and_category_bitmaps():
+    index = MetadataIndex.from_store(_store())
+    assert _rows(index, product_class="SOFAS") == [0, 2]
+    assert _rows(index, category="furniture") == [0, 1, 2]
+    assert _rows(index, category="Furniture / Sofas", product_class="sofas") == [0, 2]
+    assert _rows(index, product_class="lamps") == []
+
+
+def test_range_on_a_missing_column_is_rejected():
+    index = MetadataIndex.from_store(_store())
+    index.validate(ProductFilter(product_class="sofas"))
+    with pytest.raises(ValueError, match="average_rating"):
+        index.validate(ProductFilter(min_rating=3))
+    with pytest.raises(ValueError):
+        index.bitmap(ProductFilter(min_rating=3))
+
+
+def test_search_kwargs_returns_400_for_a_missing_rating_column(monkeypatch):
+    import main
+    monkeypatch.setattr(main.retriever, "metadata", MetadataIndex.from_store(_store()))
+    req = SearchRequest(query="sofa", filters={"product_class": "sofas"})
+    assert main._search_kwargs(req)["filters"] == ProductFilter(product_class="sofas")
+    with pytest.raises(HTTPException) as e:
+        main._search_kwargs(SearchRequest(query="sofa", filters={"min_rating": 4}))
+    assert e.value.status_code == 400 and "average_rating" in e.value.detail
+
+
+def test_non_numeric_ratings_become_missing_values():
+    store = _store(average_rating=["4.5", "N/A", "", " 2 "], review_count=["10", "many", "3", "0"])
+    index = MetadataIndex.from_store(store)
+    np.testing.assert_array_equal(index.numeric["average_rating"], np.array([4.5, np.nan, np.nan, 2.0], dtype=np.float32))
+    assert _rows(index, min_rating=1) == [0, 3]
+    assert _rows(index, max_rating=3) == [3]
+    assert _rows(index, min_review_count=1) == [0, 2]
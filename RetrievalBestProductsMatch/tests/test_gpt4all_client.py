@@ -0,0 +1,111 @@
+# tests/test_gpt4all_client.py
+"""GPT4AllClient estructurado: prefijo cacheado con los internals de gpt4all 2.8 y fallback a generate()."""
+import contextlib
+
+import pytest
+
+from app.clients import gpt4all_client
+from app.clients.gpt4all_client import GPT4AllClient
+
+ANSWER = ['{"best_product_id": 7, ', '"reasons": ["fits"], ', '"top_candidates": []}', " and some prose", " more"]
+
+
+class StubContext:
+    def __init__(self):
+        self.n_past = 0
+
+
+class StubLLModel:
+    """LLModel de prueba con la firma de prompt_model de gpt4all 2.8; cada prompt suma 10 tokens a n_past."""
+    def __init__(self):
+        self.context = StubContext()
+        self.prefix_ingests = 0
+        self.n_past_at_prompt = []
+        self.tokens_emitted = 0
+
+    def prompt_model(self, prompt, prompt_template, callback, n_predict=4096, temp=0.1,
+                     reset_context=False, special=False):
+        if reset_context:
+            self.context.n_past = 0
+            self.prefix_ingests += 1
+        else:
+            self.n_past_at_prompt.append(self.context.n_past)
+        self.context.n_past += 10
+        for token in ANSWER[:n_predict]:
+            self.tokens_emitted += 1
+            self.context.n_past += 1
+            if not callback(0, token):
+                break
+
+
+class OldLLModel:
+    """LLModel con otra firma de prompt_model (sin reset_context / special)."""
+    context = StubContext()
+
+    def prompt_model(self, prompt, callback, n_predict=4096):
+        raise AssertionError("prompt_model should not be used without the expected arguments")
+
+
+class StubGPT4All:
+    """GPT4All de prueba: generate() con callback dentro de chat_session, como el SDK."""
+    def __init__(self, model):
+        self.model = model
+        self.config = {"promptTemplate": "{0}{1}"}
+        self.generate_calls = 0
+        self.system_prompts = []
+
+    @contextlib.contextmanager
+    def chat_session(self, system_prompt=None):
+        self.system_prompts.append(system_prompt)
+        yield
+
+    def generate(self, prompt, max_tokens=200, temp=0.7, callback=None, streaming=False):
+        self.generate_calls += 1
+        for token in ANSWER[:max_tokens]:
+            if callback is not None and not callback(0, token):
+                break
+
+
+@pytest.fixture(autouse=True)
+def pinned_version(monkeypatch):
+    monkeypatch.setattr(gpt4all_client, "_gpt4all_version", lambda: "2.8.2")
+
+
+def test_prefix_is_ingested_once_and_rewound():
+    model = StubLLModel()
+    gpt = StubGPT4All(model)
+    client = GPT4AllClient(gpt)
+    first = client.generate_answer("sofa", "id=7 red sofa")
+    second = client.generate_answer("sofa", "id=7 red sofa")
+    assert first == second == {"best_product_id": 7, "reasons": ["fits"], "top_candidates": []}
+    assert model.prefix_ingests == 1 and gpt.generate_calls == 0
+    # cada llamada empieza justo al final del prefijo, sin los tokens de la anterior
+    assert model.n_past_at_prompt == [10, 10]
+    # se corta al cerrarse el JSON: la prosa posterior no se genera
+    assert model.tokens_emitted == 2 * 3
+
+
+def test_falls_back_to_generate_without_the_internals():
+    gpt = StubGPT4All(OldLLModel())
+    client = GPT4AllClient(gpt)
+    assert client.generate_answer("sofa", "id=7 red sofa")["best_product_id"] == 7
+    assert client.generate_answer("sofa", "id=7 red sofa")["best_product_id"] == 7
+    assert gpt.generate_calls == 2
+    assert gpt.system_prompts == [gpt4all_client.STRUCTURED_SYSTEM_PROMPT] * 2
+
+
+def test_falls_back_to_generate_on_other_versions(monkeypatch):
+    monkeypatch.setattr(gpt4all_client, "_gpt4all_version", lambda: "3.4.0")
+    model = StubLLModel()
+    gpt = StubGPT4All(model)
+    assert GPT4AllClient(gpt).generate_answer("sofa", "id=7 red sofa")["best_product_id"] == 7
+    assert model.prefix_ingests == 0 and gpt.generate_calls == 1
+
+
+def test_falls_back_when_the_rewind_fails():
+    model = StubLLModel()
+    model.context = None  # sin contexto tras ingerir el prefijo: n_past no existe
+    gpt = StubGPT4All(model)
+    client = GPT4AllClient(gpt)
+    assert client.generate_answer("sofa", "id=7 red sofa")["best_product_id"] == 7
+    assert gpt.generate_calls == 1 and client._prefix_reuse is False
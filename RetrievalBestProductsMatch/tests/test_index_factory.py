@@ -0,0 +1,127 @@
+# tests/test_index_factory.py
+"""factory_string, build_index y search_parameters (nprobe / efSearch / selector) con y sin wrappers IDMap / OPQ."""
+import faiss
+import numpy as np
+import pytest
+
+from app.models.index_factory import (bitmap_selector, build_index, factory_string, reconstructs_exactly,
+                                      search_parameters, unwrap_index)
+
+D = 16
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    x = np.random.default_rng(0).normal(size=(2000, D)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _id_mapped(vectors, index_type, ids=None, **kwargs):
+    """IndexIDMap2 sobre la misma cadena de factory_string (IndexIDMap exige un índice vacío al envolverlo)."""
+    spec = factory_string(index_type, len(vectors), nlist=16, pq_m=4, pq_nbits=4, **kwargs)
+    index = faiss.index_factory(D, f"IDMap2,{spec}", faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64") if ids is None else ids)
+    return index
+
+
+@pytest.mark.parametrize("index_type, expected", [
+    ("flat", "Flat"),
+    ("ivf_flat", "IVF32,Flat"),
+    ("hnsw", "HNSW16,Flat"),
+    ("ivf_pq", "IVF32,PQ4x8"),
+    ("opq_ivf_pq", "OPQ4,IVF32,PQ4x8"),
+])
+def test_factory_string(index_type, expected):
+    assert factory_string(index_type, 100000, nlist=32, pq_m=4, hnsw_m=16) == expected
+
+
+def test_factory_string_caps_nlist_by_training_points():
+    assert factory_string("ivf_flat", 39 * 10, nlist=1024) == "IVF10,Flat"
+    assert factory_string("ivf_flat", 5, nlist=1024) == "IVF1,Flat"
+    with pytest.raises(ValueError, match="Unknown index type"):
+        factory_string("ivf_sq8", 1000)
+
+
+@pytest.mark.parametrize("index_type, inner, exact", [
+    ("flat", faiss.IndexFlat, True),
+    ("ivf_flat", faiss.IndexIVFFlat, True),
+    ("hnsw", faiss.IndexHNSW, True),
+    ("ivf_pq", faiss.IndexIVFPQ, False),
+    ("opq_ivf_pq", faiss.IndexIVFPQ, False),
+])
+def test_build_index(vectors, index_type, inner, exact):
+    index = build_index(vectors, index_type=index_type, nlist=16, pq_m=4, pq_nbits=4, hnsw_m=8,
+                        ef_construction=40, train_size=1000, add_batch_size=512)
+    assert index.ntotal == len(vectors) and index.is_trained
+    assert index.metric_type == faiss.METRIC_INNER_PRODUCT
+    assert isinstance(unwrap_index(index), inner)
+    assert isinstance(index, faiss.IndexPreTransform) == (index_type == "opq_ivf_pq")
+    assert reconstructs_exactly(index) == exact
+    if index_type == "hnsw":
+        assert unwrap_index(index).hnsw.efConstruction == 40
+    # cada vector es su propio vecino más cercano (salvo aproximación de PQ)
+    params = search_parameters(index, nprobe=16, ef_search=64)
+    _, ids = index.search(vectors[:50], 1, params=params)
+    assert (ids[:, 0] == np.arange(50)).mean() >= (1.0 if exact else 0.5)
+
+
+def _nprobe(params):
+    if isinstance(params, faiss.SearchParametersPreTransform):
+        params = params.referenced_objects[0]
+    return params.nprobe
+
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "opq_ivf_pq"])
+@pytest.mark.parametrize("id_map", [False, True])
+def test_nprobe_through_wrappers(vectors, index_type, id_map):
+    if id_map:
+        index = _id_mapped(vectors, index_type)
+    else:
+        index = build_index(vectors, index_type=index_type, nlist=16, pq_m=4, pq_nbits=4, train_size=1000)
+    unwrap_index(index).nprobe = 3
+    wrapped = isinstance(faiss.downcast_index(index.index) if id_map else index, faiss.IndexPreTransform)
+    for nprobe, expected in [(None, 3), (9, 9)]:
+        params = search_parameters(index, nprobe=nprobe)
+        assert isinstance(params, faiss.SearchParametersPreTransform) == wrapped
+        assert _nprobe(params) == expected
+    # el índice compartido no cambia
+    assert unwrap_index(index).nprobe == 3
+
+
+def test_nprobe_changes_the_search_not_the_index(vectors):
+    flat = build_index(vectors)
+    index = _id_mapped(vectors, "ivf_flat")
+    unwrap_index(index).nprobe = 1
+    queries = vectors[::97] + 0.3
+    _, expected = flat.search(queries, 5)
+    _, probed = index.search(queries, 5, params=search_parameters(index, nprobe=16))
+    _, default = index.search(queries, 5)
+    np.testing.assert_array_equal(probed, expected)
+    assert (default != expected).any()
+
+
+def test_ef_search_on_hnsw(vectors):
+    index = _id_mapped(vectors, "hnsw", hnsw_m=8)
+    unwrap_index(index).hnsw.efSearch = 12
+    assert search_parameters(index).efSearch == 12
+    assert search_parameters(index, ef_search=80).efSearch == 80
+    assert unwrap_index(index).hnsw.efSearch == 12
+
+
+def test_flat_needs_no_parameters_without_a_selector(vectors):
+    assert search_parameters(build_index(vectors)) is None
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "opq_ivf_pq"])
+def test_selector_uses_external_ids_under_id_map(vectors, index_type):
+    # ids externos desplazados: el selector (por id externo) no coincide con las posiciones internas
+    external = np.arange(len(vectors), dtype="int64") + 10000
+    index = _id_mapped(vectors, index_type, ids=external)
+    allowed = np.zeros(10000 + len(vectors), dtype=bool)
+    allowed[external[::7]] = True
+    packed = np.packbits(allowed, bitorder="little")
+    params = search_parameters(index, nprobe=16, sel=bitmap_selector(packed))
+    _, ids = index.search(vectors[:20], 5, params=params)
+    found = ids[ids >= 0]
+    assert len(found) and allowed[found].all()
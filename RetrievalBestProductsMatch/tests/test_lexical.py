@@ -0,0 +1,116 @@
+# tests/test_lexical.py
+"""LexicalIndex.search (MaxScore) y DeltaLexicalIndex contra BM25 por fuerza bruta sobre todos los documentos."""
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from app.models.lexical import DeltaLexicalIndex, LexicalIndex, reciprocal_rank_fusion, tokenize
+
+K1, B = 1.2, 0.75
+
+
+def _corpus(n_docs: int = 400, vocab: int = 60, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # frecuencias tipo Zipf: términos muy comunes y términos raros, como en un catálogo real
+    probs = 1.0 / np.arange(1, vocab + 1)
+    probs /= probs.sum()
+    words = [f"w{i}" for i in range(vocab)]
+    return [" ".join(rng.choice(words, size=rng.integers(3, 25), p=probs)) for _ in range(n_docs)]
+
+
+def brute_force_bm25(texts, query, reference=()):
+    """reference: documentos que sólo cuentan para el idf (la base de un delta)."""
+    docs = [Counter(tokenize(t)) for t in texts]
+    n = len(docs)
+    avgdl = sum(sum(d.values()) for d in docs) / n
+    df = Counter(term for d in docs for term in d)
+    ref_df = Counter(term for t in reference for term in set(tokenize(t)))
+    scores = np.zeros(n)
+    for term, qtf in Counter(tokenize(query)).items():
+        if term not in df:
+            continue
+        total_df = df[term] + ref_df[term]
+        idf = math.log1p((n + len(reference) - total_df + 0.5) / (total_df + 0.5))
+        for i, d in enumerate(docs):
+            tf = d.get(term, 0)
+            if tf:
+                dl = sum(d.values())
+                scores[i] += qtf * idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avgdl))
+    return scores
+
+
+def _check_topk(index, texts, query, top_k, mask=None, reference=(), **kwargs):
+    ids, scores = index.search(query, top_k, mask=mask, **kwargs)
+    expected = brute_force_bm25(texts, query, reference)
+    if mask is not None:
+        expected[~mask] = 0.0
+    positive = np.flatnonzero(expected > 0)
+    k = min(top_k, len(positive))
+    assert len(ids) == k
+    # mismos scores que la fuerza bruta, en orden descendente (los empates pueden cambiar el id)
+    np.testing.assert_allclose(scores, np.sort(expected[positive])[::-1][:k], rtol=1e-4)
+    np.testing.assert_allclose(scores, expected[ids], rtol=1e-4)
+
+
+@pytest.mark.parametrize("query", ["w0", "w1 w2", "w0 w5 w30 w59", "w3 w3 w40", "w10 w11 w12 w13 w14 w15"])
+@pytest.mark.parametrize("top_k", [1, 5, 50])
+def test_maxscore_matches_brute_force(query, top_k):
+    texts = _corpus()
+    _check_topk(LexicalIndex.build(texts, k1=K1, b=B), texts, query, top_k)
+
+
+def test_maxscore_with_mask_matches_brute_force():
+    texts = _corpus(seed=1)
+    index = LexicalIndex.build(texts, k1=K1, b=B)
+    mask = np.random.default_rng(2).random(len(texts)) < 0.3
+    for query in ["w0 w1", "w2 w45 w7", "w58"]:
+        _check_topk(index, texts, query, 10, mask=mask)
+
+
+def test_unknown_terms_and_empty_mask():
+    texts = _corpus(n_docs=50)
+    index = LexicalIndex.build(texts)
+    assert index.search("nothing matches", 10) == ([], [])
+    assert index.search("w0", 10, mask=np.zeros(len(texts), dtype=bool)) == ([], [])
+
+
+def test_save_load_roundtrip(tmp_path):
+    texts = _corpus(n_docs=100)
+    index = LexicalIndex.build(texts)
+    path = str(tmp_path / "lexical.npz")
+    index.save(path)
+    assert LexicalIndex.load(path).search("w1 w8", 10) == index.search("w1 w8", 10)
+
+
+def _delta_index(texts, batch=37, reference=None):
+    index = DeltaLexicalIndex(reference=reference, k1=K1, b=B)
+    for start in range(0, len(texts), batch):
+        index.add(texts[start:start + batch])
+    return index
+
+
+@pytest.mark.parametrize("query", ["w0", "w1 w2", "w3 w3 w40"])
+def test_delta_index_matches_brute_force(query):
+    texts = _corpus(n_docs=150, seed=3)
+    mask = np.random.default_rng(4).random(len(texts)) < 0.5
+    index = _delta_index(texts)
+    _check_topk(index, texts, query, 10)
+    _check_topk(index, texts, query, 10, mask=mask)
+    # una vista anterior sólo ve los primeros num_docs documentos
+    _check_topk(index, texts[:100], query, 10, num_docs=100)
+
+
+def test_delta_index_idf_includes_the_reference():
+    base, delta = _corpus(n_docs=300, seed=5), _corpus(n_docs=40, seed=6)
+    index = _delta_index(delta, reference=LexicalIndex.build(base, k1=K1, b=B))
+    for query in ["w0 w1", "w20 w7"]:
+        _check_topk(index, delta, query, 10, reference=base)
+    assert index.search("nothing matches", 10) == ([], [])
+
+
+def test_reciprocal_rank_fusion():
+    docs, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60, top_k=2)
+    assert docs == [1, 3]
+    assert scores[0] == pytest.approx(1 / 61 + 1 / 62)
@@ -0,0 +1,53 @@
+# tests/test_llm_json.py
+"""IncrementalJSONParser: el objeto se detecta en el trozo en que se cierra, llegue como llegue el texto."""
+import json
+
+import pytest
+
+from app.clients.llm_base import IncrementalJSONParser, extract_json_from_text
+
+ANSWER = {"answer": "Try the {blue} sofa \"Oslo\"", "product_ids": ["12", "7"]}
+
+
+def feed_chunks(parser, text, size):
+    for start in range(0, len(text), size):
+        result = parser.feed(text[start:start + size])
+        if result is not None:
+            return result, start + size
+    return None, len(text)
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_detects_object_when_it_closes(size):
+    prefix = "Sure! Here is the answer:\n```json\n"
+    payload = json.dumps(ANSWER)
+    text = prefix + payload + "\n```\nHope it helps {"
+    parser = IncrementalJSONParser()
+    result, consumed = feed_chunks(parser, text, size)
+    assert result == ANSWER and parser.done
+    assert parser.end == len(prefix) + len(payload)
+    # se detecta en el mismo trozo que contiene la llave de cierre
+    assert consumed - size < parser.end <= consumed
+
+
+def test_braces_and_escaped_quotes_inside_strings():
+    obj = {"answer": "a } b { c \\\" d", "nested": {"x": [1, {"y": "}"}]}}
+    parser = IncrementalJSONParser()
+    result, _ = feed_chunks(parser, "prose " + json.dumps(obj) + " tail", 2)
+    assert result == obj
+
+
+def test_skips_invalid_and_rejected_objects():
+    accept = lambda obj: "answer" in obj  # noqa: E731
+    text = '{not json} {"other": 1} {"wrapper": {"answer": "inner"}} {"answer": "outer"}'
+    assert IncrementalJSONParser(accept).feed(text) == {"answer": "inner"}
+    assert IncrementalJSONParser().feed(text) == {"other": 1}
+
+
+def test_result_is_sticky_and_no_object_returns_none():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"answer": ') is None and not parser.done
+    assert parser.feed('"ok"}') == {"answer": "ok"}
+    assert parser.feed('{"answer": "later"}') == {"answer": "ok"}
+    assert extract_json_from_text("no json here") is None
+    assert extract_json_from_text('x ["list"] {"a": 1}') == {"a": 1}
@@ -0,0 +1,283 @@
+# tests/test_llm_pool.py
+"""LLMPool (cola acotada, timeout, cancelación) y el SSE de /rag/stream con FakeLLMClient."""
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.clients.fake_llm import FakeLLMClient
+from app.clients.llm_pool import LLMPool, LLMTimeoutError
+from app.models.product_store import ProductStore
+from app.models.rag import RAGService
+from app.schemas import SearchRequest
+from app.utils.batching import QueueFullError
+
+CONTEXT = "product_id: 7\nname: red sofa\n\nproduct_id: 9\nname: oak table\n"
+
+
+class RecordingFakeLLM(FakeLLMClient):
+    """FakeLLMClient que cuenta los tokens entregados y guarda el cancel_event de cada llamada."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = 0
+        self.cancel_events = []
+
+    def stream_answer(self, query, context, max_tokens=1024, cancel_event=None):
+        self.cancel_events.append(cancel_event)
+        for token in super().stream_answer(query, context, max_tokens=max_tokens, cancel_event=cancel_event):
+            self.tokens += 1
+            yield token
+
+
+class BlockingClient:
+    """Cliente sin streaming: generate_answer bloquea hasta que el test lo libera."""
+    def __init__(self):
+        self.release = threading.Event()
+
+    def generate_answer(self, query, context):
+        self.release.wait(5)
+        return {"best_product_id": 7}
+
+
+class BrokenClient:
+    def stream_answer(self, query, context, max_tokens=1024, cancel_event=None):
+        yield '{"best'
+        raise RuntimeError("llama.cpp crashed")
+
+
+async def _until(predicate, timeout_s: float = 5.0):
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def _fast_llm(**kwargs):
+    return RecordingFakeLLM(**{"first_token_s": 0.0, "tokens_per_s": 0.0, "output_tokens": 0, **kwargs})
+
+
+def test_generate_returns_the_parsed_answer():
+    async def run():
+        pool = LLMPool([_fast_llm()])
+        try:
+            return await pool.generate("sofa", CONTEXT)
+        finally:
+            pool.shutdown()
+
+    result = asyncio.run(run())
+    assert json.loads(result["raw"])["best_product_id"] == 7
+
+
+def test_client_without_streaming_yields_its_dict():
+    client = BlockingClient()
+    client.release.set()
+
+    async def run():
+        pool = LLMPool([client])
+        try:
+            return [item async for item in pool.stream("sofa", CONTEXT)]
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(run()) == [{"best_product_id": 7}]
+
+
+def test_queue_limit_rejects_once_every_client_is_busy():
+    client = BlockingClient()
+
+    async def run():
+        pool = LLMPool([client], max_queue=1)
+        try:
+            busy = asyncio.ensure_future(pool.generate("a", CONTEXT))
+            await _until(lambda: pool.stats()["idle"] == 0)
+            waiting = asyncio.ensure_future(pool.generate("b", CONTEXT))
+            await _until(lambda: pool.stats()["waiting"] == 1)
+            assert pool.saturated()
+            with pytest.raises(QueueFullError):
+                await pool.generate("c", CONTEXT)
+            client.release.set()
+            results = await asyncio.gather(busy, waiting)
+            await _until(lambda: pool.stats()["idle"] == 1)
+            return results, pool.saturated()
+        finally:
+            pool.shutdown()
+
+    results, saturated = asyncio.run(run())
+    assert results == [{"best_product_id": 7}] * 2 and not saturated
+
+
+def test_timeout_cancels_the_generation_and_frees_the_client():
+    llm = RecordingFakeLLM(first_token_s=5.0, tokens_per_s=10.0)
+
+    async def run():
+        pool = LLMPool([llm], timeout_s=0.1)
+        try:
+            t0 = time.monotonic()
+            with pytest.raises(LLMTimeoutError):
+                await pool.generate("sofa", CONTEXT)
+            # el cliente vuelve al pool en cuanto su thread ve el cancel_event, no al cabo de 5s
+            await _until(lambda: pool.stats()["idle"] == 1, timeout_s=2.0)
+            return time.monotonic() - t0
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(run()) < 2.0
+    assert llm.tokens == 0 and llm.cancel_events[0].is_set()
+
+
+def test_closing_the_stream_cancels_the_generation():
+    llm = RecordingFakeLLM(first_token_s=0.0, tokens_per_s=50.0, output_tokens=200)
+
+    async def run():
+        pool = LLMPool([llm])
+        try:
+            stream = pool.stream("sofa", CONTEXT)
+            received = [await stream.__anext__() for _ in range(3)]
+            await stream.aclose()  # cliente desconectado
+            await _until(lambda: pool.stats()["idle"] == 1)
+            return received
+        finally:
+            pool.shutdown()
+
+    assert len(asyncio.run(run())) == 3
+    assert llm.cancel_events[0].is_set() and llm.tokens < 20
+
+
+def test_client_errors_propagate():
+    async def run():
+        pool = LLMPool([BrokenClient()])
+        try:
+            return [item async for item in pool.stream("sofa", CONTEXT)]
+        finally:
+            pool.shutdown()
+
+    with pytest.raises(RuntimeError, match="crashed"):
+        asyncio.run(run())
+
+
+# ---------------------------------------------------------------- /rag/stream
+
+class StubRetriever:
+    def __init__(self, n: int = 4):
+        ids = [str(100 + i) for i in range(n)]
+        self.store = ProductStore.from_columns({
+            "product_id": ids,
+            "product_name": [f"name {pid}" for pid in ids],
+            "product_description": [f"description of {pid}" for pid in ids],
+            "rerank_text": [f"name {pid} - description of {pid}" for pid in ids],
+        })
+
+    def encode(self, queries):
+        return np.full((len(queries), 4), 0.5, dtype=np.float32)
+
+    def get_products(self, idxs):
+        return self.store.get_many(idxs)
+
+    def get_product(self, idx):
+        return self.store.get(idx)
+
+
+class StubRequest:
+    """Request de Starlette mínima: is_disconnected() pasa a True tras `connected_for` comprobaciones."""
+    def __init__(self, connected_for: int = 10 ** 9):
+        self.checks = 0
+        self.connected_for = connected_for
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.checks > self.connected_for
+
+
+def _parse_sse(chunks):
+    events = []
+    for chunk in chunks:
+        event, data = chunk.strip().split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+@pytest.fixture
+def api(monkeypatch):
+    import main
+
+    async def candidates(req, search_kwargs):
+        return [2, 0, 1], [0.9, 0.8, 0.7]
+
+    monkeypatch.setattr(main, "_check_ready", lambda: None)
+    monkeypatch.setattr(main, "_check_llm_ready", lambda: None)
+    monkeypatch.setattr(main, "_rag_candidates", candidates)
+    return main
+
+
+def _use_pool(api, monkeypatch, llm, **kwargs) -> LLMPool:
+    pool = LLMPool([llm], **kwargs)
+    rag = RAGService(StubRetriever(), llm_client=llm, llm_pool=pool)
+    monkeypatch.setattr(api, "rag_service", rag)
+    monkeypatch.setattr(api, "llm_pool", pool)
+    return pool
+
+
+def test_rag_stream_sends_candidates_tokens_and_answer(api, monkeypatch):
+    llm = _fast_llm()
+    pool = _use_pool(api, monkeypatch, llm)
+
+    async def run():
+        response = await api.rag_stream(SearchRequest(query="red sofa", rerank_m=3), StubRequest())
+        return response.media_type, [chunk async for chunk in response.body_iterator]
+
+    try:
+        media_type, chunks = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    events = _parse_sse(chunks)
+    names = [name for name, _ in events]
+    assert media_type == "text/event-stream"
+    assert names[0] == "candidates" and names[-1] == "answer" and set(names[1:-1]) == {"token"}
+    assert [c["product_id"] for c in events[0][1]["top_candidates"]] == [102, 100, 101]
+    assert "".join(data["text"] for name, data in events if name == "token") == llm._answer_text(
+        api.rag_service.build_context([2, 0, 1]))
+    assert events[-1][1]["best_product_id"] == 102
+
+
+def test_rag_stream_disconnect_cancels_the_generation(api, monkeypatch):
+    llm = RecordingFakeLLM(first_token_s=0.0, tokens_per_s=50.0, output_tokens=200)
+    pool = _use_pool(api, monkeypatch, llm)
+
+    async def run():
+        response = await api.rag_stream(SearchRequest(query="red sofa", rerank_m=3), StubRequest(connected_for=3))
+        chunks = [chunk async for chunk in response.body_iterator]
+        await _until(lambda: pool.stats()["idle"] == 1)
+        return chunks
+
+    try:
+        chunks = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert [name for name, _ in _parse_sse(chunks)] == ["candidates", "token", "token"]
+    assert llm.cancel_events[0].is_set() and llm.tokens < 20
+
+
+def test_rag_stream_returns_503_when_the_pool_is_saturated(api, monkeypatch):
+    client = BlockingClient()
+    pool = _use_pool(api, monkeypatch, client, max_queue=0)
+
+    async def run():
+        busy = asyncio.ensure_future(pool.generate("a", CONTEXT))
+        await _until(lambda: pool.stats()["idle"] == 0)
+        try:
+            with pytest.raises(HTTPException) as e:
+                await api.rag_stream(SearchRequest(query="red sofa"), StubRequest())
+            return e.value
+        finally:
+            client.release.set()
+            await busy
+
+    try:
+        error = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert error.status_code == 503
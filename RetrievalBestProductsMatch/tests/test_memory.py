@@ -0,0 +1,148 @@
+# tests/test_memory.py
+"""Parseo de /proc/<pid>/smaps_rollup (process_memory / group_memory) y supervisión de workers de PreforkServer."""
+import io
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+from app.utils import memory
+from app.utils.memory import child_pids, group_memory, process_memory
+from app.utils.prefork import MIN_UPTIME_S, PreforkServer
+
+SMAPS_ROLLUP = """\
+55d0c7a3e000-7ffd2b5f9000 ---p 00000000 00:00 0                          [rollup]
+Rss:              204800 kB
+Pss:              102400 kB
+Pss_Anon:          51200 kB
+Pss_File:          51200 kB
+Shared_Clean:     133120 kB
+Shared_Dirty:       4096 kB
+Private_Clean:     10240 kB
+Private_Dirty:     57344 kB
+Referenced:       204800 kB
+Anonymous:         61440 kB
+Swap:               1536 kB
+SwapPss:            1536 kB
+"""
+
+
+def _fake_proc(monkeypatch, files):
+    """Sustituye open() en app.utils.memory: las rutas de `files` devuelven su contenido, el resto no existe."""
+    def fake_open(path, *args, **kwargs):
+        if path not in files:
+            raise FileNotFoundError(path)
+        return io.StringIO(files[path])
+
+    monkeypatch.setattr(memory, "open", fake_open, raising=False)
+
+
+def test_process_memory_parses_smaps_rollup(monkeypatch):
+    _fake_proc(monkeypatch, {"/proc/1234/smaps_rollup": SMAPS_ROLLUP})
+    assert process_memory(1234) == {
+        "rss_mb": 200.0,
+        "pss_mb": 100.0,
+        "uss_mb": 66.0,      # Private_Clean + Private_Dirty
+        "shared_mb": 134.0,  # Shared_Clean + Shared_Dirty
+        "swap_mb": 1.5,
+    }
+
+
+def test_missing_fields_count_as_zero(monkeypatch):
+    _fake_proc(monkeypatch, {"/proc/1234/smaps_rollup": "Rss:  2048 kB\nPrivate_Dirty:  1024 kB\n"})
+    assert process_memory(1234) == {"rss_mb": 2.0, "pss_mb": 0.0, "uss_mb": 1.0, "shared_mb": 0.0, "swap_mb": 0.0}
+
+
+def test_without_smaps_rollup(monkeypatch):
+    _fake_proc(monkeypatch, {})
+    # el propio proceso cae a getrusage; otro pid propaga el error (group_memory lo salta)
+    assert set(process_memory()) == {"max_rss_mb"}
+    with pytest.raises(OSError):
+        process_memory(os.getpid() + 1)
+
+
+def test_group_memory_sums_parent_and_workers(monkeypatch):
+    _fake_proc(monkeypatch, {
+        "/proc/10/task/10/children": "11 12\n",
+        "/proc/10/task/13/children": "",
+        "/proc/10/smaps_rollup": SMAPS_ROLLUP,
+        "/proc/11/smaps_rollup": SMAPS_ROLLUP,
+        # el worker 12 terminó mientras se leía
+    })
+    monkeypatch.setattr(memory.os, "listdir", lambda path: ["10", "13"] if path == "/proc/10/task" else [])
+    report = group_memory(10)
+    assert [(p["pid"], p["role"]) for p in report["processes"]] == [(10, "parent"), (11, "worker")]
+    assert report["total"] == {"rss_mb": 400.0, "pss_mb": 200.0, "uss_mb": 132.0, "shared_mb": 268.0}
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="needs Linux /proc/<pid>/smaps_rollup")
+def test_real_process_and_children():
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        assert child.pid in child_pids(os.getpid())
+        report = group_memory()
+        roles = {p["pid"]: p["role"] for p in report["processes"]}
+        assert roles[os.getpid()] == "parent" and roles[child.pid] == "worker"
+        own = report["processes"][0]
+        assert 0 < own["pss_mb"] <= own["rss_mb"] and own["uss_mb"] <= own["rss_mb"]
+    finally:
+        child.kill()
+        child.wait()
+
+
+# ---------------------------------------------------------------- prefork
+
+class RecordingServer(PreforkServer):
+    """PreforkServer sin fork ni señales: registra los workers relanzados y las paradas."""
+    def __init__(self):
+        super().__init__(app=None, workers=2)
+        self.spawned = []
+        self.stops = 0
+
+    def _spawn(self, worker_id):
+        self.spawned.append(worker_id)
+
+    def _handle_stop(self, signum, frame):
+        self.stops += 1
+        self._stopping = True
+
+
+def test_worker_that_dies_later_is_restarted(monkeypatch):
+    server = RecordingServer()
+    server._children = {101: (1, 0.0)}
+    monkeypatch.setattr("app.utils.prefork.time.monotonic", lambda: MIN_UPTIME_S + 1.0)
+    server._reap(101, 1 << 8)  # exit code 1
+    assert server.spawned == [1] and server.stops == 0 and server._children == {}
+
+
+def test_worker_that_dies_on_startup_stops_the_server(monkeypatch):
+    server = RecordingServer()
+    server._children = {101: (0, 100.0)}
+    monkeypatch.setattr("app.utils.prefork.time.monotonic", lambda: 100.5)
+    server._reap(101, 1 << 8)
+    assert server.spawned == [] and server.stops == 1
+
+
+def test_no_restart_while_stopping():
+    server = RecordingServer()
+    server._children = {101: (0, 0.0)}
+    server._stopping = True
+    server._reap(101, 0)
+    server._reap(999, 0)  # pid desconocido
+    assert server.spawned == [] and server.stops == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="prefork needs os.fork")
+def test_supervise_reaps_forked_workers(monkeypatch):
+    server = PreforkServer(app=None, workers=2)
+    monkeypatch.setattr(server, "_run_worker", lambda worker_id: None)
+    server._stopping = True  # los workers salen en seguida: no se relanzan
+    for worker_id in range(2):
+        server._spawn(worker_id)
+    assert len(server._children) == 2
+    server._supervise()
+    assert server._children == {}
+    # sin workers vivos, una señal de parada no tiene a quién reenviarse
+    server._handle_stop(signal.SIGTERM, None)
@@ -0,0 +1,95 @@
+# tests/test_parity.py
+"""ranking_agreement / parity_report (PyTorch vs ONNX) con encoders y cross-encoders de prueba."""
+import numpy as np
+import pytest
+
+from app.models.onnx_backend import parity_report, ranking_agreement
+
+
+def test_identical_rankings_agree():
+    scores = [0.1, 0.9, 0.5, 0.3]
+    assert ranking_agreement(scores, np.asarray(scores) * 2 + 1, k=2) == {"top1": 1.0, "overlap@k": 1.0,
+                                                                           "spearman": pytest.approx(1.0)}
+
+
+def test_reversed_ranking():
+    result = ranking_agreement([4, 3, 2, 1], [1, 2, 3, 4], k=2)
+    assert result["top1"] == 0.0 and result["overlap@k"] == 0.0
+    assert result["spearman"] == pytest.approx(-1.0)
+
+
+def test_partial_overlap():
+    # top-3 de referencia {0, 1, 2}; el nuevo {0, 1, 3}
+    result = ranking_agreement([9, 8, 7, 6, 5], [9, 8, 1, 7, 5], k=3)
+    assert result["top1"] == 1.0 and result["overlap@k"] == pytest.approx(2 / 3)
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_short_candidate_lists_use_the_effective_k(n):
+    scores = np.arange(n, dtype=float)
+    result = ranking_agreement(scores, scores, k=10)
+    # misma clave que con k candidatos o más, y overlap sobre min(k, n): un ranking idéntico da 1.0
+    assert set(result) == {"top1", "overlap@k", "spearman"}
+    assert result["overlap@k"] == 1.0 and result["spearman"] == pytest.approx(1.0)
+
+
+class HashEncoder:
+    """Encoder de prueba: vector determinista por texto, más ruido opcional (el backend 'nuevo')."""
+    def __init__(self, noise: float = 0.0):
+        self.noise = noise
+
+    def encode(self, texts, batch_size=64):
+        out = []
+        for text in texts:
+            rng = np.random.default_rng(sum(map(ord, text)))
+            vec = rng.normal(size=8)
+            out.append(vec + self.noise * np.random.default_rng(len(text)).normal(size=8))
+        return np.asarray(out, dtype=np.float32)
+
+
+class LengthReranker:
+    """Cross-encoder de prueba: score = longitud del texto (+ un desplazamiento que cambia el orden)."""
+    def __init__(self, swap_first_two: bool = False):
+        self.swap_first_two = swap_first_two
+        self.batches = []
+
+    def predict(self, pairs, batch_size=64):
+        self.batches.append(len(pairs))
+        scores = np.array([len(text) for _, text in pairs], dtype=np.float32)
+        if self.swap_first_two:
+            top = np.argsort(-scores, kind="stable")[:2]
+            scores[top] = scores[top[::-1]]
+        return scores
+
+
+def _candidates(n):
+    return [f"product {'x' * i}" for i in range(n)]
+
+
+def test_parity_report_averages_queries_with_short_lists():
+    queries = ["red sofa", "oak table", "lamp"]
+    candidates = [_candidates(12), _candidates(3), _candidates(1)]
+    ref_reranker, new_reranker = LengthReranker(), LengthReranker()
+    report = parity_report(queries, candidates, HashEncoder(), HashEncoder(noise=0.01), ref_reranker, new_reranker,
+                           k=10)
+    assert report["num_queries"] == 3 and report["k"] == 10
+    assert 0.99 < report["embedding_cosine_min"] <= report["embedding_cosine_mean"] <= 1.0 + 1e-6
+    assert report["rerank"] == {"top1": 1.0, "overlap@k": 1.0, "spearman": pytest.approx(1.0)}
+    # la query con un único candidato no tiene ranking que comparar
+    assert ref_reranker.batches == [12, 3]
+
+
+def test_parity_report_detects_a_rank_swap():
+    queries = ["red sofa", "oak table"]
+    candidates = [_candidates(12), _candidates(3)]
+    report = parity_report(queries, candidates, HashEncoder(), HashEncoder(), LengthReranker(),
+                           LengthReranker(swap_first_two=True), k=2)
+    assert report["embedding_cosine_min"] == pytest.approx(1.0)
+    assert report["rerank"]["top1"] == 0.0 and report["rerank"]["overlap@k"] == 1.0
+    assert report["rerank"]["spearman"] < 1.0
+
+
+def test_parity_report_without_rankable_queries():
+    report = parity_report(["lamp"], [_candidates(1)], HashEncoder(), HashEncoder(), LengthReranker(),
+                           LengthReranker())
+    assert report["rerank"] == {}
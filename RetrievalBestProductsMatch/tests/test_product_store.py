@@ -0,0 +1,58 @@
+# tests/test_product_store.py
+"""ProductStoreWriter: el store se escribe en un directorio temporal y sólo sustituye al actual al completarse."""
+import os
+
+import pandas as pd
+import pytest
+
+from app.models.product_store import ProductStore, ProductStoreWriter
+from app.utils.index_builder import build_index_offline
+
+
+def _products(names):
+    return pd.DataFrame({
+        "product_id": [str(i) for i in range(len(names))],
+        "product_name": names,
+        "product_description": [f"description of {name}" for name in names],
+    })
+
+
+def _write(directory, *chunks):
+    writer = ProductStoreWriter(directory)
+    for chunk in chunks:
+        writer.append(chunk)
+    writer.close()
+    return writer
+
+
+def test_close_replaces_the_store(tmp_path):
+    directory = str(tmp_path / "product_store")
+    _write(directory, _products(["old sofa"]))
+    _write(directory, _products(["red sofa", "oak table"]), _products(["lamp"]))
+    store = ProductStore.load(directory)
+    assert len(store) == 3 and store.get(2)["product_name"] == "lamp"
+    assert os.listdir(tmp_path) == ["product_store"]
+
+
+def test_store_is_untouched_until_close(tmp_path):
+    directory = str(tmp_path / "product_store")
+    _write(directory, _products(["old sofa"]))
+    writer = ProductStoreWriter(directory)
+    writer.append(_products(["red sofa", "oak table"]))
+    # build en curso: quien cargue el store ve el anterior completo
+    assert len(ProductStore.load(directory)) == 1
+    writer.abort()
+    assert ProductStore.load(directory).get(0)["product_name"] == "old sofa"
+    assert os.listdir(tmp_path) == ["product_store"]
+
+
+def test_failed_build_keeps_the_previous_store(tmp_path):
+    directory = str(tmp_path / "product_store")
+    _write(directory, _products(["old sofa"]))
+    csv = tmp_path / "product.csv"
+    _products([]).to_csv(csv, sep="\t", index=False)
+    with pytest.raises(ValueError, match="No products"):
+        build_index_offline(str(csv), str(tmp_path / "faiss.index"), directory, str(tmp_path / "emb.npy"),
+                            str(tmp_path / "manifest.json"), "unused", {})
+    assert len(ProductStore.load(directory)) == 1
+    assert sorted(os.listdir(tmp_path)) == ["product.csv", "product_store"]
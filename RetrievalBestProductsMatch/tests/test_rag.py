@@ -0,0 +1,126 @@
+# tests/test_rag.py
+"""RAGService async (answer_async / stream_answer) con FakeLLMClient, un retriever de prueba y la answer cache."""
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from app.clients.fake_llm import FakeLLMClient
+from app.clients.llm_pool import LLMPool
+from app.models.product_store import ProductStore
+from app.models.rag import RAGService
+from app.utils.batching import QueueFullError
+from app.utils.cache import SemanticAnswerCache
+
+DIM = 4
+
+
+class StubRetriever:
+    """store + get_products + encode; anota el thread de cada encode y de cada get_products."""
+    def __init__(self, n: int = 6):
+        ids = [str(100 + i) for i in range(n)]
+        self.store = ProductStore.from_columns({
+            "product_id": ids,
+            "product_name": [f"name {pid}" for pid in ids],
+            "product_description": [f"description of {pid}" for pid in ids],
+            "rerank_text": [f"name {pid} - description of {pid}" for pid in ids],
+        })
+        self.encode_threads = []
+        self.get_products_threads = []
+
+    def encode(self, queries):
+        self.encode_threads.append(threading.current_thread())
+        return np.full((len(queries), DIM), 0.5, dtype=np.float32)
+
+    def get_products(self, idxs):
+        self.get_products_threads.append(threading.current_thread())
+        return self.store.get_many(idxs)
+
+    def get_product(self, idx):
+        return self.store.get(idx)
+
+
+class StubScheduler:
+    def __init__(self, full: bool = False):
+        self.queries = []
+        self.full = full
+
+    async def encode(self, query):
+        if self.full:
+            raise QueueFullError("encode queue is full")
+        self.queries.append(query)
+        return np.full(DIM, 0.5, dtype=np.float32)
+
+
+class CountingFakeLLM(FakeLLMClient):
+    def __init__(self):
+        super().__init__(first_token_s=0.0, tokens_per_s=0.0, output_tokens=0)
+        self.calls = 0
+
+    def stream_answer(self, *args, **kwargs):
+        self.calls += 1
+        return super().stream_answer(*args, **kwargs)
+
+
+async def _answer_twice(rag: RAGService):
+    rag.llm_pool = LLMPool([rag.llm], max_queue=4, timeout_s=5.0)
+    try:
+        first = await rag.answer_async("red sofa", [2, 0, 1], rerank_top=3)
+        second = await rag.answer_async("red sofa", [2, 0, 1], rerank_top=3)
+        return first, second
+    finally:
+        rag.llm_pool.shutdown()
+
+
+def _rag(**kwargs) -> RAGService:
+    return RAGService(StubRetriever(), llm_client=CountingFakeLLM(), answer_cache=SemanticAnswerCache(), **kwargs)
+
+
+def test_answer_key_embedding_goes_through_the_scheduler():
+    scheduler = StubScheduler()
+    rag = _rag(scheduler=scheduler)
+    first, second = asyncio.run(_answer_twice(rag))
+    assert first["best_product_id"] == 102 and second == first
+    assert rag.llm.calls == 1  # la segunda sale de la answer cache
+    assert scheduler.queries == ["red sofa", "red sofa"]
+    assert rag.retriever.encode_threads == []
+
+
+def test_answer_key_without_scheduler_encodes_off_the_event_loop():
+    rag = _rag()
+    loop_threads = []
+
+    async def run():
+        loop_threads.append(threading.current_thread())
+        return await _answer_twice(rag)
+
+    first, second = asyncio.run(run())
+    assert rag.llm.calls == 1 and second == first
+    assert rag.retriever.encode_threads and loop_threads[0] not in rag.retriever.encode_threads
+
+
+def test_full_scheduler_skips_the_answer_cache():
+    rag = _rag(scheduler=StubScheduler(full=True))
+    first, second = asyncio.run(_answer_twice(rag))
+    assert first["best_product_id"] == 102 and rag.llm.calls == 2
+    assert len(rag.answer_cache) == 0
+
+
+def test_context_is_built_off_the_event_loop():
+    rag = _rag(scheduler=StubScheduler())
+    rag.llm_pool = LLMPool([rag.llm], max_queue=4, timeout_s=5.0)
+
+    async def run():
+        loop_thread = threading.current_thread()
+        answer = await rag.answer_async("red sofa", [1, 3], rerank_top=2)
+        events = [event async for event, _ in rag.stream_answer("blue bed", [4, 5], rerank_top=2)]
+        return loop_thread, answer, events
+
+    try:
+        loop_thread, answer, events = asyncio.run(run())
+    finally:
+        rag.llm_pool.shutdown()
+    assert answer["best_product_id"] == 101 and events[0] == "candidates" and events[-1] == "answer"
+    assert len(rag.retriever.get_products_threads) == 2
+    assert loop_thread not in rag.retriever.get_products_threads
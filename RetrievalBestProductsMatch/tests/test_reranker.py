@@ -0,0 +1,89 @@
+# tests/test_reranker.py
+"""CascadeRanking: parada temprana sin cambiar el top_m y rerank_batch con cascada vs rerank completo."""
+import numpy as np
+import pytest
+
+from app.models.reranker import CascadeRanking, Reranker
+
+
+def run_cascade(cascade: CascadeRanking, full_scores: np.ndarray):
+    while True:
+        positions = cascade.next_batch()
+        if not positions:
+            return cascade
+        cascade.add(positions, full_scores[positions])
+
+
+def full_ranking(full_scores, candidates, top_m):
+    return Reranker.rank(full_scores, candidates, top_m)
+
+
+def test_stops_early_when_cheap_scores_predict_the_full_ones():
+    rng = np.random.default_rng(0)
+    cheap = rng.normal(size=200)
+    full = 3.0 * cheap + 1.0 + rng.uniform(-0.05, 0.05, size=200)
+    candidates = list(range(1000, 1200))
+    cascade = run_cascade(CascadeRanking(candidates, cheap, top_m=10, batch_size=8, margin=0.5), full)
+    assert cascade.done
+    assert cascade.pairs_scored < 200 / 2
+    assert cascade.result()[0] == full_ranking(full, candidates, 10)[0]
+
+
+def test_first_batch_is_top_m_plus_batch_in_cheap_order():
+    cheap = np.arange(30, dtype=float)
+    cascade = CascadeRanking(list(range(30)), cheap, top_m=5, batch_size=4)
+    assert cascade.next_batch() == list(range(29, 20, -1))
+
+
+def test_scores_everything_without_correlation():
+    rng = np.random.default_rng(1)
+    cheap = rng.normal(size=60)
+    full = -cheap  # pendiente negativa: la etapa barata no acota nada
+    cascade = run_cascade(CascadeRanking(list(range(60)), cheap, top_m=5, batch_size=8), full)
+    assert cascade.pairs_scored == 60
+    assert cascade.result()[0] == full_ranking(full, list(range(60)), 5)[0]
+
+
+def test_margin_controls_the_stop():
+    cheap = np.linspace(10, 0, 40)
+    full = 2.0 * cheap
+    eager = run_cascade(CascadeRanking(list(range(40)), cheap, top_m=3, batch_size=4, margin=0.0), full)
+    cautious = run_cascade(CascadeRanking(list(range(40)), cheap, top_m=3, batch_size=4, margin=np.inf), full)
+    assert eager.pairs_scored == 3 + 4 and cautious.pairs_scored == 40
+    assert eager.result() == cautious.result()
+
+
+@pytest.mark.parametrize("n, top_m", [(0, 5), (1, 5), (3, 10)])
+def test_small_candidate_lists(n, top_m):
+    cheap = np.arange(n, dtype=float)
+    cascade = run_cascade(CascadeRanking(list(range(n)), cheap, top_m=top_m), cheap * 2)
+    assert cascade.done and cascade.pairs_scored == n
+    assert cascade.result()[0] == list(range(n))[::-1]
+
+
+class CountingModel:
+    """Cross-encoder de prueba: score = nº de palabras de la query en el texto; cuenta los pares."""
+    def __init__(self):
+        self.pairs = 0
+
+    def predict(self, pairs, batch_size=32):
+        self.pairs += len(pairs)
+        return np.array([len(set(q.split()) & set(t.split())) for q, t in pairs], dtype=np.float32)
+
+
+def test_rerank_batch_with_cascade_matches_full_rerank():
+    queries = ["red sofa", "oak table wide"]
+    texts = [[f"{'red sofa' if i < 3 else 'blue chair'} {i}" for i in range(40)],
+             [f"{'oak table wide' if i in (0, 10, 20) else 'pine shelf'} {i}" for i in range(40)]]
+    indices = [list(range(40)), list(range(100, 140))]
+    # scores de retrieval correlados con la relevancia
+    cheap = [[3.0 if i < 3 else 0.1 - i / 1000 for i in range(40)],
+             [3.0 if i in (0, 10, 20) else 0.1 - i / 1000 for i in range(40)]]
+    full = Reranker("unused")
+    full.model = CountingModel()
+    cascade = Reranker("unused", cascade=True, cascade_batch_size=4, cascade_margin=0.5)
+    cascade.model = CountingModel()
+    expected = full.rerank_batch(queries, texts, indices, top_m=3, cheap_scores=cheap)
+    result = cascade.rerank_batch(queries, texts, indices, top_m=3, cheap_scores=cheap)
+    assert [ids for ids, _ in result] == [ids for ids, _ in expected]
+    assert cascade.model.pairs < full.model.pairs == 80
@@ -0,0 +1,104 @@
+# tests/test_search.py
+"""SearchService.search_batch y /search/batch: orden de los resultados, lista vacía, cache y MAX_BATCH_QUERIES."""
+import pytest
+from fastapi import HTTPException
+
+from app.models.search import SearchService
+from app.schemas import BatchSearchRequest
+from app.utils.cache import QueryCache
+
+N_PRODUCTS = 100
+
+
+class StubStore:
+    def rerank_texts(self, idxs):
+        return [f"product {i}" for i in idxs]
+
+
+class StubRetriever:
+    """Cada query recupera sus top_k filas a partir de len(query); registra los lotes que recibe."""
+    def __init__(self):
+        self.store = StubStore()
+        self.batches = []
+
+    def retrieve_batch(self, queries, top_k=50, **kwargs):
+        self.batches.append((list(queries), kwargs))
+        return [([(len(q) + j) % N_PRODUCTS for j in range(top_k)], [1.0 - j / top_k for j in range(top_k)])
+                for q in queries]
+
+    def get_products(self, idxs):
+        return [{"product_id": str(i)} for i in idxs]
+
+
+class ReversingReranker:
+    """Reranker de prueba: invierte el orden de retrieval y recorta a top_m."""
+    def __init__(self):
+        self.calls = 0
+
+    def rerank_batch(self, queries, texts, indices, top_m=10, cheap_scores=None):
+        self.calls += 1
+        return [(idxs[::-1][:top_m], [float(s) for s in range(top_m, 0, -1)][:len(idxs)]) for idxs in indices]
+
+
+def _ids(results):
+    return [[p["product_id"] for p in r] for r in results]
+
+
+def test_results_follow_the_query_order_in_one_batch():
+    retriever = StubRetriever()
+    service = SearchService(retriever, ReversingReranker())
+    queries = ["sofa", "red oak table", "lamp"]
+    results = service.search_batch(queries, top_k=5, rerank_m=3)
+    assert len(retriever.batches) == 1 and retriever.batches[0][0] == queries
+    assert _ids(results) == [[str(len(q) + j) for j in (4, 3, 2)] for q in queries]
+    assert _ids(results) == [_ids([service.search(q, top_k=5, rerank_m=3)])[0] for q in queries]
+
+
+def test_without_rerank_keeps_the_retrieval_order():
+    reranker = ReversingReranker()
+    results = SearchService(StubRetriever(), reranker).search_batch(["sofa"], top_k=5, rerank_m=2, use_rerank=False)
+    assert _ids(results) == [["4", "5"]] and reranker.calls == 0
+
+
+def test_empty_batch():
+    retriever = StubRetriever()
+    assert SearchService(retriever, ReversingReranker()).search_batch([]) == []
+    assert retriever.batches == []
+
+
+def test_cached_queries_are_not_recomputed():
+    retriever = StubRetriever()
+    service = SearchService(retriever, ReversingReranker(), cache=QueryCache())
+    first = service.search_batch(["lamp", "sofa"], top_k=5, rerank_m=3)
+    second = service.search_batch(["sofa", "red oak table", "lamp"], top_k=5, rerank_m=3)
+    assert [queries for queries, _ in retriever.batches] == [["lamp", "sofa"], ["red oak table"]]
+    assert second[0] == first[1] and second[2] == first[0]
+    # otras opciones de búsqueda son otra entrada de la cache
+    service.search_batch(["sofa"], top_k=5, rerank_m=3, nprobe=8)
+    assert retriever.batches[-1] == (["sofa"], {"nprobe": 8})
+
+
+@pytest.fixture
+def api(monkeypatch):
+    import main
+    service = SearchService(StubRetriever(), ReversingReranker())
+    monkeypatch.setattr(main, "search_service", service)
+    monkeypatch.setattr(main, "_check_ready", lambda: None)
+    return main
+
+
+def test_batch_endpoint_returns_results_per_query(api):
+    response = api.search_batch(BatchSearchRequest(queries=["sofa", "lamp"], top_k=5, rerank_m=2))
+    assert [r["query"] for r in response["results"]] == ["sofa", "lamp"]
+    assert [[p["product_id"] for p in r["results"]] for r in response["results"]] == [["8", "7"], ["8", "7"]]
+
+
+def test_batch_endpoint_rejects_empty_and_oversized_batches(api, monkeypatch):
+    with pytest.raises(HTTPException) as e:
+        api.search_batch(BatchSearchRequest(queries=[]))
+    assert e.value.status_code == 400
+    monkeypatch.setattr(api.settings, "MAX_BATCH_QUERIES", 2)
+    api.search_batch(BatchSearchRequest(queries=["a", "b"]))
+    with pytest.raises(HTTPException) as e:
+        api.search_batch(BatchSearchRequest(queries=["a", "b", "c"]))
+    assert e.value.status_code == 400 and "at most 2" in e.value.detail